@@ -0,0 +1,50 @@
+"""Micro-benchmark of the date extraction used to name every document.
+
+Compares the streaming fast path of ``extrair_ano_mes`` with the full tree
+search it replaced, over a corpus of real-sized NFS-e and event XMLs::
+
+    python benchmarks/bench_extrair_ano_mes.py --docs 2000
+"""
+from __future__ import annotations
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from benchmarks.corpus import gerar
+from nfse import datas
+
+
+def _medir(func, docs: list[bytes], repeticoes: int) -> float:
+    melhor = float("inf")
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        for xml in docs:
+            func(xml)
+        melhor = min(melhor, time.perf_counter() - inicio)
+    return melhor
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--docs", type=int, default=2000)
+    parser.add_argument("--repeticoes", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    docs = [xml for _chave, xml in gerar(args.docs)]
+    for xml in docs:
+        assert datas.extrair_ano_mes(xml) == datas.ano_mes_arvore(xml)
+    tamanho = sum(map(len, docs)) / len(docs)
+    rapido = _medir(datas.extrair_ano_mes, docs, args.repeticoes)
+    arvore = _medir(datas.ano_mes_arvore, docs, args.repeticoes)
+    print(f"{len(docs)} documentos, {tamanho / 1024:.1f} KiB em média")
+    print(f"streaming:     {rapido / len(docs) * 1e6:8.1f} us/doc")
+    print(f"árvore (XML):  {arvore / len(docs) * 1e6:8.1f} us/doc")
+    print(f"ganho:         {arvore / rapido:8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
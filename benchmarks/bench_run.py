@@ -0,0 +1,140 @@
+"""End-to-end benchmark of ``NFSeDownloader.run`` against the mock portal.
+
+Downloads the whole mock corpus into a temporary directory and reports
+documents/s, bytes/s, peak RSS (not on Windows) and the per-stage times
+the engine logs. No certificate or network access is needed::
+
+    python benchmarks/bench_run.py --docs 2000 --pagina 50 --latencia 0.05
+    python benchmarks/bench_run.py --engine asyncio --pdf
+"""
+from __future__ import annotations
+
+import argparse
+import ssl
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Optional
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from benchmarks.mock_portal import MockPortal
+from nfse.config import Config
+from nfse.credentials import Credencial
+
+RESUMOS = ("Estágio", "PDFs:", "Conexões:")
+
+
+def _pico_rss_mib() -> Optional[float]:
+    """Return the peak RSS in MiB, or ``None`` where it cannot be read."""
+    if resource is None:
+        return None
+    # ru_maxrss is KiB on Linux and bytes on macOS.
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return pico / (1024 * 1024) if sys.platform == "darwin" else pico / 1024
+
+
+def _executar(cfg: Config):
+    """Run the engine selected by ``cfg`` over plain HTTP, no certificate."""
+    if cfg.engine == "asyncio":
+        from nfse.async_downloader import AsyncNFSeDownloader, _aiohttp
+
+        class Downloader(AsyncNFSeDownloader):
+            def credencial(self) -> Credencial:
+                return Credencial(ssl.create_default_context(), 0.0)
+
+        dl = Downloader(cfg, session_factory=lambda ctx: _aiohttp().ClientSession())
+        return dl, lambda write: dl.run(write=write)
+
+    from nfse import transport
+    from nfse.downloader import NFSeDownloader
+
+    dl = NFSeDownloader(cfg)
+
+    def executar(write):
+        sess = transport.criar_sessao(ssl.create_default_context(), cfg, dl.metricas)
+        try:
+            return dl.run(write=write, session=sess)
+        finally:
+            sess.close()
+            write(sess.transporte.resumo(), log=True)
+
+    return dl, executar
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--docs", type=int, default=1000)
+    parser.add_argument("--pagina", type=int, default=50)
+    parser.add_argument("--latencia", type=float, default=0.0, help="segundos por resposta")
+    parser.add_argument("--taxa-erro", type=float, default=0.0, help="fração de respostas 503")
+    parser.add_argument("--taxa-429", type=float, default=0.0, help="fração de respostas 429")
+    parser.add_argument("--pdf", action="store_true", help="baixa também os PDFs")
+    parser.add_argument("--engine", choices=("threads", "asyncio"), default="threads")
+    parser.add_argument("--decode-workers", type=int, default=2)
+    parser.add_argument("--decode-processes", type=int, default=0)
+    parser.add_argument("--pdf-workers", type=int, default=4)
+    parser.add_argument("--output-format", default="xml")
+    parser.add_argument("--prefetch", type=int, default=0, help="páginas lidas antecipadamente")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp, MockPortal(
+        args.docs, args.pagina, args.latencia, args.taxa_erro, args.taxa_429
+    ) as portal:
+        cfg = Config(
+            cnpj="00000000000000",
+            output_dir=str(Path(tmp) / "xml"),
+            log_dir=str(Path(tmp) / "logs"),
+            state_db=str(Path(tmp) / "state.db"),
+            output_format=args.output_format,
+            download_pdf=args.pdf,
+            delay_seconds=0,
+            retry_backoff_seconds=0.01,
+            max_retries=20,
+            engine=args.engine,
+            decode_workers=args.decode_workers,
+            decode_processes=args.decode_processes,
+            pdf_workers=args.pdf_workers,
+            prefetch_depth=args.prefetch,
+            dfe_url=portal.dfe_url,
+            danfse_url=portal.danfse_url,
+        )
+        resumos: list[str] = []
+
+        def write(msg: str, log: bool = True) -> None:
+            if msg.startswith(RESUMOS):
+                resumos.append(msg)
+
+        dl, executar = _executar(cfg)
+        inicio = time.perf_counter()
+        try:
+            resumo = executar(write)
+        finally:
+            dl.close()
+        segundos = time.perf_counter() - inicio
+
+    print(
+        f"motor {args.engine}: {resumo.documentos} documentos em {segundos:.2f}s "
+        f"({args.pagina} por página, latência {args.latencia * 1000:.0f} ms)"
+    )
+    print(f"vazão:      {resumo.documentos / segundos:10.1f} docs/s")
+    print(f"bytes:      {resumo.bytes / segundos / 2**20:10.2f} MiB/s gravados")
+    pico = _pico_rss_mib()
+    if pico is not None:
+        print(f"RSS máximo: {pico:10.1f} MiB")
+    print(
+        f"portal:     {portal.stats.paginas} páginas, {portal.stats.pdfs} PDFs, "
+        f"{portal.stats.erros} erros 503, {portal.stats.throttled} respostas 429"
+    )
+    for linha in resumos:
+        print(linha)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""Synthetic NFS-e and event XMLs shaped like the ones served by the ADN.
+
+Documents carry the same structure, namespaces and approximate size as real
+notes (DPS with a long service description plus two XML signatures), so
+parsing and compression costs are representative.
+"""
+from __future__ import annotations
+
+import base64
+import random
+from typing import Iterator
+
+NS = "http://www.sped.fazenda.gov.br/nfse"
+
+
+def _assinatura(rng: random.Random, ref: str) -> str:
+    cert = base64.b64encode(rng.randbytes(1400)).decode()
+    valor = base64.b64encode(rng.randbytes(256)).decode()
+    digest = base64.b64encode(rng.randbytes(20)).decode()
+    return (
+        '<Signature xmlns="http://www.w3.org/2000/09/xmldsig#"><SignedInfo>'
+        '<CanonicalizationMethod Algorithm="http://www.w3.org/TR/2001/REC-xml-c14n-20010315"/>'
+        '<SignatureMethod Algorithm="http://www.w3.org/2001/04/xmldsig-more#rsa-sha256"/>'
+        f'<Reference URI="#{ref}"><Transforms>'
+        '<Transform Algorithm="http://www.w3.org/2000/09/xmldsig#enveloped-signature"/>'
+        '<Transform Algorithm="http://www.w3.org/TR/2001/REC-xml-c14n-20010315"/>'
+        '</Transforms><DigestMethod Algorithm="http://www.w3.org/2001/04/xmlenc#sha256"/>'
+        f"<DigestValue>{digest}</DigestValue></Reference></SignedInfo>"
+        f"<SignatureValue>{valor}</SignatureValue>"
+        f"<KeyInfo><X509Data><X509Certificate>{cert}</X509Certificate></X509Data></KeyInfo>"
+        "</Signature>"
+    )
+
+
+def _cnpj(rng: random.Random) -> str:
+    return "".join(str(rng.randrange(10)) for _ in range(14))
+
+
+def chave_acesso(rng: random.Random) -> str:
+    """Return a random 50-digit access key."""
+    return "".join(str(rng.randrange(10)) for _ in range(50))
+
+
+def nfse_xml(
+    rng: random.Random,
+    chave: str,
+    ano: int = 2025,
+    mes: int = 6,
+    prestador: str = "",
+    tomador: str = "",
+) -> bytes:
+    """Return one NFS-e document emitted in ``ano``/``mes``."""
+    prestador = prestador or _cnpj(rng)
+    tomador = tomador or _cnpj(rng)
+    dia = rng.randrange(1, 28)
+    valor = rng.randrange(10000, 10000000) / 100
+    liquido = round(valor * 0.95, 2)
+    descricao = " ".join(
+        rng.choice(["servico", "consultoria", "manutencao", "licenca", "suporte", "mensal"])
+        for _ in range(rng.randrange(40, 160))
+    )
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        f'<NFSe versao="1.00" xmlns="{NS}"><infNFSe Id="NFS{chave}">'
+        "<xLocEmi>Sao Paulo</xLocEmi><xLocPrestacao>Sao Paulo</xLocPrestacao>"
+        f"<nNFSe>{rng.randrange(1, 99999)}</nNFSe><cLocIncid>3550308</cLocIncid>"
+        "<xLocIncid>Sao Paulo</xLocIncid><xTribNac>Analise e desenvolvimento de sistemas.</xTribNac>"
+        "<verAplic>SefinNac_Pre_1.0</verAplic><ambGer>2</ambGer><tpEmis>1</tpEmis>"
+        f"<procEmi>1</procEmi><cStat>100</cStat><dhProc>{ano}-{mes:02d}-{dia:02d}T10:49:10-03:00</dhProc>"
+        f"<nDFSe>{rng.randrange(1, 999999)}</nDFSe>"
+        f"<emit><CNPJ>{prestador}</CNPJ><xNome>PRESTADOR DE SERVICOS LTDA</xNome>"
+        "<enderNac><xLgr>RUA DAS FLORES</xLgr><nro>100</nro><xBairro>CENTRO</xBairro>"
+        "<cMun>3550308</cMun><UF>SP</UF><CEP>01001000</CEP></enderNac></emit>"
+        f"<valores><vBC>{valor:.2f}</vBC><pAliqAplic>2.00</pAliqAplic>"
+        f"<vISSQN>{valor * 0.02:.2f}</vISSQN><vTotalRet>0.00</vTotalRet><vLiq>{liquido:.2f}</vLiq></valores>"
+        f'<DPS versao="1.00"><infDPS Id="DPS{chave[:45]}">'
+        f"<tpAmb>1</tpAmb><dhEmi>{ano}-{mes:02d}-{dia:02d}T10:49:08-03:00</dhEmi>"
+        "<verAplic>ERP 1.0</verAplic><serie>900</serie>"
+        f"<nDPS>{rng.randrange(1, 99999)}</nDPS><dCompet>{ano}-{mes:02d}-{dia:02d}</dCompet>"
+        "<tpEmit>1</tpEmit><cLocEmi>3550308</cLocEmi>"
+        f"<prest><CNPJ>{prestador}</CNPJ><regTrib><opSimpNac>1</opSimpNac><regEspTrib>0</regEspTrib></regTrib></prest>"
+        f"<toma><CNPJ>{tomador}</CNPJ><xNome>TOMADOR DO SERVICO S.A.</xNome>"
+        "<end><endNac><cMun>3304557</cMun><CEP>20010000</CEP></endNac><xLgr>AVENIDA CENTRAL</xLgr>"
+        "<nro>200</nro><xBairro>CENTRO</xBairro></end></toma>"
+        "<serv><locPrest><cLocPrestacao>3550308</cLocPrestacao></locPrest>"
+        f"<cServ><cTribNac>010101</cTribNac><xDescServ>{descricao}</xDescServ></cServ></serv>"
+        f"<valores><vServPrest><vServ>{valor:.2f}</vServ></vServPrest>"
+        "<trib><tribMun><tribISSQN>1</tribISSQN></tribMun></trib></valores>"
+        "</infDPS>"
+        f"{_assinatura(rng, 'DPS' + chave[:45])}</DPS></infNFSe>"
+        f"{_assinatura(rng, 'NFS' + chave)}</NFSe>"
+    ).encode()
+
+
+def evento_xml(rng: random.Random, chave: str, ano: int = 2025, mes: int = 7) -> bytes:
+    """Return one cancellation event for the note ``chave``."""
+    dia = rng.randrange(1, 28)
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        f'<evento versao="1.00" xmlns="{NS}"><infEvento Id="EVT{chave}10110101">'
+        "<verAplic>SefinNac_1.0</verAplic><ambGer>2</ambGer><nSeqEvento>1</nSeqEvento>"
+        f"<dhProc>{ano}-{mes:02d}-{dia:02d}T08:00:05-03:00</dhProc><nDFe>{rng.randrange(1, 999999)}</nDFe>"
+        f'<pedRegEvento versao="1.00"><infPedReg Id="PRE{chave}101101">'
+        f"<tpAmb>1</tpAmb><verAplic>ERP 1.0</verAplic><dhEvento>{ano}-{mes:02d}-{dia:02d}T08:00:00-03:00</dhEvento>"
+        f"<CNPJAutor>{_cnpj(rng)}</CNPJAutor><chNFSe>{chave}</chNFSe><nPedRegEvento>1</nPedRegEvento>"
+        "<e101101><xDesc>Cancelamento de NFS-e</xDesc><cMotivo>1</cMotivo>"
+        "<xMotivo>Erro na emissao da nota fiscal de servico</xMotivo></e101101></infPedReg>"
+        f"{_assinatura(rng, 'PRE' + chave + '101101')}</pedRegEvento></infEvento>"
+        f"{_assinatura(rng, 'EVT' + chave + '10110101')}</evento>"
+    ).encode()
+
+
+def gerar(n: int, seed: int = 0, eventos: float = 0.1) -> Iterator[tuple[str, bytes]]:
+    """Yield ``n`` ``(chave, xml)`` pairs, a fraction of them events."""
+    rng = random.Random(seed)
+    for _ in range(n):
+        chave = chave_acesso(rng)
+        ano = rng.choice([2023, 2024, 2025])
+        mes = rng.randrange(1, 13)
+        if rng.random() < eventos:
+            yield chave, evento_xml(rng, chave, ano, mes)
+        else:
+            yield chave, nfse_xml(rng, chave, ano, mes)
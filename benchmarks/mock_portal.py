@@ -0,0 +1,214 @@
+"""Local stand-in for the ADN distribution API and the DANFSe service.
+
+Serves ``/contribuintes/DFe/<nsu>?cnpj=...`` pages and
+``/sefinnacional/danfse/<chave>`` PDFs over plain HTTP on localhost, with
+configurable page size, latency, error and throttling rates. Payloads are
+built from :mod:`benchmarks.corpus`, gzip compressed and base64 encoded
+like the real portal. Run it standalone to point a manual run at it::
+
+    python benchmarks/mock_portal.py --docs 5000 --porta 8080
+"""
+from __future__ import annotations
+
+import argparse
+import base64
+import bisect
+import gzip
+import json
+import random
+import sys
+import threading
+import time
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import urlsplit
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from benchmarks.corpus import gerar
+
+DFE_PATH = "/contribuintes/DFe/"
+DANFSE_PATH = "/sefinnacional/danfse/"
+
+
+@dataclass
+class PortalStats:
+    """Requests served by the mock, by kind and status."""
+
+    paginas: int = 0
+    pdfs: int = 0
+    erros: int = 0
+    throttled: int = 0
+    bytes: int = 0
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def contar(self, campo: str, nbytes: int = 0) -> None:
+        with self._lock:
+            setattr(self, campo, getattr(self, campo) + 1)
+            self.bytes += nbytes
+
+
+class MockPortal:
+    """Threaded HTTP server answering like ``adn``/``sefin.nfse.gov.br``.
+
+    ``taxa_erro`` and ``taxa_429`` are the probabilities of answering 503
+    or 429 (with ``Retry-After``) instead of the real content. ``latencia``
+    is added to every response. Use as a context manager; the URLs to put
+    in ``Config.dfe_url``/``Config.danfse_url`` are :attr:`dfe_url` and
+    :attr:`danfse_url`.
+    """
+
+    def __init__(
+        self,
+        docs: int = 1000,
+        pagina: int = 50,
+        latencia: float = 0.0,
+        taxa_erro: float = 0.0,
+        taxa_429: float = 0.0,
+        retry_after: float = 0.0,
+        pdf_kib: int = 60,
+        seed: int = 0,
+        porta: int = 0,
+    ):
+        self.pagina = pagina
+        self.latencia = latencia
+        self.taxa_erro = taxa_erro
+        self.taxa_429 = taxa_429
+        self.retry_after = retry_after
+        self.stats = PortalStats()
+        self._rng = random.Random(seed)
+        self._rng_lock = threading.Lock()
+        self.documentos = [
+            {
+                "NSU": nsu,
+                "ChaveAcesso": chave,
+                "TipoDocumento": "NFSE",
+                "ArquivoXml": base64.b64encode(gzip.compress(xml)).decode(),
+            }
+            for nsu, (chave, xml) in enumerate(gerar(docs, seed), start=1)
+        ]
+        self._nsus = [d["NSU"] for d in self.documentos]
+        self.pdf = b"%PDF-1.4\n" + random.Random(seed).randbytes(pdf_kib * 1024)
+        self._server = ThreadingHTTPServer(("127.0.0.1", porta), self._handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, porta = self._server.server_address[:2]
+        return f"http://{host}:{porta}"
+
+    @property
+    def dfe_url(self) -> str:
+        return self.url + DFE_PATH.rstrip("/")
+
+    @property
+    def danfse_url(self) -> str:
+        return self.url + DANFSE_PATH.rstrip("/")
+
+    def __enter__(self) -> "MockPortal":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def _sortear(self) -> float:
+        with self._rng_lock:
+            return self._rng.random()
+
+    def pagina_apos(self, nsu: int) -> list[dict]:
+        """Return the documents after ``nsu`` that fit in one page."""
+        inicio = bisect.bisect_right(self._nsus, nsu)
+        return self.documentos[inicio : inicio + self.pagina]
+
+    def _handler(self) -> type[BaseHTTPRequestHandler]:
+        portal = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args) -> None:
+                pass
+
+            def _responder(self, status: int, corpo: bytes = b"", tipo: str = "", headers=()):
+                self.send_response(status)
+                if tipo:
+                    self.send_header("Content-Type", tipo)
+                for nome, valor in headers:
+                    self.send_header(nome, valor)
+                self.send_header("Content-Length", str(len(corpo)))
+                self.end_headers()
+                if corpo:
+                    self.wfile.write(corpo)
+
+            def do_GET(self) -> None:
+                if portal.latencia:
+                    time.sleep(portal.latencia)
+                sorteio = portal._sortear()
+                if sorteio < portal.taxa_429:
+                    portal.stats.contar("throttled")
+                    self._responder(429, b"Too Many Requests", "text/plain",
+                                    [("Retry-After", f"{portal.retry_after:g}")])
+                    return
+                if sorteio < portal.taxa_429 + portal.taxa_erro:
+                    portal.stats.contar("erros")
+                    self._responder(503, b"Service Unavailable", "text/plain")
+                    return
+                caminho = urlsplit(self.path).path
+                if caminho.startswith(DFE_PATH):
+                    self._dfe(caminho[len(DFE_PATH):])
+                elif caminho.startswith(DANFSE_PATH):
+                    portal.stats.contar("pdfs", len(portal.pdf))
+                    self._responder(200, portal.pdf, "application/pdf")
+                else:
+                    self._responder(404)
+
+            def _dfe(self, nsu: str) -> None:
+                try:
+                    documentos = portal.pagina_apos(int(nsu))
+                except ValueError:
+                    self._responder(400, b"NSU invalido", "text/plain")
+                    return
+                if not documentos:
+                    self._responder(204)
+                    return
+                corpo = json.dumps(
+                    {
+                        "StatusProcessamento": "DOCUMENTOS_LOCALIZADOS",
+                        "LoteDFe": documentos,
+                        "Alertas": None,
+                        "Erros": None,
+                    }
+                ).encode()
+                portal.stats.contar("paginas", len(corpo))
+                self._responder(200, corpo, "application/json")
+
+        return Handler
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--docs", type=int, default=1000)
+    parser.add_argument("--pagina", type=int, default=50)
+    parser.add_argument("--latencia", type=float, default=0.0)
+    parser.add_argument("--taxa-erro", type=float, default=0.0)
+    parser.add_argument("--taxa-429", type=float, default=0.0)
+    parser.add_argument("--porta", type=int, default=8080)
+    args = parser.parse_args(argv)
+    with MockPortal(
+        args.docs, args.pagina, args.latencia, args.taxa_erro, args.taxa_429, porta=args.porta
+    ) as portal:
+        print(f"dfe_url:    {portal.dfe_url}")
+        print(f"danfse_url: {portal.danfse_url}")
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    main()
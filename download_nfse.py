@@ -1,5 +1,6 @@
 import json
 import logging
+import multiprocessing
 import os
 import sys
 import tempfile
@@ -11,8 +12,10 @@ from tkinter.scrolledtext import ScrolledText
 
 from dataclasses import asdict
 
-from nfse.downloader import NFSeDownloader
+from nfse.downloader import criar_downloader
+from nfse.orchestrator import MultiCNPJOrchestrator
 from nfse.config import Config
+from nfse.log_sink import LogSink
 
 try:
     from version import __version__  # type: ignore
@@ -28,6 +31,10 @@ DEFAULT_CONFIG = asdict(Config())
 
 
 class App:
+    LOG_REFRESH_MS = 100  # drain the log sink at most 10 times per second
+    LOG_BATCH_LINES = 1000  # lines rendered per refresh
+    LOG_MAX_LINES = 5000  # scrollback kept in the text widget
+
     def __init__(self, root, config: Config):
         self.root = root
         self.config = config
@@ -50,7 +57,9 @@ class App:
         self.running = False
         self.thread = None
         self.user_stop = False
-        self.downloader = NFSeDownloader(config)
+        self.log_sink = LogSink(max_pendentes=self.LOG_MAX_LINES)
+        self.download_done = threading.Event()
+        self.downloader = criar_downloader(config)
 
         self.start_button = tk.Button(self.button_frame, text="Iniciar Download", command=self.start)
         self.start_button.pack(side=tk.LEFT, padx=5, pady=5)
@@ -69,18 +78,34 @@ class App:
         self.settings_win = None  # referencia para a janela de configuração
         self.about_win = None  # referencia para a janela Sobre
 
+        self.root.after(self.LOG_REFRESH_MS, self.drain_log)
         if self.config.auto_start:
             self.root.after(500, self.start)  # pequeno delay para interface carregar antes de iniciar
 
     def write(self, msg, log=True):
+        # Called from worker threads: only touch the sink, never Tk widgets
         now = datetime.datetime.now().strftime("%H:%M:%S")
-        msg_fmt = f"[{now}] {msg}\n"
-        self.text.insert(tk.END, msg_fmt)
-        self.text.see(tk.END)
-        self.status_label.config(text=msg)
+        self.log_sink.push(f"[{now}] {msg}\n", status=msg)
         if log:
             self.logger.info(msg)
 
+    def drain_log(self):
+        """Render pending log lines on the Tk thread and reschedule itself."""
+        lines = self.log_sink.drain(self.LOG_BATCH_LINES)
+        if lines:
+            self.text.insert(tk.END, "".join(lines))
+            # "end-1c" sits on the empty line after the trailing newline
+            excess = int(self.text.index("end-1c").split(".")[0]) - 1 - self.LOG_MAX_LINES
+            if excess > 0:
+                self.text.delete("1.0", f"{excess + 1}.0")
+            self.text.see(tk.END)
+            if self.log_sink.status is not None:
+                self.status_label.config(text=self.log_sink.status)
+        if self.download_done.is_set():
+            self.download_done.clear()
+            self.on_download_finished()
+        self.root.after(self.LOG_REFRESH_MS, self.drain_log)
+
     def start(self):
         if self.running:
             return
@@ -89,6 +114,7 @@ class App:
         self.start_button.config(state=tk.DISABLED)
         self.stop_button.config(state=tk.NORMAL)
         self.text.delete(1.0, tk.END)
+        self.log_sink.clear()
         self.status_label.config(text="Iniciando...")
         self.thread = threading.Thread(target=self.download_nfse)
         self.thread.daemon = True
@@ -172,7 +198,10 @@ class App:
             new_data["download_pdf"] = pdf_var.get()
             self.config = Config(**new_data)
             # Update the downloader instance so new settings take effect
-            self.downloader.config = self.config
+            if self.running:
+                self.downloader.config = self.config
+            else:
+                self.downloader = criar_downloader(self.config)
             self.config.save(CONFIG_FILE)
             messagebox.showinfo("Configurações", "Configurações salvas com sucesso!")
             on_close()
@@ -183,42 +212,45 @@ class App:
         win = tk.Toplevel(self.root)
         win.title("Editar NSU")
 
-        file_var = tk.StringVar(value=f"ultimo_nsu_{self.config.cnpj}.txt")
+        cnpj_var = tk.StringVar(value=self.config.cnpj)
         nsu_var = tk.StringVar(value=str(self.downloader.ler_ultimo_nsu(self.config.cnpj)))
 
-        tk.Label(win, text="Arquivo NSU").grid(row=0, column=0, sticky="w", padx=5, pady=2)
-        tk.Entry(win, textvariable=file_var, width=40).grid(row=0, column=1, padx=5, pady=2)
+        tk.Label(win, text="CNPJ").grid(row=0, column=0, sticky="w", padx=5, pady=2)
+        tk.Entry(win, textvariable=cnpj_var, width=40).grid(row=0, column=1, padx=5, pady=2)
 
-        def choose_file():
-            path = filedialog.askopenfilename(parent=win, filetypes=[("TXT", "*.txt"), ("All", "*.*")])
-            if path:
-                file_var.set(path)
-                if os.path.exists(path):
-                    try:
-                        with open(path, "r", encoding="utf-8") as f:
-                            nsu_var.set(str(int(f.read().strip())))
-                    except Exception:
-                        pass
+        def load_nsu():
+            cnpj = cnpj_var.get().strip()
+            if cnpj:
+                nsu_var.set(str(self.downloader.ler_ultimo_nsu(cnpj)))
 
-        tk.Button(win, text="...", command=choose_file).grid(row=0, column=2, padx=2, pady=2)
+        tk.Button(win, text="Ler", command=load_nsu).grid(row=0, column=2, padx=2, pady=2)
 
         tk.Label(win, text="NSU").grid(row=1, column=0, sticky="w", padx=5, pady=2)
-        tk.Entry(win, textvariable=nsu_var, width=20).grid(row=1, column=1, padx=5, pady=2)
+        tk.Entry(win, textvariable=nsu_var, width=20).grid(row=1, column=1, sticky="w", padx=5, pady=2)
+
+        def import_file():
+            # Legacy ultimo_nsu_<cnpj>.txt files can still be loaded by hand
+            path = filedialog.askopenfilename(parent=win, filetypes=[("TXT", "*.txt"), ("All", "*.*")])
+            if path and os.path.exists(path):
+                try:
+                    with open(path, "r", encoding="utf-8") as f:
+                        nsu_var.set(str(int(f.read().strip())))
+                except Exception:
+                    messagebox.showerror("Erro", "Arquivo NSU inválido")
+
+        tk.Button(win, text="Importar TXT", command=import_file).grid(row=1, column=2, padx=2, pady=2)
 
         def save():
+            cnpj = cnpj_var.get().strip()
             try:
                 nsu = int(nsu_var.get())
             except ValueError:
                 messagebox.showerror("Erro", "NSU inválido")
                 return
-            self.downloader.salvar_ultimo_nsu(nsu, self.config.cnpj)
-            # also save to chosen path if different
-            path = file_var.get()
-            try:
-                with open(path, "w", encoding="utf-8") as f:
-                    f.write(str(nsu))
-            except Exception:
-                pass
+            if not cnpj:
+                messagebox.showerror("Erro", "CNPJ inválido")
+                return
+            self.downloader.salvar_ultimo_nsu(nsu, cnpj)
             messagebox.showinfo("NSU", "NSU salvo com sucesso!")
             win.destroy()
 
@@ -260,17 +292,26 @@ class App:
 
     def download_nfse(self):
         try:
-            self.downloader.run(write=self.write, running=lambda: self.running)
-            self.status_label.config(text="Processo concluído")
+            if self.config.clients:
+                MultiCNPJOrchestrator(self.config).run(
+                    write=self.write, running=lambda: self.running
+                )
+            else:
+                self.downloader.run(write=self.write, running=lambda: self.running)
+            self.write("Processo concluído", log=False)
         except Exception as e:
             self.logger.error("Erro inesperado: %s", e)
             self.write(f"Erro inesperado: {e}", log=True)
         finally:
             self.running = False
-            self.start_button.config(state=tk.NORMAL)
-            self.stop_button.config(state=tk.DISABLED)
-            if self.config.auto_start and not self.user_stop:
-                self.root.after(1000, self.root.destroy)
+            # Widgets are updated by drain_log on the Tk thread
+            self.download_done.set()
+
+    def on_download_finished(self):
+        self.start_button.config(state=tk.NORMAL)
+        self.stop_button.config(state=tk.DISABLED)
+        if self.config.auto_start and not self.user_stop:
+            self.root.after(1000, self.root.destroy)
 
 REQUIRED_FIELDS = ["cert_path", "cert_pass", "cnpj", "output_dir", "log_dir"]
 
@@ -286,6 +327,8 @@ def salvar_config(cfg: Config | dict) -> None:
         Config(**cfg).save(CONFIG_FILE)
 
 if __name__ == "__main__":
+    # Needed by decode_processes in the PyInstaller executable.
+    multiprocessing.freeze_support()
     try:
         cfg = Config.load(CONFIG_FILE)
     except Exception as e:
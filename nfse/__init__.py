@@ -1,5 +1,28 @@
-from .downloader import NFSeDownloader
-from .pdf_downloader import NFSePDFDownloader
-from .config import Config
+from importlib import import_module
 
-__all__ = ["NFSeDownloader", "NFSePDFDownloader", "Config"]
+# Submodules are imported on first access so that ``import nfse`` (and the
+# CLI) does not pull in requests, cryptography or aiohttp up front.
+_EXPORTS = {
+    "NFSeDownloader": ".downloader",
+    "criar_downloader": ".downloader",
+    "AsyncNFSeDownloader": ".async_downloader",
+    "MultiCNPJOrchestrator": ".orchestrator",
+    "Backfill": ".backfill",
+    "NFSePDFDownloader": ".pdf_downloader",
+    "Config": ".config",
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name: str):
+    modulo = _EXPORTS.get(name)
+    if modulo is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    valor = getattr(import_module(modulo, __name__), name)
+    globals()[name] = valor
+    return valor
+
+
+def __dir__() -> list[str]:
+    return sorted(set(globals()) | set(__all__))
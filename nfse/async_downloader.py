@@ -0,0 +1,443 @@
+from __future__ import annotations
+
+import asyncio
+import gzip
+import os
+import ssl
+import time
+from concurrent.futures import Executor, ThreadPoolExecutor
+from contextlib import aclosing, suppress
+from typing import Any, AsyncIterator, Callable, Optional
+
+from . import decodificacao
+from .config import Config
+from .diario import NIVEL_COMPRESSAO
+from .lote import CHUNK_SIZE, LeitorLote
+from .downloader import NFSeDownloader
+from .pdf_downloader import NFSePDFDownloader, PDFStats
+from .pacing import PacingController, parse_retry_after
+from .pipeline import FIM, Documento, NSUCheckpoint, NSUVistos, RunSummary
+from .state import RegistroDocumento, StateStore
+
+
+def _aiohttp():
+    """Import ``aiohttp`` on demand; it is only needed by this engine."""
+    try:
+        import aiohttp
+    except ImportError as e:
+        raise RuntimeError(
+            "O motor asyncio requer o pacote aiohttp (pip install aiohttp)."
+        ) from e
+    return aiohttp
+
+
+def _erros_rede() -> tuple[type[BaseException], ...]:
+    """Return the exception types treated as connection errors."""
+    try:
+        import aiohttp
+    except ImportError:
+        return (OSError, asyncio.TimeoutError)
+    return (aiohttp.ClientError, asyncio.TimeoutError)
+
+
+def criar_sessao_async(ctx: ssl.SSLContext, config: Config):
+    """Return an ``aiohttp.ClientSession`` authenticated by ``ctx``."""
+    aiohttp = _aiohttp()
+    return aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(ssl=ctx),
+        timeout=aiohttp.ClientTimeout(total=int(config.timeout)),
+    )
+
+
+class AsyncNFSeDownloader(NFSeDownloader):
+    """Event-loop engine that keeps many portal requests in flight.
+
+    Pages are parsed with :class:`LeitorLote` as they stream in, decoded
+    on ``decode_workers`` threads (or ``decode_processes`` processes) and
+    written in NSU order on one worker thread. ``prefetch_depth`` and
+    :attr:`limite` behave as in the threaded engine.
+    """
+
+    def __init__(
+        self,
+        config: Config,
+        state: Optional[StateStore] = None,
+        session_factory: Optional[Callable[[ssl.SSLContext], Any]] = None,
+    ):
+        super().__init__(config, state)
+        self.session_factory = session_factory or self._criar_sessao
+
+    def _criar_sessao(self, ctx: ssl.SSLContext):
+        return criar_sessao_async(ctx, self.config)
+
+    def run(
+        self,
+        write: Callable[[str, bool], None] = lambda msg, log=True: None,
+        running: Callable[[], bool] = lambda: True,
+        session=None,
+    ) -> RunSummary:
+        """Blocking wrapper around :meth:`run_async`."""
+        return asyncio.run(self.run_async(write, running, session))
+
+    async def run_async(
+        self,
+        write: Callable[[str, bool], None] = lambda msg, log=True: None,
+        running: Callable[[], bool] = lambda: True,
+        session=None,
+    ) -> RunSummary:
+        """Download NFS-e documents until ``running`` returns ``False``.
+
+        ``session`` lets callers share an open ``aiohttp`` session; it is
+        left open when the run finishes.
+        """
+        cfg = self.config
+        inicio = time.perf_counter()
+        antes = self.metricas.amostras()
+        cnpj = cfg.cnpj
+        pacer = self.pacer or PacingController.from_config(cfg)
+
+        self._preparar_execucao(write)
+        propria = session is None
+        if propria:
+            cred = await asyncio.to_thread(self.credencial)
+            self._informar_credencial(cred, write)
+            session = self.session_factory(cred.contexto)
+
+        processos = max(0, int(cfg.decode_processes))
+        pool = self.processos
+        if processos and pool is None:
+            pool = decodificacao.criar_pool(processos)
+        decodificadores = ThreadPoolExecutor(
+            processos or max(1, int(cfg.decode_workers)), thread_name_prefix="nfse-decod"
+        )
+        pdf_stats = PDFStats()
+        pdf_slots = asyncio.Semaphore(max(1, int(cfg.pdf_workers)))
+        pdf_tasks: set[asyncio.Task] = set()
+        total_baixados = 0
+        total_bytes = 0
+        try:
+            nsu = await asyncio.to_thread(self.ler_ultimo_nsu, cnpj)
+            checkpoint = NSUCheckpoint(nsu)
+            vistos = NSUVistos(nsu)
+            registros: list[RegistroDocumento] = []
+            paginas = self._paginas(session, nsu, pacer, write, running)
+            profundidade = max(0, int(cfg.prefetch_depth))
+            if profundidade:
+                paginas = self._paginas_antecipadas(paginas, profundidade)
+            async with aclosing(paginas):
+                async for nsu_pagina, documentos, nsu_maior, corpo in paginas:
+                    novos = []
+                    for nfse in sorted(documentos, key=lambda d: int(d["NSU"])):
+                        nsu_item = int(nfse["NSU"])
+                        if not self._fora_do_limite(nsu_item) and vistos.adicionar(nsu_item):
+                            checkpoint.registrar(nsu_item)
+                            novos.append(nfse)
+                    docs = await self._decodificar_pagina(novos, pool, decodificadores)
+                    gravados = await asyncio.to_thread(
+                        self._gravar_pagina, docs, checkpoint, write, running
+                    )
+                    for doc, registro in gravados:
+                        registros.append(registro)
+                        total_baixados += 1
+                        total_bytes += doc.tamanho
+                        if not cfg.download_pdf:
+                            continue
+                        # Queued with the page; when stopped, left to the retry queue.
+                        self._abrir_pdf(registro, self._caminho_pdf(doc))
+                        if running():
+                            await pdf_slots.acquire()
+                            task = asyncio.create_task(
+                                self._baixar_pdf(session, doc, pdf_slots, pdf_stats, write)
+                            )
+                            pdf_tasks.add(task)
+                            task.add_done_callback(pdf_tasks.discard)
+                    if len(gravados) < len(docs):
+                        break
+                    if self.diario is not None:
+                        corpo = gzip.compress(corpo, NIVEL_COMPRESSAO)
+                        await asyncio.to_thread(
+                            self.diario.registrar, nsu_pagina, nsu_maior, corpo
+                        )
+                    checkpoint.avancar(nsu_maior + 1)
+                    vistos.avancar(nsu_maior)
+                    await asyncio.to_thread(self._concluir_lote, checkpoint.valor, registros)
+                    registros = []
+            await asyncio.to_thread(self._concluir_lote, max(1, checkpoint.valor), registros)
+            if pdf_tasks:
+                await asyncio.gather(*pdf_tasks)
+            if cfg.download_pdf:
+                write(pdf_stats.resumo(), log=True)
+        finally:
+            decodificadores.shutdown()
+            if pool is not None and pool is not self.processos:
+                pool.shutdown()
+            if propria:
+                await session.close()
+            await asyncio.to_thread(self._fechar_armazenamento)
+        if cfg.export_format:
+            await asyncio.to_thread(self._exportar, write, running)
+
+        resumo = RunSummary(
+            cnpj,
+            total_baixados,
+            total_bytes,
+            time.perf_counter() - inicio,
+            metricas=await asyncio.to_thread(self._salvar_metricas, antes, write),
+        )
+        write(f"Processo concluído. Total baixados: {total_baixados}", log=True)
+        return resumo
+
+    async def _paginas(
+        self,
+        session,
+        nsu: int,
+        pacer: PacingController,
+        write: Callable[[str, bool], None],
+        running: Callable[[], bool],
+    ) -> AsyncIterator[tuple[int, list[dict], int, bytes]]:
+        """Yield ``(nsu, documentos, maior NSU, corpo)`` for each page from ``nsu``.
+
+        Ends on a 204, an error, a stop or past :attr:`limite`.
+        """
+        cfg = self.config
+        cnpj = cfg.cnpj
+        while not self._fora_do_limite(nsu) and await self._aguardar(pacer, running):
+            query_nsu = max(0, nsu - 1)
+            url = f"{cfg.dfe_url}/{query_nsu:020d}?cnpj={cnpj}"
+            write(
+                f"Consultando NSU {nsu} (consulta {query_nsu}) para CNPJ {cnpj}...",
+                log=True,
+            )
+            resultado = await self._consultar_async(session, url, pacer, write, running)
+            if resultado is None:
+                return
+            status, campos, documentos, texto, corpo = resultado
+            if status == 200:
+                if not self._lote_localizado(campos) or not documentos:
+                    self.logger.error("Resposta inesperada ou nenhum documento localizado.")
+                    write("Resposta inesperada ou nenhum documento localizado.", log=True)
+                    return
+                self.metricas.paginas.inc()
+                nsu_maior = max([nsu] + [int(d["NSU"]) for d in documentos])
+                yield nsu, documentos, nsu_maior, corpo
+                nsu = nsu_maior + 1
+                write(f"Aguardando {pacer.intervalo:.1f} segundos para o próximo lote...", log=True)
+            elif status == 204:
+                write("Nenhuma nota encontrada. Fim da consulta.", log=True)
+                return
+            else:
+                self.logger.error("Erro: %s %s", status, texto)
+                write(f"Erro: {status} {texto}", log=True)
+                return
+
+    @staticmethod
+    async def _paginas_antecipadas(
+        paginas: AsyncIterator, profundidade: int
+    ) -> AsyncIterator[tuple[int, list[dict], int, bytes]]:
+        """Read ``paginas`` ahead in a task, keeping up to ``profundidade`` buffered.
+
+        Pages still buffered when the caller stops are discarded, as in
+        :meth:`NFSeDownloader._buscar_lotes_antecipados`.
+        """
+        fila: asyncio.Queue = asyncio.Queue(maxsize=profundidade)
+
+        async def ler() -> None:
+            try:
+                async with aclosing(paginas):
+                    async for pagina in paginas:
+                        await fila.put(pagina)
+            except Exception as e:  # re-raised below
+                await fila.put(e)
+            else:
+                await fila.put(FIM)
+
+        leitor = asyncio.create_task(ler())
+        try:
+            while True:
+                pagina = await fila.get()
+                if pagina is FIM:
+                    return
+                if isinstance(pagina, Exception):
+                    raise pagina
+                yield pagina
+        finally:
+            leitor.cancel()
+            with suppress(asyncio.CancelledError):
+                await leitor
+
+    async def _decodificar_pagina(
+        self, documentos: list[dict], pool: Optional[Executor], threads: Executor
+    ) -> list[Documento]:
+        """Decode one page on ``threads``, or in batches on the process ``pool``."""
+        loop = asyncio.get_running_loop()
+        if pool is not None:
+            n = decodificacao.LOTE_PROCESSOS
+            tarefas = [
+                loop.run_in_executor(threads, self._decodificar_lote, pool, documentos[i : i + n])
+                for i in range(0, len(documentos), n)
+            ]
+        else:
+            tarefas = [loop.run_in_executor(threads, self._decodificar, d) for d in documentos]
+        partes = await asyncio.gather(*tarefas, return_exceptions=True)
+        erros = [p for p in partes if isinstance(p, BaseException)]
+        docs = [
+            doc
+            for parte in partes
+            if not isinstance(parte, BaseException)
+            for doc in (parte if pool is not None else [parte])
+        ]
+        if erros:
+            for doc in docs:
+                doc.descartar()
+            raise erros[0]
+        return docs
+
+    def _gravar_pagina(
+        self,
+        docs: list[Documento],
+        checkpoint: NSUCheckpoint,
+        write: Callable[[str, bool], None],
+        running: Callable[[], bool],
+    ) -> list[tuple[Documento, RegistroDocumento]]:
+        """Write ``docs`` in order, stopping early when ``running`` turns false."""
+        gravados: list[tuple[Documento, RegistroDocumento]] = []
+        try:
+            for doc in docs:
+                if not running():
+                    break
+                gravados.append((doc, self._gravar_xml(doc, write)))
+                checkpoint.concluir(doc.nsu)
+        finally:
+            for doc in docs[len(gravados) :]:
+                doc.descartar()
+        return gravados
+
+    @staticmethod
+    async def _aguardar(pacer: PacingController, running: Callable[[], bool]) -> bool:
+        """Async counterpart of :meth:`PacingController.aguardar`."""
+        while running():
+            espera = pacer.reservar()
+            if espera <= 0:
+                return True
+            await asyncio.sleep(min(espera, 0.5))
+        return False
+
+    async def _consultar_async(
+        self,
+        session,
+        url: str,
+        pacer: PacingController,
+        write: Callable[[str, bool], None],
+        running: Callable[[], bool],
+    ) -> Optional[tuple[int, dict, list[dict], str, bytes]]:
+        """Async counterpart of :meth:`NFSeDownloader._consultar`.
+
+        Returns ``(status, campos, documentos, text, body)`` or ``None``
+        when stopped or out of retries. A 200 body is parsed with
+        :class:`LeitorLote` as it streams in and a malformed one is
+        requested again; the raw body is only kept for the journal.
+        """
+        max_retries = int(self.config.max_retries)
+        erros_rede = _erros_rede()
+        tentativa = 0
+        while True:
+            espera = 0.0
+            inicio = time.perf_counter()
+            try:
+                async with session.get(url) as resp:
+                    status = resp.status
+                    self.metricas.latencia.observar(time.perf_counter() - inicio, servico="dfe")
+                    self.metricas.respostas.inc(servico="dfe", status=status)
+                    if status == 200:
+                        leitor = LeitorLote()
+                        documentos: list[dict] = []
+                        partes: list[bytes] = []
+                        async for chunk in resp.content.iter_chunked(CHUNK_SIZE):
+                            if self.diario is not None:
+                                partes.append(chunk)
+                            documentos += leitor.alimentar(chunk)
+                        leitor.finalizar()
+                        pacer.sucesso()
+                        return status, leitor.campos, documentos, "", b"".join(partes)
+                    texto = await resp.text()
+                    if status != 429 and status < 500:
+                        pacer.sucesso()
+                        return status, {}, [], texto, b""
+                    espera = parse_retry_after(resp.headers.get("Retry-After"))
+            except erros_rede as e:
+                self.metricas.erros.inc(tipo="conexao")
+                self.logger.error("Erro de conexão: %s", e)
+                motivo = f"Erro de conexão: {e}"
+            except ValueError as e:
+                self.metricas.erros.inc(tipo="leitura")
+                self.logger.error("Erro ao ler lote: %s", e)
+                motivo = f"Erro ao ler lote: {e}"
+            else:
+                pacer.penalizar(espera)
+                self.logger.error("Erro: %s %s", status, texto)
+                motivo = f"Erro: {status} {texto}"
+            tentativa += 1
+            if tentativa > max_retries:
+                write(motivo, log=True)
+                return None
+            espera = espera or pacer.backoff(tentativa)
+            write(
+                f"{motivo}. Nova tentativa em {espera:.1f}s ({tentativa}/{max_retries}).",
+                log=True,
+            )
+            fim = time.monotonic() + espera
+            while running() and time.monotonic() < fim:
+                await asyncio.sleep(min(0.5, fim - time.monotonic()))
+            if not await self._aguardar(pacer, running):
+                return None
+
+    async def _baixar_pdf(
+        self,
+        session,
+        doc: Documento,
+        slots: asyncio.Semaphore,
+        stats: PDFStats,
+        write: Callable[[str, bool], None],
+    ) -> None:
+        """Stream the DANFSe of ``doc`` to disk and release its pool slot."""
+        pdf_file = self._caminho_pdf(doc)
+        existed = os.path.exists(pdf_file)
+        url = f"{self.config.danfse_url}/{doc.chave}"
+        inicio = time.perf_counter()
+        ok = False
+        nbytes = 0
+        try:
+            async with session.get(url) as resp:
+                self.metricas.latencia.observar(time.perf_counter() - inicio, servico="danfse")
+                self.metricas.respostas.inc(servico="danfse", status=resp.status)
+                if resp.status == 200:
+                    tmp_path = f"{pdf_file}.part"
+                    f = await asyncio.to_thread(open, tmp_path, "wb")
+                    try:
+                        try:
+                            async for chunk in resp.content.iter_chunked(
+                                NFSePDFDownloader.CHUNK_SIZE
+                            ):
+                                await asyncio.to_thread(f.write, chunk)
+                                nbytes += len(chunk)
+                        finally:
+                            await asyncio.to_thread(f.close)
+                        await asyncio.to_thread(os.replace, tmp_path, pdf_file)
+                    except BaseException:
+                        try:
+                            os.remove(tmp_path)
+                        except OSError:
+                            pass
+                        raise
+                    ok = True
+        except Exception as e:
+            self.logger.error("Erro ao baixar PDF %s: %s", doc.chave, e)
+        finally:
+            slots.release()
+        segundos = time.perf_counter() - inicio
+        stats.registrar(ok, segundos)
+        self.metricas.pdfs.inc(resultado="ok" if ok else "falha")
+        self.metricas.bytes.inc(nbytes, tipo="pdf")
+        await asyncio.to_thread(
+            self._pdf_callback(write), doc.chave, pdf_file, ok, existed, segundos
+        )
@@ -0,0 +1,306 @@
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+
+from . import decodificacao, metrics, transport
+from .config import Config
+from .downloader import NFSeDownloader
+from .fila_pdf import TrabalhadorFilaPDF
+from .lote import CHUNK_SIZE, LeitorLote
+from .metrics import Metricas
+from .pacing import PacingController
+from .pipeline import RunSummary
+from .state import Faixa, RegistroDocumento, StateStore, cursor_mesclado
+
+PASSO_SONDAGEM = 1024
+"""First step, in NSUs, of the search for the last NSU on the portal."""
+
+
+def dividir(inicio: int, fim: int, partes: int) -> list[Faixa]:
+    """Split ``inicio..fim`` into at most ``partes`` consecutive shards."""
+    total = fim - inicio + 1
+    if total <= 0:
+        return []
+    partes = max(1, min(partes, total))
+    tamanho, resto = divmod(total, partes)
+    faixas = []
+    for i in range(partes):
+        fim_faixa = inicio + tamanho + (1 if i < resto else 0) - 1
+        faixas.append(Faixa(inicio, fim_faixa, inicio))
+        inicio = fim_faixa + 1
+    return faixas
+
+
+class _DownloaderFaixa(NFSeDownloader):
+    """Engine that downloads one shard and records pages against it.
+
+    Failed PDFs go to the shared ``fila_pdf``, which :class:`Backfill`
+    drains with a single worker for all shards.
+    """
+
+    def __init__(
+        self,
+        config: Config,
+        state: StateStore,
+        metricas: Metricas,
+        faixa: Faixa,
+        pacer: PacingController,
+        armazenamento,
+        fila_pdf,
+    ):
+        super().__init__(config, state, metricas)
+        self.faixa = faixa
+        self.limite = faixa.fim
+        self.pacer = pacer
+        self._armazenamento = armazenamento
+        self._fila_pdf = fila_pdf
+        self.drenar_fila_pdf = False
+
+    def ler_ultimo_nsu(self, cnpj: Optional[str] = None) -> int:
+        return self.faixa.cursor
+
+    def _fechar_armazenamento(self) -> None:
+        # The archives are shared with the other shards; Backfill.run closes them.
+        pass
+
+    def _salvar_lote(self, nsu: int, registros: list[RegistroDocumento]) -> None:
+        self.faixa.cursor = nsu
+        self.state.registrar_faixa(self.config.cnpj, self.faixa.inicio, nsu, registros)
+
+
+class Backfill:
+    """Initial load of an NSU range split into shards fetched concurrently.
+
+    Each shard walks its own part of the range with its own cursor, kept
+    in the ``backfill`` table of the state store, so an interrupted
+    backfill resumes where every shard stopped. All shards share one
+    :class:`PacingController`, so ``delay_seconds``/``min_delay_seconds``
+    remain a global rate limit. After every page the CNPJ cursor moves to
+    the merged, contiguous resume point, which is where ``run`` picks up
+    once the backfill is over.
+    """
+
+    def __init__(
+        self,
+        config: Config,
+        state: Optional[StateStore] = None,
+        metricas: Optional[Metricas] = None,
+    ):
+        self.config = config
+        self.metricas = metricas or metrics.REGISTRO
+        self.principal = NFSeDownloader(config, state, self.metricas)
+        self.logger = logging.getLogger(__name__)
+
+    @property
+    def state(self) -> StateStore:
+        return self.principal.state
+
+    def _sondar(
+        self,
+        sess,
+        nsu: int,
+        write: Callable[[str, bool], None],
+        running: Callable[[], bool],
+    ) -> Optional[int]:
+        """Return the highest NSU of the page after ``nsu``, or ``None`` if empty."""
+        dl = self.principal
+        url = f"{self.config.dfe_url}/{nsu:020d}?cnpj={self.config.cnpj}"
+        if not dl.pacer.aguardar(running):
+            raise RuntimeError("Backfill interrompido.")
+        resp = dl._consultar(sess, url, dl.pacer, write, running)
+        if resp is None:
+            raise RuntimeError("Não foi possível consultar o portal para descobrir o último NSU.")
+        try:
+            if resp.status_code == 204:
+                return None
+            if resp.status_code != 200:
+                raise RuntimeError(f"Erro: {resp.status_code} {resp.text}")
+            nsus = [int(d["NSU"]) for d in LeitorLote().iterar(resp.iter_content(CHUNK_SIZE))]
+        finally:
+            resp.close()
+        return max(nsus) if nsus else None
+
+    def descobrir_limite(
+        self,
+        sess,
+        inicio: int,
+        write: Callable[[str, bool], None] = lambda msg, log=True: None,
+        running: Callable[[], bool] = lambda: True,
+    ) -> int:
+        """Find the last NSU available on the portal from ``inicio`` on.
+
+        Probes ahead with doubling steps until a query comes back empty,
+        then bisects, so it costs about ``2 * log2(n / PASSO_SONDAGEM)``
+        requests. Returns ``inicio - 1`` when nothing is available.
+        """
+        if self.principal.pacer is None:
+            self.principal.pacer = PacingController.from_config(self.config)
+        baixo = inicio - 1
+        alto = None
+        passo = PASSO_SONDAGEM
+        consulta = baixo
+        while alto is None:
+            maior = self._sondar(sess, max(0, consulta), write, running)
+            if maior is None:
+                alto = consulta
+            else:
+                baixo = maior
+                consulta = maior + passo
+                passo *= 2
+        while baixo < alto:
+            meio = (baixo + alto) // 2
+            maior = self._sondar(sess, meio, write, running)
+            if maior is None:
+                alto = meio
+            else:
+                baixo = maior
+        write(f"Último NSU disponível: {baixo}", log=True)
+        return baixo
+
+    def planejar(self, inicio: int, fim: int, partes: int) -> list[Faixa]:
+        """Store and return a new plan of ``partes`` shards for ``inicio..fim``."""
+        faixas = dividir(inicio, fim, partes)
+        self.state.salvar_faixas(self.config.cnpj, faixas)
+        return faixas
+
+    def run(
+        self,
+        write: Callable[[str, bool], None] = lambda msg, log=True: None,
+        running: Callable[[], bool] = lambda: True,
+        inicio: Optional[int] = None,
+        fim: Optional[int] = None,
+        partes: Optional[int] = None,
+        session=None,
+    ) -> RunSummary:
+        """Download ``inicio..fim`` in ``partes`` concurrent shards.
+
+        ``inicio`` defaults to the stored cursor and ``fim`` to the last
+        NSU found on the portal; a larger ``fim`` is capped there, since a
+        shard past it could never complete. An unfinished plan stored by a
+        previous backfill is resumed instead of starting a new one.
+        """
+        cfg = self.config
+        dl = self.principal
+        partes = max(1, int(partes if partes is not None else cfg.backfill_shards))
+        t0 = time.perf_counter()
+        antes = dl.metricas.amostras()
+        dl._preparar_execucao(write)
+        dl.pacer = PacingController.from_config(cfg)
+
+        sess = session
+        if sess is None:
+            cred = dl.credencial()
+            dl._informar_credencial(cred, write)
+            sess = transport.criar_sessao(cred.contexto, cfg, self.metricas, partes)
+        try:
+            faixas = self.state.ler_faixas(cfg.cnpj)
+            if faixas and not all(f.concluida for f in faixas):
+                write(
+                    f"Retomando backfill de {len(faixas)} faixas "
+                    f"(NSU {faixas[0].inicio} a {faixas[-1].fim}).",
+                    log=True,
+                )
+            else:
+                if inicio is None:
+                    inicio = dl.ler_ultimo_nsu()
+                limite = self.descobrir_limite(sess, inicio, write, running)
+                fim = limite if fim is None else min(fim, limite)
+                faixas = self.planejar(inicio, fim, partes)
+                if not faixas:
+                    write("Nenhum NSU para o backfill.", log=True)
+                    return RunSummary(cfg.cnpj, segundos=time.perf_counter() - t0)
+                write(
+                    f"Backfill do NSU {inicio} a {fim} em {len(faixas)} faixas.",
+                    log=True,
+                )
+            if int(cfg.decode_processes) > 0:
+                # One pool for every shard instead of one per shard.
+                dl.processos = decodificacao.criar_pool(int(cfg.decode_processes))
+            resumos = self._executar_faixas(sess, faixas, write, running)
+        finally:
+            if dl.processos is not None:
+                dl.processos.shutdown()
+                dl.processos = None
+            if session is None:
+                sess.close()
+                write(sess.transporte.resumo(), log=True)
+            dl.close()
+
+        faixas = self.state.ler_faixas(cfg.cnpj)
+        erros = [r.erro for r in resumos if r.erro]
+        if faixas and all(f.concluida for f in faixas):
+            self.state.limpar_faixas(cfg.cnpj)
+            write(f"Backfill concluído. Próximo NSU: {cursor_mesclado(faixas)}", log=True)
+        elif faixas:
+            write(f"Backfill interrompido no NSU {cursor_mesclado(faixas)}.", log=True)
+        if cfg.export_format:
+            dl._exportar(write, running)
+        resumo = RunSummary(
+            cfg.cnpj,
+            sum(r.documentos for r in resumos),
+            sum(r.bytes for r in resumos),
+            time.perf_counter() - t0,
+            erro=erros[0] if erros else None,
+            metricas=dl._salvar_metricas(antes, write),
+        )
+        write(f"Processo concluído. Total baixados: {resumo.documentos}", log=True)
+        return resumo
+
+    def _executar_faixas(
+        self,
+        sess,
+        faixas: list[Faixa],
+        write: Callable[[str, bool], None],
+        running: Callable[[], bool],
+    ) -> list[RunSummary]:
+        """Run every unfinished shard on its own thread.
+
+        One :class:`TrabalhadorFilaPDF` retries failed PDFs for all shards,
+        so a queued PDF is never downloaded twice.
+        """
+        cfg = self.config
+        parar = threading.Event()
+        pendentes = [f for f in faixas if not f.concluida]
+
+        def ativo() -> bool:
+            return not parar.is_set() and running()
+
+        def executar(faixa: Faixa) -> RunSummary:
+            def write_faixa(msg: str, log: bool = True) -> None:
+                write(f"[{faixa.inicio}-{faixa.fim}] {msg}", log)
+
+            inicio = time.perf_counter()
+            dl = _DownloaderFaixa(
+                cfg, self.state, self.metricas, faixa, self.principal.pacer,
+                self.principal.armazenamento, self.principal.fila_pdf,
+            )
+            dl.processos = self.principal.processos
+            try:
+                stats = dl._executar_com_sessao(sess, write_faixa, ativo)
+            except Exception as e:
+                parar.set()
+                self.logger.error("Erro na faixa %s-%s: %s", faixa.inicio, faixa.fim, e)
+                write_faixa(f"Erro inesperado: {e}", log=True)
+                return RunSummary(cfg.cnpj, segundos=time.perf_counter() - inicio, erro=str(e))
+            return RunSummary(cfg.cnpj, stats.itens, stats.bytes, time.perf_counter() - inicio)
+
+        if not pendentes:
+            return []
+        trabalhador = None
+        if cfg.download_pdf:
+            principal = self.principal
+            trabalhador = TrabalhadorFilaPDF(
+                principal.fila_pdf, principal._criar_pdf_downloader(sess, 0), write, ativo
+            ).iniciar()
+        try:
+            with ThreadPoolExecutor(
+                max_workers=len(pendentes), thread_name_prefix="nfse-faixa"
+            ) as pool:
+                return list(pool.map(executar, pendentes))
+        finally:
+            if trabalhador is not None:
+                trabalhador.parar()
@@ -0,0 +1,245 @@
+from __future__ import annotations
+
+import datetime
+import re
+import xml.parsers.expat as expat
+import zlib
+from dataclasses import dataclass, fields
+from typing import Optional
+
+from . import datas
+
+_CAMPOS = {
+    ("infNFSe", "nNFSe"): "numero",
+    (None, "dhEmi"): "data_emissao",
+    (None, "dhEvento"): "data_emissao",
+    (None, "DataEmissao"): "data_emissao",
+    ("infDPS", "dCompet"): "competencia",
+    ("emit", "CNPJ"): "prestador",
+    ("emit", "CPF"): "prestador",
+    ("prest", "CNPJ"): "prestador",
+    ("prest", "CPF"): "prestador",
+    ("toma", "CNPJ"): "tomador",
+    ("toma", "CPF"): "tomador",
+    ("cServ", "cTribNac"): "codigo_servico",
+    ("vServPrest", "vServ"): "valor_servico",
+    ("valores", "vBC"): "base_calculo",
+    ("valores", "vISSQN"): "valor_issqn",
+    ("valores", "vLiq"): "valor_liquido",
+    ("infPedReg", "chNFSe"): "chave_nfse",
+}
+"""``(parent, element)`` local names mapped to a field; ``None`` matches any parent."""
+
+CHUNK_SIZE = 16 * 1024
+
+_EVENTO = re.compile(r"e\d{6}$")
+"""Element under ``infPedReg`` named after the event type, e.g. ``e101101``."""
+
+
+@dataclass
+class CamposNFSe:
+    """Key fields of an NFS-e or of an event about one.
+
+    ``tipo`` is ``nfse`` or ``evento``; events fill ``tipo_evento`` (for
+    example ``101101``, cancellation) and ``chave_nfse``, the note they
+    refer to. Fields missing from the document are ``None``.
+    """
+
+    chave: str
+    tipo: str = "nfse"
+    numero: Optional[str] = None
+    data_emissao: Optional[str] = None
+    competencia: Optional[str] = None
+    prestador: Optional[str] = None
+    tomador: Optional[str] = None
+    codigo_servico: Optional[str] = None
+    valor_servico: Optional[float] = None
+    base_calculo: Optional[float] = None
+    valor_issqn: Optional[float] = None
+    valor_liquido: Optional[float] = None
+    tipo_evento: Optional[str] = None
+    chave_nfse: Optional[str] = None
+
+    @property
+    def ano_mes(self) -> Optional[tuple[str, str]]:
+        """``(ano, mes)`` of :attr:`data_emissao`, if it parses."""
+        return datas.ano_mes_de_texto(self.data_emissao) if self.data_emissao else None
+
+    @property
+    def data(self) -> Optional[str]:
+        """:attr:`data_emissao` as ``AAAA-MM-DD``, if it parses."""
+        if not self.data_emissao:
+            return None
+        texto = self.data_emissao[:10]
+        for formato in ("%Y-%m-%d", "%d/%m/%Y"):
+            try:
+                return datetime.datetime.strptime(texto, formato).date().isoformat()
+            except ValueError:
+                continue
+        return None
+
+
+VALORES = tuple(f.name for f in fields(CamposNFSe) if f.name.startswith(("valor", "base")))
+"""Monetary fields, stored as numbers."""
+
+
+class _Assinatura(Exception):
+    """Raised at the first ``Signature``: every field comes before it."""
+
+
+class _Coletor:
+    """Expat handlers that keep the first text of each field of ``_CAMPOS``.
+
+    Text is only collected inside those fields, so the large base64
+    signature values are never handed to Python.
+    """
+
+    def __init__(self, parser):
+        self.parser = parser
+        self.pilha: list[str] = []
+        self.valores: dict[str, str] = {}
+        self.raiz: Optional[str] = None
+        self.tipo_evento: Optional[str] = None
+        self._campo: Optional[str] = None
+        self._partes: list[str] = []
+
+    def inicio(self, nome: str, _attrs) -> None:
+        local = nome.rsplit(":", 1)[-1]
+        if local == "Signature":
+            raise _Assinatura()
+        pai = self.pilha[-1] if self.pilha else None
+        if self.raiz is None:
+            self.raiz = local
+        elif pai == "infPedReg" and _EVENTO.match(local):
+            self.tipo_evento = local[1:]
+        campo = _CAMPOS.get((pai, local)) or _CAMPOS.get((None, local))
+        if campo is not None and campo not in self.valores:
+            self._campo = campo
+            self._partes = []
+            self.parser.CharacterDataHandler = self._partes.append
+        self.pilha.append(local)
+
+    def fim(self, _nome: str) -> None:
+        self.pilha.pop()
+        if self._campo is not None:
+            self.valores[self._campo] = "".join(self._partes).strip()
+            self._campo = None
+            self.parser.CharacterDataHandler = None
+
+    def campos(self, chave: str) -> CamposNFSe:
+        valores = self.valores
+        campos = CamposNFSe(
+            chave,
+            tipo="evento" if (self.raiz or "").lower() == "evento" else "nfse",
+            tipo_evento=self.tipo_evento,
+            **{k: v or None for k, v in valores.items() if k not in VALORES},
+        )
+        for campo in VALORES:
+            setattr(campos, campo, _numero(valores.get(campo)))
+        return campos
+
+
+def _coletor() -> _Coletor:
+    parser = expat.ParserCreate()
+    coletor = _Coletor(parser)
+    parser.StartElementHandler = coletor.inicio
+    parser.EndElementHandler = coletor.fim
+    return coletor
+
+
+def _numero(texto: Optional[str]) -> Optional[float]:
+    if not texto:
+        return None
+    try:
+        return float(texto)
+    except ValueError:
+        return None
+
+
+def extrair_campos(xml_bytes: bytes, chave: str) -> CamposNFSe:
+    """Return the :class:`CamposNFSe` of ``xml_bytes`` in one streaming pass.
+
+    Raises ``ValueError`` when the document is not well-formed XML.
+    """
+    coletor = _coletor()
+    try:
+        coletor.parser.Parse(xml_bytes, True)
+    except _Assinatura:
+        pass
+    except expat.ExpatError as e:
+        raise ValueError(f"XML inválido ({chave}): {e}") from None
+    return coletor.campos(chave)
+
+
+def campos_ou_nada(dados: bytes, chave: str, comprimido: bool) -> Optional[CamposNFSe]:
+    """Return the fields of a plain or gzip document, or ``None`` if it does not parse."""
+    try:
+        if comprimido:
+            return extrair_campos_gzip(dados, chave)
+        return extrair_campos(dados, chave)
+    except ValueError:
+        return None
+
+
+class ExtratorCampos:
+    """Incremental counterpart of :func:`extrair_campos`.
+
+    Feed the XML in chunks with :meth:`alimentar` until it returns
+    ``True``, then call :meth:`finalizar`.
+    """
+
+    def __init__(self):
+        self._coletor = _coletor()
+        self._erro: Optional[str] = None
+        self.concluido = False
+
+    def alimentar(self, dados: bytes) -> bool:
+        """Feed ``dados``. Returns ``True`` once no more input is needed."""
+        if self.concluido:
+            return True
+        try:
+            self._coletor.parser.Parse(dados, False)
+        except _Assinatura:
+            self.concluido = True
+        except expat.ExpatError as e:
+            self._erro = str(e)
+            self.concluido = True
+        return self.concluido
+
+    def finalizar(self, chave: str) -> CamposNFSe:
+        """Signal end of input and return the fields found.
+
+        Raises ``ValueError`` when the document is not well-formed XML.
+        """
+        if not self.concluido:
+            self.concluido = True
+            try:
+                self._coletor.parser.Parse(b"", True)
+            except _Assinatura:
+                pass
+            except expat.ExpatError as e:
+                self._erro = str(e)
+        if self._erro is not None:
+            raise ValueError(f"XML inválido ({chave}): {self._erro}")
+        return self._coletor.campos(chave)
+
+
+def extrair_campos_gzip(gz_bytes: bytes, chave: str) -> CamposNFSe:
+    """Like :func:`extrair_campos` for the gzip payload sent by the portal.
+
+    Inflation stops with the parse at the first signature, so the
+    signatures at the end of the document are never decompressed.
+    """
+    extrator = ExtratorCampos()
+    inflador = zlib.decompressobj(wbits=31)
+    pendente = gz_bytes
+    try:
+        while pendente and not extrator.concluido:
+            parte = inflador.decompress(pendente, CHUNK_SIZE)
+            pendente = inflador.unconsumed_tail
+            if not parte:
+                break
+            extrator.alimentar(parte)
+    except zlib.error as e:
+        raise ValueError(f"XML inválido ({chave}): {e}") from None
+    return extrator.finalizar(chave)
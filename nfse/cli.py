@@ -0,0 +1,385 @@
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import signal
+import sys
+import threading
+from contextlib import contextmanager
+from dataclasses import asdict
+from typing import Callable, Iterator, Optional, Sequence
+
+# Keep start-up light: the engines, and with them requests and
+# cryptography, are imported only by the commands that use them.
+from .config import Config
+
+CONFIG_FILE = "config.json"
+
+
+class Saida:
+    """Print progress messages as plain text or as JSON lines."""
+
+    def __init__(self, json_lines: bool = False, stream=None):
+        self.json_lines = json_lines
+        self.stream = stream or sys.stdout
+        self.logger = logging.getLogger(__name__)
+
+    def write(self, msg: str, log: bool = True) -> None:
+        """``write`` callback handed to the engines."""
+        self.emitir("log", mensagem=msg)
+        if log:
+            self.logger.info(msg)
+
+    def emitir(self, evento: str, mensagem: str = "", **dados) -> None:
+        """Print one event; text mode shows only ``mensagem``."""
+        if self.json_lines:
+            linha = json.dumps({"evento": evento, "mensagem": mensagem, **dados}, ensure_ascii=False)
+        else:
+            linha = mensagem
+        print(linha, file=self.stream, flush=True)
+
+
+def _cnpjs(cfg: Config) -> list[str]:
+    if cfg.clients:
+        return [c["cnpj"] for c in cfg.clients]
+    return [cfg.cnpj]
+
+
+@contextmanager
+def _interrompivel(saida: Saida) -> Iterator[Callable[[], bool]]:
+    """Yield a ``running`` callback that turns false on SIGINT/SIGTERM."""
+    parar = threading.Event()
+
+    def sinal(signum, _frame) -> None:
+        saida.write("Parando processo... aguarde.", log=True)
+        parar.set()
+
+    anteriores = {s: signal.signal(s, sinal) for s in (signal.SIGINT, signal.SIGTERM)}
+    try:
+        yield lambda: not parar.is_set()
+    finally:
+        for s, handler in anteriores.items():
+            signal.signal(s, handler)
+
+
+def cmd_run(cfg: Config, args: argparse.Namespace, saida: Saida) -> int:
+    """Download until the portal has no more documents or a signal arrives."""
+    with _interrompivel(saida) as running:
+        if cfg.clients:
+            from .orchestrator import MultiCNPJOrchestrator
+
+            resumos = MultiCNPJOrchestrator(cfg).run(write=saida.write, running=running)
+        else:
+            from .downloader import criar_downloader
+
+            downloader = criar_downloader(cfg)
+            try:
+                resumos = [downloader.run(write=saida.write, running=running)]
+            except Exception as e:
+                saida.emitir("erro", f"Erro inesperado: {e}", cnpj=cfg.cnpj)
+                return 1
+            finally:
+                downloader.close()
+    for resumo in resumos:
+        saida.emitir("resumo", resumo.resumo(), **asdict(resumo))
+    return 1 if any(r.erro for r in resumos) else 0
+
+
+def cmd_backfill(cfg: Config, args: argparse.Namespace, saida: Saida) -> int:
+    """Load an NSU range in concurrent shards (see :class:`nfse.backfill.Backfill`)."""
+    from .backfill import Backfill
+
+    with _interrompivel(saida) as running:
+        try:
+            resumo = Backfill(cfg).run(
+                write=saida.write,
+                running=running,
+                inicio=args.inicio,
+                fim=args.fim,
+                partes=args.faixas,
+            )
+        except Exception as e:
+            saida.emitir("erro", f"Erro inesperado: {e}", cnpj=cfg.cnpj)
+            return 1
+    saida.emitir("resumo", resumo.resumo(), **asdict(resumo))
+    return 1 if resumo.erro else 0
+
+
+def cmd_reprocessar(cfg: Config, args: argparse.Namespace, saida: Saida) -> int:
+    """Run the page journal of every configured CNPJ through the pipeline offline."""
+    from .reprocessamento import Reprocessamento
+
+    clientes = [cfg.para_cliente(c) for c in cfg.clients] if cfg.clients else [cfg]
+    with _interrompivel(saida) as running:
+        for cliente in clientes:
+            if not running():
+                break
+            try:
+                resumo = Reprocessamento(cliente).run(
+                    write=saida.write, running=running, inicio=args.inicio, fim=args.fim
+                )
+            except Exception as e:
+                saida.emitir("erro", f"Erro no reprocessamento: {e}", cnpj=cliente.cnpj)
+                return 1
+            saida.emitir("resumo", resumo.resumo(), **asdict(resumo))
+    return 0
+
+
+def cmd_migrar_layout(cfg: Config, args: argparse.Namespace, saida: Saida) -> int:
+    """Move a flat ``output_dir`` into ``output_layout``."""
+    from .migracao import MigracaoLayout
+
+    with _interrompivel(saida) as running:
+        try:
+            stats = MigracaoLayout(cfg, workers=args.workers).run(
+                write=saida.write, running=running
+            )
+        except Exception as e:
+            saida.emitir("erro", f"Erro na migração: {e}")
+            return 1
+    saida.emitir("resumo", stats.resumo(), **asdict(stats))
+    return 1 if stats.conflitos else 0
+
+
+def cmd_retry_pdfs(cfg: Config, args: argparse.Namespace, saida: Saida) -> int:
+    """Download the PDFs waiting in the retry queue of every configured CNPJ."""
+    from .downloader import NFSeDownloader
+
+    clientes = [cfg.para_cliente(c) for c in cfg.clients] if cfg.clients else [cfg]
+    falhas = 0
+    with _interrompivel(saida) as running:
+        for cliente in clientes:
+            downloader = NFSeDownloader(cliente)
+            try:
+                ok, erro = downloader.reprocessar_pdfs(
+                    write=saida.write, running=running, todos=args.todos
+                )
+            except Exception as e:
+                saida.emitir("erro", f"Erro inesperado: {e}", cnpj=cliente.cnpj)
+                return 1
+            finally:
+                downloader.close()
+            falhas += erro
+            saida.emitir(
+                "pdfs",
+                f"CNPJ {cliente.cnpj}: {ok} PDFs baixados, {erro} falhas",
+                cnpj=cliente.cnpj,
+                baixados=ok,
+                falhas=erro,
+            )
+    return 1 if falhas else 0
+
+
+def cmd_exportar(cfg: Config, args: argparse.Namespace, saida: Saida) -> int:
+    """Export the documents not exported yet of every configured CNPJ."""
+    from .exportacao import Exportador
+    from .state import StateStore
+
+    clientes = [cfg.para_cliente(c) for c in cfg.clients] if cfg.clients else [cfg]
+    falhas = 0
+    with _interrompivel(saida) as running:
+        for cliente in clientes:
+            state = StateStore(cliente.state_db)
+            try:
+                formato = args.formato or cliente.export_format or "csv"
+                stats = Exportador(cliente, state, formato, args.destino).run(
+                    write=saida.write, running=running
+                )
+            except Exception as e:
+                saida.emitir("erro", f"Erro na exportação: {e}", cnpj=cliente.cnpj)
+                return 1
+            finally:
+                state.close()
+            falhas += stats.falhas
+            saida.emitir(
+                "exportacao",
+                f"CNPJ {cliente.cnpj}: {stats.resumo()}",
+                cnpj=cliente.cnpj,
+                **asdict(stats),
+            )
+    return 1 if falhas else 0
+
+
+def cmd_buscar(cfg: Config, args: argparse.Namespace, saida: Saida) -> int:
+    """List indexed documents matching the filters, without opening the XMLs."""
+    from .state import FiltroIndice, StateStore
+
+    filtro = FiltroIndice(
+        chave=args.chave,
+        cnpj=args.cnpj,
+        participante=args.participante,
+        prestador=args.prestador,
+        tomador=args.tomador,
+        de=args.de,
+        ate=args.ate,
+        valor_min=args.valor_min,
+        valor_max=args.valor_max,
+        tipo=args.tipo,
+    )
+    state = StateStore(cfg.state_db)
+    try:
+        entradas = state.buscar(filtro, args.limite)
+    finally:
+        state.close()
+    for e in entradas:
+        c = e.campos
+        valor = f"{c.valor_servico:.2f}" if c.valor_servico is not None else "-"
+        saida.emitir(
+            "documento",
+            f"{c.data or '-'} {c.tipo} {c.chave} prestador {c.prestador or '-'} "
+            f"tomador {c.tomador or '-'} valor {valor} {e.caminho or '-'}",
+            cnpj=e.cnpj,
+            nsu=e.nsu,
+            caminho=e.caminho,
+            **asdict(c),
+        )
+    saida.emitir("resumo", f"{len(entradas)} documentos encontrados.", total=len(entradas))
+    return 0
+
+
+def cmd_reindexar(cfg: Config, args: argparse.Namespace, saida: Saida) -> int:
+    """Rebuild the query index from the documents already downloaded."""
+    from .indice import ReconstrucaoIndice
+
+    with _interrompivel(saida) as running:
+        try:
+            stats = ReconstrucaoIndice(cfg, workers=args.workers).run(
+                write=saida.write, running=running
+            )
+        except Exception as e:
+            saida.emitir("erro", f"Erro na reindexação: {e}")
+            return 1
+    saida.emitir("resumo", stats.resumo(), **asdict(stats))
+    return 1 if stats.falhas else 0
+
+
+def cmd_status(cfg: Config, args: argparse.Namespace, saida: Saida) -> int:
+    """Show the NSU cursor and document count of every configured CNPJ."""
+    from .state import StateStore
+
+    state = StateStore(cfg.state_db)
+    try:
+        for cnpj in _cnpjs(cfg):
+            nsu = state.ler_cursor(cnpj)
+            if nsu is None:
+                nsu = state.importar_txt(cnpj)
+            docs = state.contar_documentos(cnpj)
+            pdfs = state.contar_pdfs_pendentes(cnpj)
+            saida.emitir(
+                "status",
+                f"CNPJ {cnpj}: NSU {nsu if nsu is not None else '-'}, {docs} documentos, "
+                f"{pdfs} PDFs na fila",
+                cnpj=cnpj,
+                nsu=nsu,
+                documentos=docs,
+                pdfs_pendentes=pdfs,
+            )
+    finally:
+        state.close()
+    return 0
+
+
+def cmd_set_nsu(cfg: Config, args: argparse.Namespace, saida: Saida) -> int:
+    """Move the NSU cursor of a CNPJ."""
+    from .state import StateStore
+
+    cnpj = args.cnpj or cfg.cnpj
+    state = StateStore(cfg.state_db)
+    try:
+        state.salvar_cursor(cnpj, args.nsu)
+    finally:
+        state.close()
+    saida.emitir("nsu", f"NSU de {cnpj} definido para {args.nsu}", cnpj=cnpj, nsu=args.nsu)
+    return 0
+
+
+def criar_parser() -> argparse.ArgumentParser:
+    """Return the argument parser of ``python -m nfse``."""
+    parser = argparse.ArgumentParser(
+        prog="python -m nfse",
+        description="Baixa NFS-e do Portal Nacional sem interface gráfica.",
+    )
+    parser.add_argument("--config", default=CONFIG_FILE, help="arquivo de configuração")
+    parser.add_argument("--json", action="store_true", help="saída em linhas JSON")
+    sub = parser.add_subparsers(dest="comando", required=True)
+
+    run = sub.add_parser("run", help="baixa os documentos pendentes")
+    run.set_defaults(func=cmd_run)
+
+    status = sub.add_parser("status", help="mostra o último NSU de cada CNPJ")
+    status.set_defaults(func=cmd_status)
+
+    set_nsu = sub.add_parser("set-nsu", help="define o NSU inicial de um CNPJ")
+    set_nsu.add_argument("nsu", type=int)
+    set_nsu.add_argument("--cnpj", help="CNPJ (padrão: o do config)")
+    set_nsu.set_defaults(func=cmd_set_nsu)
+
+    backfill = sub.add_parser("backfill", help="carga inicial em faixas de NSU paralelas")
+    backfill.add_argument("--inicio", type=int, help="primeiro NSU (padrão: o NSU salvo)")
+    backfill.add_argument("--fim", type=int, help="último NSU (padrão: descoberto no portal)")
+    backfill.add_argument("--faixas", type=int, help="faixas simultâneas (padrão: backfill_shards)")
+    backfill.set_defaults(func=cmd_backfill)
+
+    reprocessar = sub.add_parser(
+        "reprocessar", help="regrava o acervo a partir do diário de respostas, sem acessar o portal"
+    )
+    reprocessar.add_argument("--inicio", type=int, default=0, help="primeiro NSU (padrão: 0)")
+    reprocessar.add_argument("--fim", type=int, help="último NSU (padrão: todo o diário)")
+    reprocessar.set_defaults(func=cmd_reprocessar)
+
+    migrar = sub.add_parser(
+        "migrar-layout", help="move os arquivos de output_dir para as pastas de output_layout"
+    )
+    migrar.add_argument("--workers", type=int, default=8, help="arquivos movidos em paralelo")
+    migrar.set_defaults(func=cmd_migrar_layout)
+
+    retry = sub.add_parser("retry-pdfs", help="baixa os PDFs que falharam em execuções anteriores")
+    retry.add_argument(
+        "--todos", action="store_true", help="tenta agora, sem esperar o horário agendado"
+    )
+    retry.set_defaults(func=cmd_retry_pdfs)
+
+    exportar = sub.add_parser(
+        "exportar", help="exporta os campos das notas baixadas para CSV ou Parquet"
+    )
+    exportar.add_argument(
+        "--formato", choices=("csv", "parquet"), help="padrão: export_format ou csv"
+    )
+    exportar.add_argument("--destino", help="pasta do conjunto de dados (padrão: export_dir)")
+    exportar.set_defaults(func=cmd_exportar)
+
+    buscar = sub.add_parser("buscar", help="consulta o índice local das notas baixadas")
+    buscar.add_argument("--chave", help="chave de acesso")
+    buscar.add_argument("--cnpj", help="CNPJ do cliente que baixou a nota")
+    buscar.add_argument("--participante", help="CNPJ/CPF do prestador ou do tomador")
+    buscar.add_argument("--prestador", help="CNPJ/CPF do prestador")
+    buscar.add_argument("--tomador", help="CNPJ/CPF do tomador")
+    buscar.add_argument("--de", help="data de emissão inicial (AAAA-MM-DD)")
+    buscar.add_argument("--ate", help="data de emissão final (AAAA-MM-DD)")
+    buscar.add_argument("--valor-min", type=float, help="valor do serviço mínimo")
+    buscar.add_argument("--valor-max", type=float, help="valor do serviço máximo")
+    buscar.add_argument("--tipo", choices=("nfse", "evento"))
+    buscar.add_argument("--limite", type=int, default=1000, help="máximo de resultados")
+    buscar.set_defaults(func=cmd_buscar)
+
+    reindexar = sub.add_parser(
+        "reindexar", help="reconstrói o índice local a partir dos XMLs já baixados"
+    )
+    reindexar.add_argument(
+        "--workers", type=int, default=0, help="processos em paralelo (padrão: um por CPU)"
+    )
+    reindexar.set_defaults(func=cmd_reindexar)
+    return parser
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    """Entry point; returns the process exit code."""
+    args = criar_parser().parse_args(argv)
+    saida = Saida(json_lines=args.json)
+    try:
+        cfg = Config.load(args.config)
+    except Exception as e:
+        saida.emitir("erro", f"Erro ao carregar configuração: {e}")
+        return 2
+    return args.func(cfg, args, saida)
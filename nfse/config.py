@@ -2,7 +2,7 @@ from __future__ import annotations
 
 import json
 import os
-from dataclasses import dataclass, asdict
+from dataclasses import dataclass, asdict, field, fields, replace
 
 
 @dataclass
@@ -12,11 +12,39 @@ class Config:
     cnpj: str = "00000000000000"
     output_dir: str = "./xml"
     log_dir: str = "logs"
+    state_db: str = "nfse_state.db"
     file_prefix: str = "NFS-e"
+    output_format: str = "xml"
+    output_layout: str = ""
+    index_documents: bool = True
+    journal_dir: str = ""
+    export_format: str = ""
+    export_dir: str = "./export"
     download_pdf: bool = False
     delay_seconds: int = 60
+    min_delay_seconds: float = 1.0
+    max_retries: int = 5
+    retry_backoff_seconds: float = 2.0
     auto_start: bool = False
     timeout: int = 30
+    decode_workers: int = 2
+    decode_processes: int = 0
+    queue_size: int = 100
+    prefetch_depth: int = 0
+    pdf_workers: int = 4
+    pdf_retry_backoff_seconds: float = 60.0
+    pdf_retry_backoff_max_seconds: float = 21600.0
+    pdf_retry_max_attempts: int = 10
+    engine: str = "threads"
+    dfe_url: str = "https://adn.nfse.gov.br/contribuintes/DFe"
+    danfse_url: str = "https://sefin.nfse.gov.br/sefinnacional/danfse"
+    http_pool_size: int = 0
+    http_keepalive_seconds: int = 60
+    http2: bool = False
+    max_concurrent: int = 4
+    backfill_shards: int = 4
+    metrics_port: int = 0
+    clients: list = field(default_factory=list)
 
     REQUIRED_FIELDS = ["cert_path", "cert_pass", "cnpj", "output_dir", "log_dir"]
 
@@ -42,6 +70,26 @@ class Config:
             cfg.save(path)
         return cfg
 
+    def para_cliente(self, cliente: dict) -> "Config":
+        """Return a copy of this config for one entry of ``clients``.
+
+        Each entry must have a ``cnpj`` and may override any other field,
+        typically ``cert_path``/``cert_pass`` for clients with their own
+        certificate. Fields not given are shared with this config;
+        ``engine`` cannot differ between clients.
+        """
+        validos = {f.name for f in fields(self)} - {"clients"}
+        desconhecidos = set(cliente) - validos
+        if desconhecidos:
+            raise ValueError(
+                "Campos desconhecidos em clients: " + ", ".join(sorted(desconhecidos))
+            )
+        if not cliente.get("cnpj"):
+            raise ValueError("Cada item de clients precisa de um cnpj.")
+        if "engine" in cliente:
+            raise ValueError("engine vale para todos os clients; defina-o fora da lista.")
+        return replace(self, clients=[], **cliente)
+
     def save(self, path: str) -> None:
         """Persist configuration to ``path`` as JSON."""
         with open(path, "w", encoding="utf-8") as f:
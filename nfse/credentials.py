@@ -0,0 +1,108 @@
+from __future__ import annotations
+
+import hashlib
+import os
+import secrets
+import ssl
+import tempfile
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+
+
+@dataclass
+class Credencial:
+    """TLS context built from a PFX certificate."""
+
+    contexto: ssl.SSLContext
+    segundos: float
+    """Time spent loading the certificate when it entered the cache."""
+    reutilizada: bool = False
+
+
+def carregar_contexto(pfx_path: str, pfx_password: str) -> ssl.SSLContext:
+    """Return a client ``SSLContext`` holding the key of ``pfx_path``.
+
+    ``ssl`` can only read keys from files, so the key goes through a
+    temporary PEM encrypted with a one-time password and removed as soon
+    as the context has loaded it. The plain key never touches the disk.
+    """
+    from cryptography.hazmat.primitives.serialization import (
+        BestAvailableEncryption,
+        Encoding,
+        PrivateFormat,
+    )
+    from cryptography.hazmat.primitives.serialization.pkcs12 import (
+        load_key_and_certificates,
+    )
+
+    data = Path(pfx_path).read_bytes()
+    priv_key, cert, add_certs = load_key_and_certificates(
+        data, pfx_password.encode(), None
+    )
+    senha = secrets.token_bytes(32)
+    fd, pem_path = tempfile.mkstemp(suffix=".pem")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(
+                priv_key.private_bytes(
+                    Encoding.PEM, PrivateFormat.PKCS8, BestAvailableEncryption(senha)
+                )
+            )
+            f.write(cert.public_bytes(Encoding.PEM))
+            for ca in add_certs or ():
+                f.write(ca.public_bytes(Encoding.PEM))
+        ctx = ssl.create_default_context()
+        ctx.load_cert_chain(pem_path, password=senha)
+    finally:
+        os.remove(pem_path)
+    return ctx
+
+
+class CacheCredenciais:
+    """Thread-safe cache of TLS contexts keyed by certificate file.
+
+    An entry is reused while the PFX path, its modification time and the
+    password are unchanged, so several runs and CNPJs sharing a
+    certificate pay for the PKCS#12 parsing only once.
+    """
+
+    def __init__(self, carregar=carregar_contexto):
+        self._carregar = carregar
+        self._lock = threading.Lock()
+        self._entradas: dict[tuple, Credencial] = {}
+
+    @staticmethod
+    def _chave(pfx_path: str, pfx_password: str) -> tuple:
+        caminho = os.path.abspath(pfx_path)
+        return (
+            caminho,
+            os.stat(caminho).st_mtime_ns,
+            hashlib.sha256(pfx_password.encode()).digest(),
+        )
+
+    def obter(self, pfx_path: str, pfx_password: str) -> Credencial:
+        """Return the cached credential for the certificate, loading it once."""
+        chave = self._chave(pfx_path, pfx_password)
+        with self._lock:
+            cred = self._entradas.get(chave)
+            if cred is not None:
+                return Credencial(cred.contexto, cred.segundos, reutilizada=True)
+            inicio = time.perf_counter()
+            contexto = self._carregar(pfx_path, pfx_password)
+            cred = Credencial(contexto, time.perf_counter() - inicio)
+            # Drop entries of older versions of the same file.
+            for antiga in [k for k in self._entradas if k[0] == chave[0]]:
+                del self._entradas[antiga]
+            self._entradas[chave] = cred
+            return cred
+
+    def limpar(self) -> None:
+        """Forget every cached credential."""
+        with self._lock:
+            self._entradas.clear()
+
+
+CACHE = CacheCredenciais()
+"""Process-wide cache shared by every engine and the orchestrator."""
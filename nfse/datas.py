@@ -0,0 +1,154 @@
+from __future__ import annotations
+
+import datetime
+import gzip
+import xml.etree.ElementTree as ET
+import xml.parsers.expat as expat
+import zlib
+from typing import Optional
+
+TAGS_DATA = ("dhEmi", "dhEvento", "DataEmissao")
+"""Elements holding the emission/event date, in order of preference."""
+
+CHUNK_SIZE = 1024
+
+
+def ano_mes_de_texto(txt: str) -> Optional[tuple[str, str]]:
+    """Return ``(ano, mes)`` parsed from a date string or ``None``."""
+    txt = txt.strip()
+    try:
+        dt = datetime.datetime.fromisoformat(txt.replace("Z", ""))
+        return str(dt.year), f"{dt.month:02d}"
+    except Exception:
+        for fmt in ("%Y-%m-%d", "%d/%m/%Y"):
+            try:
+                dt = datetime.datetime.strptime(txt[:10], fmt)
+                return str(dt.year), f"{dt.month:02d}"
+            except Exception:
+                continue
+    return None
+
+
+class _Encontrada(Exception):
+    """Raised from expat callbacks to stop parsing at the date element."""
+
+
+class ExtratorData:
+    """Incremental parser that stops at the first date element.
+
+    Feed the XML in chunks with :meth:`alimentar` until it returns ``True``;
+    :attr:`texto` then holds the date text, or ``None`` if the document had
+    no date element or could not be parsed. Namespace processing is off
+    (prefixes are stripped by hand) because it doubles expat's cost.
+    """
+
+    def __init__(self):
+        self._parser = expat.ParserCreate()
+        self._parser.StartElementHandler = self._inicio
+        self._partes: list[str] = []
+        self.texto: Optional[str] = None
+        self.concluido = False
+
+    def _inicio(self, nome: str, _attrs) -> None:
+        if nome.rsplit(":", 1)[-1] in TAGS_DATA:
+            self._parser.CharacterDataHandler = self._partes.append
+            self._parser.EndElementHandler = self._fim
+
+    def _fim(self, _nome: str) -> None:
+        raise _Encontrada()
+
+    def alimentar(self, dados: bytes) -> bool:
+        """Feed ``dados``. Returns ``True`` once no more input is needed."""
+        if self.concluido:
+            return True
+        try:
+            self._parser.Parse(dados, False)
+        except _Encontrada:
+            self.texto = "".join(self._partes) or None
+            self.concluido = True
+        except expat.ExpatError:
+            self.concluido = True
+        return self.concluido
+
+    def finalizar(self) -> Optional[str]:
+        """Signal end of input and return the date text found, if any."""
+        self.concluido = True
+        return self.texto
+
+
+def data_streaming(xml_bytes: bytes, chunk_size: int = CHUNK_SIZE) -> Optional[str]:
+    """Return the text of the first date element of ``xml_bytes``."""
+    extrator = ExtratorData()
+    view = memoryview(xml_bytes)
+    for inicio in range(0, len(view), chunk_size):
+        if extrator.alimentar(view[inicio : inicio + chunk_size].tobytes()):
+            break
+    return extrator.finalizar()
+
+
+def data_gzip(gz_bytes: bytes, chunk_size: int = CHUNK_SIZE) -> Optional[str]:
+    """Like :func:`data_streaming` but for gzip data.
+
+    Only as much of ``gz_bytes`` is inflated as the parser needs to reach
+    the date element; the rest of the document is never decompressed.
+    """
+    extrator = ExtratorData()
+    inflador = zlib.decompressobj(wbits=31)
+    pendente = gz_bytes
+    try:
+        while pendente and not extrator.concluido:
+            parte = inflador.decompress(pendente, chunk_size)
+            pendente = inflador.unconsumed_tail
+            if not parte:
+                break
+            extrator.alimentar(parte)
+    except zlib.error:
+        return None
+    return extrator.finalizar()
+
+
+def ano_mes_arvore(xml_bytes: bytes) -> Optional[tuple[str, str]]:
+    """Full-tree lookup honouring the ``TAGS_DATA`` preference order."""
+    try:
+        root = ET.fromstring(xml_bytes)
+    except ET.ParseError:
+        return None
+    for tag in TAGS_DATA:
+        el = root.find(f".//{{*}}{tag}")
+        if el is not None and el.text:
+            return ano_mes_de_texto(el.text)
+    return None
+
+
+def extrair_ano_mes(xml_bytes: bytes) -> tuple[str, str]:
+    """Return the year and month from ``dhEmi`` or ``dhEvento``.
+
+    The streaming parser is tried first; the full tree search is the
+    fallback, and the current month is used when both fail.
+    """
+    texto = data_streaming(xml_bytes)
+    resultado = ano_mes_de_texto(texto) if texto else None
+    if resultado is None:
+        resultado = ano_mes_arvore(xml_bytes)
+    if resultado is None:
+        now = datetime.datetime.now()
+        resultado = str(now.year), f"{now.month:02d}"
+    return resultado
+
+
+def extrair_ano_mes_gzip(gz_bytes: bytes) -> tuple[str, str]:
+    """Return the year and month of a gzip compressed XML document.
+
+    Mirrors :func:`extrair_ano_mes`; the payload is only fully inflated
+    when the partial streaming parse finds no usable date.
+    """
+    texto = data_gzip(gz_bytes)
+    resultado = ano_mes_de_texto(texto) if texto else None
+    if resultado is None:
+        try:
+            return extrair_ano_mes(gzip.decompress(gz_bytes))
+        except (OSError, EOFError, zlib.error):
+            pass
+        now = datetime.datetime.now()
+        resultado = str(now.year), f"{now.month:02d}"
+    return resultado
@@ -0,0 +1,146 @@
+from __future__ import annotations
+
+import base64
+import gzip
+import hashlib
+import multiprocessing
+import os
+import threading
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+
+from . import datas
+from .campos import ExtratorCampos, campos_ou_nada
+from .pipeline import Documento
+
+LOTE_PROCESSOS = 64
+"""Most documents sent to a worker process in one task."""
+
+LIMITE_MEMORIA = 1024 * 1024
+"""Base64 payloads longer than this are decoded straight to a spool file."""
+
+BLOCO_BASE64 = 64 * 1024
+"""Base64 characters decoded at a time when spooling; a multiple of 4."""
+
+
+def _caminho_spool(diretorio: str, nsu: int) -> str:
+    return os.path.join(diretorio, f".nfse_{nsu}.{os.getpid()}.{threading.get_ident()}.tmp")
+
+
+def _ano_mes_completo(caminho: str, comprimido: bool) -> tuple[str, str]:
+    """Fallback for the rare document whose date is not near the start."""
+    with open(caminho, "rb") as f:
+        dados = f.read()
+    return datas.extrair_ano_mes_gzip(dados) if comprimido else datas.extrair_ano_mes(dados)
+
+
+def decodificar_em_arquivo(
+    nsu: int, chave: str, arquivo: str, diretorio: str, comprimido: bool, indexar: bool = False
+) -> Documento:
+    """Decode a large ``ArquivoXml`` into a spool file in ``diretorio``.
+
+    The base64 text is decoded :data:`BLOCO_BASE64` characters at a time
+    and written as it goes: the gzip payload itself for the compressed
+    formats, the inflated XML otherwise. Only the beginning of the XML is
+    parsed, for the date and the index fields, so the memory used does
+    not grow with the document. ``diretorio`` must be on the filesystem
+    of ``output_dir`` so the writer can rename the file into place.
+    """
+    caminho = _caminho_spool(diretorio, nsu)
+    h = hashlib.sha256()
+    nbytes = 0
+    extrator = datas.ExtratorData()
+    extrator_campos = ExtratorCampos() if indexar else None
+    inflador = zlib.decompressobj(wbits=31)
+    try:
+        with open(caminho, "wb") as f:
+            for inicio in range(0, len(arquivo), BLOCO_BASE64):
+                pendente = base64.b64decode(arquivo[inicio : inicio + BLOCO_BASE64])
+                if comprimido:
+                    f.write(pendente)
+                    h.update(pendente)
+                    nbytes += len(pendente)
+                while pendente:
+                    if comprimido and extrator.concluido and (
+                        extrator_campos is None or extrator_campos.concluido
+                    ):
+                        break
+                    xml = inflador.decompress(pendente, BLOCO_BASE64)
+                    pendente = inflador.unconsumed_tail
+                    if not comprimido:
+                        f.write(xml)
+                        h.update(xml)
+                        nbytes += len(xml)
+                    extrator.alimentar(xml)
+                    if extrator_campos is not None:
+                        extrator_campos.alimentar(xml)
+            if not comprimido:
+                xml = inflador.flush()
+                f.write(xml)
+                h.update(xml)
+                nbytes += len(xml)
+        texto = extrator.finalizar()
+        ano_mes = datas.ano_mes_de_texto(texto) if texto else None
+        if ano_mes is None:
+            ano_mes = _ano_mes_completo(caminho, comprimido)
+    except BaseException:
+        try:
+            os.remove(caminho)
+        except OSError:
+            pass
+        raise
+    campos = None
+    if extrator_campos is not None:
+        try:
+            campos = extrator_campos.finalizar(chave)
+        except ValueError:
+            pass
+    ano, mes = ano_mes
+    return Documento(
+        nsu, chave, b"", ano, mes, campos=campos, arquivo=caminho, sha256=h.hexdigest(),
+        nbytes=nbytes,
+    )
+
+
+def decodificar_lote(
+    itens: list[tuple[int, str, str]], comprimido: bool, indexar: bool, diretorio: str
+) -> list[Documento]:
+    """Decode the ``(NSU, chave, ArquivoXml)`` entries in ``itens``; runs in a worker process.
+
+    Documents keep the gzip payload when ``comprimido`` and the plain XML
+    otherwise; ``campos`` is only extracted with ``indexar``. Payloads
+    over :data:`LIMITE_MEMORIA` are spooled to ``diretorio`` instead, so
+    only their path crosses back. Everything else travels once in each
+    direction.
+    """
+    resultado = []
+    for nsu, chave, arquivo in itens:
+        if len(arquivo) > LIMITE_MEMORIA:
+            resultado.append(
+                decodificar_em_arquivo(nsu, chave, arquivo, diretorio, comprimido, indexar)
+            )
+            continue
+        xml_gzip = base64.b64decode(arquivo)
+        if comprimido:
+            ano, mes = datas.extrair_ano_mes_gzip(xml_gzip)
+            campos = campos_ou_nada(xml_gzip, chave, True) if indexar else None
+            resultado.append(
+                Documento(nsu, chave, b"", ano, mes, gzip_bytes=xml_gzip, campos=campos)
+            )
+        else:
+            xml_bytes = gzip.decompress(xml_gzip)
+            ano, mes = datas.extrair_ano_mes(xml_bytes)
+            campos = campos_ou_nada(xml_bytes, chave, False) if indexar else None
+            resultado.append(Documento(nsu, chave, xml_bytes, ano, mes, campos=campos))
+    return resultado
+
+
+def criar_pool(processos: int) -> ProcessPoolExecutor:
+    """Return a pool of ``processos`` decode workers.
+
+    Workers are spawned rather than forked: the parent already runs the
+    fetch and PDF threads, and forking a threaded process can deadlock.
+    """
+    return ProcessPoolExecutor(
+        max_workers=max(1, processos), mp_context=multiprocessing.get_context("spawn")
+    )
@@ -0,0 +1,213 @@
+from __future__ import annotations
+
+import bisect
+import datetime
+import itertools
+import json
+import logging
+import os
+import re
+import threading
+import zlib
+from dataclasses import dataclass
+from typing import Iterator, Optional
+
+EXTENSAO = ".dfe"
+"""Suffix of journal files."""
+
+NIVEL_COMPRESSAO = 6
+
+_sequencia = itertools.count()
+_URL_NSU = re.compile(r"/(\d{20})(?:\?|$)")
+
+
+@dataclass
+class PaginaDiario:
+    """One LoteDFe page recorded in a journal file.
+
+    ``nsu_inicial`` is the NSU the page was requested for and
+    ``nsu_final`` the highest NSU it returned; the gzip body starts at
+    ``posicao`` in ``arquivo`` and is ``tamanho`` bytes long.
+    """
+
+    nsu_inicial: int
+    nsu_final: int
+    buscado_em: str
+    arquivo: str
+    posicao: int
+    tamanho: int
+
+    def corpo(self, chunk_size: int = 64 * 1024) -> Iterator[bytes]:
+        """Yield the response body as recorded, inflating ``chunk_size`` at a time."""
+        inflador = zlib.decompressobj(wbits=31)
+        with open(self.arquivo, "rb") as f:
+            f.seek(self.posicao)
+            restante = self.tamanho
+            while restante:
+                parte = f.read(min(chunk_size, restante))
+                if not parte:
+                    raise ValueError(f"Diário truncado: {self.arquivo}")
+                restante -= len(parte)
+                dados = inflador.decompress(parte)
+                if dados:
+                    yield dados
+        final = inflador.flush()
+        if final:
+            yield final
+
+
+class CapturaPagina:
+    """Response wrapper that compresses the body while the parser reads it.
+
+    Only the compressed copy is kept, so a page costs its gzip size in
+    memory until it is appended to the journal.
+    """
+
+    def __init__(self, resp):
+        self._resp = resp
+        self._gzip = zlib.compressobj(NIVEL_COMPRESSAO, zlib.DEFLATED, 31)
+        self._partes: list[bytes] = []
+
+    def iter_content(self, chunk_size: int = 1) -> Iterator[bytes]:
+        for chunk in self._resp.iter_content(chunk_size):
+            self._partes.append(self._gzip.compress(chunk))
+            yield chunk
+
+    def comprimido(self) -> bytes:
+        """Return the gzip body read so far; call once, after the page."""
+        return b"".join(self._partes) + self._gzip.flush()
+
+    def __getattr__(self, nome):
+        return getattr(self._resp, nome)
+
+
+class DiarioDFe:
+    """Append-only journal of the raw LoteDFe responses of one CNPJ.
+
+    Each run appends to its own file in ``<journal_dir>/<cnpj>/``, named
+    after its start time, so a crash can only truncate the tail of the
+    file being written. A record is a JSON header line (NSU range, fetch
+    time and body size) followed by the gzip response body exactly as
+    the portal sent it. Readers skip a truncated last record.
+    """
+
+    def __init__(self, diretorio: str, cnpj: str):
+        self.diretorio = os.path.join(diretorio, cnpj)
+        self._arquivo: Optional[str] = None
+        self._lock = threading.Lock()
+        self.logger = logging.getLogger(__name__)
+
+    def _novo_arquivo(self) -> str:
+        os.makedirs(self.diretorio, exist_ok=True)
+        agora = datetime.datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+        nome = f"dfe_{agora}_{os.getpid()}_{next(_sequencia)}{EXTENSAO}"
+        return os.path.join(self.diretorio, nome)
+
+    def registrar(self, nsu_inicial: int, nsu_final: int, corpo_gzip: bytes) -> None:
+        """Append one page whose gzip body is ``corpo_gzip``."""
+        cabecalho = json.dumps(
+            {
+                "nsu_inicial": nsu_inicial,
+                "nsu_final": nsu_final,
+                "buscado_em": datetime.datetime.now().isoformat(timespec="seconds"),
+                "tamanho": len(corpo_gzip),
+            }
+        ).encode()
+        with self._lock:
+            if self._arquivo is None:
+                self._arquivo = self._novo_arquivo()
+            with open(self._arquivo, "ab") as f:
+                f.write(cabecalho + b"\n" + corpo_gzip)
+
+    def arquivos(self) -> list[str]:
+        """Return the journal files of this CNPJ, oldest first."""
+        if not os.path.isdir(self.diretorio):
+            return []
+        return sorted(
+            os.path.join(self.diretorio, nome)
+            for nome in os.listdir(self.diretorio)
+            if nome.endswith(EXTENSAO)
+        )
+
+    def paginas(self) -> Iterator[PaginaDiario]:
+        """Yield every complete record, reading only the headers."""
+        for arquivo in self.arquivos():
+            tamanho_arquivo = os.path.getsize(arquivo)
+            with open(arquivo, "rb") as f:
+                while True:
+                    linha = f.readline()
+                    if not linha:
+                        break
+                    try:
+                        cabecalho = json.loads(linha)
+                    except ValueError:
+                        self.logger.error("Registro inválido em %s; restante ignorado.", arquivo)
+                        break
+                    posicao = f.tell()
+                    if posicao + cabecalho["tamanho"] > tamanho_arquivo:
+                        self.logger.error("Último registro de %s incompleto; ignorado.", arquivo)
+                        break
+                    yield PaginaDiario(
+                        cabecalho["nsu_inicial"],
+                        cabecalho["nsu_final"],
+                        cabecalho["buscado_em"],
+                        arquivo,
+                        posicao,
+                        cabecalho["tamanho"],
+                    )
+                    f.seek(posicao + cabecalho["tamanho"])
+
+
+class RespostaDiario:
+    """Response served from the journal with the interface the engine reads."""
+
+    def __init__(self, pagina: Optional[PaginaDiario]):
+        self.pagina = pagina
+        self.status_code = 200 if pagina is not None else 204
+        self.headers: dict[str, str] = {}
+        self.text = ""
+
+    def iter_content(self, chunk_size: int = 1) -> Iterator[bytes]:
+        if self.pagina is not None:
+            yield from self.pagina.corpo(max(chunk_size, 64 * 1024))
+
+    def close(self) -> None:
+        pass
+
+
+class SessaoDiario:
+    """Stand-in for the HTTP session that answers DFe queries from a journal.
+
+    A query for NSU ``n`` gets the page recorded for the same start NSU,
+    or else the first page with documents after ``n``; when a start NSU
+    was fetched more than once, the latest copy wins. Past the last page
+    it answers 204, which ends the run as it would on the portal.
+    """
+
+    def __init__(self, paginas: Iterator[PaginaDiario]):
+        por_inicio: dict[int, PaginaDiario] = {}
+        for pagina in paginas:
+            atual = por_inicio.get(pagina.nsu_inicial)
+            if atual is None or pagina.buscado_em >= atual.buscado_em:
+                por_inicio[pagina.nsu_inicial] = pagina
+        self.paginas = sorted(por_inicio.values(), key=lambda p: p.nsu_inicial)
+        self._inicios = [p.nsu_inicial for p in self.paginas]
+
+    def pagina(self, nsu: int) -> Optional[PaginaDiario]:
+        """Return the page served for a query starting at ``nsu``."""
+        i = bisect.bisect_right(self._inicios, nsu) - 1
+        if i >= 0 and self.paginas[i].nsu_final >= nsu:
+            return self.paginas[i]
+        if i + 1 < len(self.paginas):
+            return self.paginas[i + 1]
+        return None
+
+    def get(self, url: str, timeout: float = 0, stream: bool = False) -> RespostaDiario:
+        m = _URL_NSU.search(url)
+        if m is None:
+            raise ValueError(f"URL sem NSU: {url}")
+        # The engine queries NSU n - 1 to receive n onwards.
+        return RespostaDiario(self.pagina(int(m.group(1)) + 1))
+
+    def close(self) -> None:
+        pass
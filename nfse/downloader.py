@@ -1,85 +1,130 @@
 import os
 import base64
 import gzip
+import json
 import logging
 import datetime
+import queue
 import tempfile
+import threading
 import time
 from pathlib import Path
+from concurrent.futures import Executor
 from contextlib import contextmanager
 from typing import Callable, Iterable, Optional
-import xml.etree.ElementTree as ET
 
 import requests
 
+from . import credentials, datas, decodificacao, metrics, transport
+from .credentials import Credencial
+from .campos import campos_ou_nada
+from .diario import CapturaPagina, DiarioDFe
+from .exportacao import Exportador
+from .fila_pdf import FilaPDF, TrabalhadorFilaPDF
 from .pdf_downloader import NFSePDFDownloader
 from .config import Config
-
-from cryptography.hazmat.primitives.serialization import (
-    Encoding,
-    PrivateFormat,
-    NoEncryption,
-)
-from cryptography.hazmat.primitives.serialization.pkcs12 import (
-    load_key_and_certificates,
-)
+from .metrics import Metricas
+from .pacing import PacingController, dormir, parse_retry_after
+from .lote import CAMPO_STATUS, CHUNK_SIZE, DOCUMENTOS_LOCALIZADOS, LeitorLote
+from .pipeline import FIM, Documento, NSUCheckpoint, NSUVistos, RunSummary, StageStats
+from .state import PDFPendente, RegistroDocumento, StateStore
+from .storage import Armazenamento
 
 
 class NFSeDownloader:
     """Utility class to download NFS-e documents."""
 
-    def __init__(self, config: Config):
+    def __init__(
+        self,
+        config: Config,
+        state: Optional[StateStore] = None,
+        metricas: Optional[Metricas] = None,
+    ):
         self.config = config
+        self._metricas_raiz = metricas or metrics.REGISTRO
+        self.metricas = self._metricas_raiz.vincular(cnpj=config.cnpj)
         self.logger = logging.getLogger(__name__)
         self.session: Optional[requests.Session] = None
+        self.pacer: Optional[PacingController] = None
+        self.limite: Optional[int] = None
+        self.processos: Optional[Executor] = None
+        self._state = state
+        self._armazenamento: Optional[Armazenamento] = None
+        self._fila_pdf: Optional[FilaPDF] = None
+        self._diario: Optional[DiarioDFe] = None
+        self.drenar_fila_pdf = True
+        """Whether a run drains :attr:`fila_pdf` in the background."""
+        self._pdfs_abertos: set[str] = set()
+        self._lock_pdf = threading.Lock()
+
+    @property
+    def state(self) -> StateStore:
+        """Return the state store, opening ``config.state_db`` on first use."""
+        if self._state is None:
+            self._state = StateStore(self.config.state_db)
+        return self._state
+
+    @property
+    def armazenamento(self) -> Armazenamento:
+        """Return the writer for ``config.output_format``."""
+        if self._armazenamento is None:
+            self._armazenamento = Armazenamento(self.config)
+        return self._armazenamento
+
+    @property
+    def fila_pdf(self) -> FilaPDF:
+        """Return the retry queue of failed PDF downloads of this CNPJ."""
+        if self._fila_pdf is None:
+            self._fila_pdf = FilaPDF.from_config(self.state, self.config)
+        return self._fila_pdf
+
+    @property
+    def diario(self) -> Optional[DiarioDFe]:
+        """Return the page journal, or ``None`` without ``journal_dir``."""
+        if self._diario is None and self.config.journal_dir:
+            self._diario = DiarioDFe(self.config.journal_dir, self.config.cnpj)
+        return self._diario
 
     def ler_ultimo_nsu(self, cnpj: Optional[str] = None) -> int:
-        """Return the last stored NSU for ``cnpj`` (defaults to config)."""
+        """Return the last stored NSU for ``cnpj`` (defaults to config).
+
+        A legacy ``ultimo_nsu_<cnpj>.txt`` is imported the first time.
+        """
         if cnpj is None:
             cnpj = self.config.cnpj
-        fname = f"ultimo_nsu_{cnpj}.txt"
-        if os.path.exists(fname):
-            with open(fname, "r", encoding="utf-8") as f:
-                try:
-                    return int(f.read().strip())
-                except Exception:
-                    pass
-        return 1
+        nsu = self.state.ler_cursor(cnpj)
+        if nsu is None:
+            nsu = self.state.importar_txt(cnpj)
+        return nsu if nsu is not None else 1
 
     def salvar_ultimo_nsu(self, nsu: int, cnpj: Optional[str] = None) -> None:
         """Persist ``nsu`` for ``cnpj`` (defaults to config)."""
         if cnpj is None:
             cnpj = self.config.cnpj
-        fname = f"ultimo_nsu_{cnpj}.txt"
-        with open(fname, "w", encoding="utf-8") as f:
-            f.write(str(nsu))
+        self.state.salvar_cursor(cnpj, nsu)
 
     @staticmethod
     def extrair_ano_mes(xml_bytes: bytes) -> tuple[str, str]:
         """Return the year and month from ``dhEmi`` or ``dhEvento``."""
-        now = datetime.datetime.now()
-        try:
-            root = ET.fromstring(xml_bytes)
-            el = None
-            for tag in ("dhEmi", "dhEvento", "DataEmissao"):
-                el = root.find(f'.//{{*}}{tag}')
-                if el is not None and el.text:
-                    break
-            if el is not None and el.text:
-                txt = el.text.strip()
-                try:
-                    dt = datetime.datetime.fromisoformat(txt.replace("Z", ""))
-                    return str(dt.year), f"{dt.month:02d}"
-                except Exception:
-                    for fmt in ("%Y-%m-%d", "%d/%m/%Y"):
-                        try:
-                            dt = datetime.datetime.strptime(txt[:10], fmt)
-                            return str(dt.year), f"{dt.month:02d}"
-                        except Exception:
-                            continue
-        except Exception:
-            pass
-        return str(now.year), f"{now.month:02d}"
+        return datas.extrair_ano_mes(xml_bytes)
+
+    def credencial(self) -> Credencial:
+        """Return the cached TLS credential of ``config.cert_path``."""
+        cfg = self.config
+        return credentials.CACHE.obter(cfg.cert_path, cfg.cert_pass)
+
+    @staticmethod
+    def _informar_credencial(cred: Credencial, write: Callable[[str, bool], None]) -> None:
+        if cred.reutilizada:
+            write(f"Certificado reutilizado (carga original {cred.segundos:.2f}s).", log=True)
+        else:
+            write(f"Certificado carregado em {cred.segundos:.2f}s.", log=True)
+
+    def _abrir_sessao(self, write: Callable[[str, bool], None]):
+        """Return a session authenticated by the cached certificate context."""
+        cred = self.credencial()
+        self._informar_credencial(cred, write)
+        return transport.criar_sessao(cred.contexto, self.config, self.metricas)
 
     @contextmanager
     def pfx_to_pem(
@@ -87,7 +132,20 @@ class NFSeDownloader:
         pfx_path: Optional[str] = None,
         pfx_password: Optional[str] = None,
     ) -> Iterable[str]:
-        """Convert ``pfx_path`` to a temporary PEM file."""
+        """Convert ``pfx_path`` to a temporary PEM file.
+
+        Runs no longer use this; they load the certificate once through
+        :mod:`nfse.credentials`. Kept for callers that need a PEM file.
+        """
+        from cryptography.hazmat.primitives.serialization import (
+            Encoding,
+            PrivateFormat,
+            NoEncryption,
+        )
+        from cryptography.hazmat.primitives.serialization.pkcs12 import (
+            load_key_and_certificates,
+        )
+
         if pfx_path is None:
             pfx_path = self.config.cert_path
         if pfx_password is None:
@@ -114,143 +172,733 @@ class NFSeDownloader:
         self,
         write: Callable[[str, bool], None] = lambda msg, log=True: None,
         running: Callable[[], bool] = lambda: True,
+        session=None,
+    ) -> RunSummary:
+        """Download NFS-e documents until ``running`` returns ``False``.
+
+        Pages are fetched, decoded and written by separate stages connected
+        by bounded queues, so portal round trips overlap with decoding and
+        disk writes. ``session`` lets callers share an already authenticated
+        session; it is left open when the run finishes.
+        """
+        cfg = self.config
+        inicio = time.perf_counter()
+        antes = self.metricas.amostras()
+
+        self._preparar_execucao(write)
+
+        if session is not None:
+            stats = self._executar_com_sessao(session, write, running)
+        else:
+            self.session = sess = self._abrir_sessao(write)
+            try:
+                stats = self._executar_com_sessao(sess, write, running)
+            finally:
+                sess.close()
+                self.session = None
+            transporte = getattr(sess, "transporte", None)
+            if transporte is not None:
+                write(transporte.resumo(), log=True)
+        if cfg.export_format:
+            self._exportar(write, running)
+
+        resumo = RunSummary(
+            cfg.cnpj,
+            stats.itens,
+            stats.bytes,
+            time.perf_counter() - inicio,
+            metricas=self._salvar_metricas(antes, write),
+        )
+        write(f"Processo concluído. Total baixados: {stats.itens}", log=True)
+        return resumo
+
+    def _executar_com_sessao(
+        self,
+        sess,
+        write: Callable[[str, bool], None],
+        running: Callable[[], bool],
+    ) -> StageStats:
+        """Run the pipeline on ``sess`` and wait for queued PDFs.
+
+        With ``download_pdf`` a background worker also retries PDFs that
+        failed in earlier runs, one at a time, while the pipeline runs.
+        """
+        cfg = self.config
+        pdf_dl = self._criar_pdf_downloader(sess, int(cfg.pdf_workers))
+        trabalhador = None
+        if cfg.download_pdf and self.drenar_fila_pdf:
+            trabalhador = TrabalhadorFilaPDF(
+                self.fila_pdf, self._criar_pdf_downloader(sess, 0), write, running
+            ).iniciar()
+        nsu = self.ler_ultimo_nsu(cfg.cnpj)
+        try:
+            stats = self._executar_pipeline(sess, pdf_dl, nsu, write, running)
+        finally:
+            if not running():
+                pdf_dl.cancelar()
+            pdf_dl.aguardar()
+            if trabalhador is not None:
+                trabalhador.parar()
+            self._fechar_armazenamento()
+        if cfg.download_pdf:
+            write(pdf_dl.stats.resumo(), log=True)
+        return stats
+
+    def _fechar_armazenamento(self) -> None:
+        """Close the archives left open by a run."""
+        self.armazenamento.close()
+
+    def reprocessar_pdfs(
+        self,
+        write: Callable[[str, bool], None] = lambda msg, log=True: None,
+        running: Callable[[], bool] = lambda: True,
+        todos: bool = False,
+        session=None,
+    ) -> tuple[int, int]:
+        """Retry the queued PDFs now and return ``(baixados, falhas)``.
+
+        Only entries whose retry time has come are tried, unless ``todos``.
+        """
+        pendentes = self.state.contar_pdfs_pendentes(self.config.cnpj)
+        write(f"{pendentes} PDFs na fila de novas tentativas.", log=True)
+        if not pendentes:
+            return 0, 0
+        sess = session if session is not None else self._abrir_sessao(write)
+        try:
+            pdf_dl = self._criar_pdf_downloader(sess, int(self.config.pdf_workers))
+            return self.fila_pdf.drenar(pdf_dl, write, running, todos)
+        finally:
+            if session is None:
+                sess.close()
+
+    def _exportar(
+        self, write: Callable[[str, bool], None], running: Callable[[], bool]
     ) -> None:
-        """Download NFS-e documents until ``running`` returns ``False``."""
+        """Append the documents not exported yet to ``export_dir``."""
+        stats = Exportador(self.config, self.state).run(write, running)
+        write(stats.resumo(), log=True)
+
+    def _criar_pdf_downloader(self, sess, workers: int) -> NFSePDFDownloader:
         cfg = self.config
-        cert_path = cfg.cert_path
-        cert_pass = cfg.cert_pass
-        cnpj = cfg.cnpj
-        output_dir = cfg.output_dir
-        log_dir = cfg.log_dir
-        file_prefix = cfg.file_prefix
-        delay_seconds = int(cfg.delay_seconds)
-        timeout = int(cfg.timeout)
-        download_pdf = bool(cfg.download_pdf)
-
-        os.makedirs(output_dir, exist_ok=True)
-        os.makedirs(log_dir, exist_ok=True)
-        base_url = "https://adn.nfse.gov.br/contribuintes/DFe"
-        log_name = os.path.join(log_dir, f"log_nfse_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.txt")
+        return NFSePDFDownloader(
+            sess, int(cfg.timeout), workers, base_url=cfg.danfse_url, metricas=self.metricas
+        )
+
+    def _preparar_execucao(self, write: Callable[[str, bool], None]) -> None:
+        """Create output/log directories and start the per-run log file."""
+        cfg = self.config
+        os.makedirs(cfg.output_dir, exist_ok=True)
+        os.makedirs(cfg.log_dir, exist_ok=True)
+        log_name = os.path.join(cfg.log_dir, f"log_nfse_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.txt")
         logging.basicConfig(
             filename=log_name,
             level=logging.INFO,
             format="%(asctime)s %(levelname)s: %(message)s",
         )
         write(f"Log registrado em: {log_name}", log=False)
-        write(f"Consultando NFS-e para CNPJ {cnpj}.", log=True)
+        servidor = metrics.iniciar_servidor(int(cfg.metrics_port), self._metricas_raiz)
+        if servidor is not None:
+            write(f"Métricas em http://127.0.0.1:{servidor.porta}/metrics", log=False)
+        write(f"Consultando NFS-e para CNPJ {cfg.cnpj}.", log=True)
+
+    def _salvar_metricas(
+        self, antes: dict[str, float], write: Callable[[str, bool], None]
+    ) -> dict[str, float]:
+        """Save the metrics recorded since ``antes`` as JSON in ``log_dir``."""
+        cfg = self.config
+        resumo = self.metricas.resumo(antes)
+        caminho = os.path.join(
+            cfg.log_dir,
+            f"metricas_{cfg.cnpj}_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.json",
+        )
+        try:
+            with open(caminho, "w", encoding="utf-8") as f:
+                json.dump(resumo, f, indent=2, ensure_ascii=False)
+        except OSError as e:
+            self.logger.error("Erro ao salvar métricas: %s", e)
+        else:
+            write(f"Métricas da execução salvas em: {caminho}", log=True)
+        return resumo
+
+    def _executar_pipeline(
+        self,
+        sess,
+        pdf_dl: NFSePDFDownloader,
+        nsu: int,
+        write: Callable[[str, bool], None],
+        running: Callable[[], bool],
+    ) -> StageStats:
+        """Run fetch, decode and write stages and return the writer stats.
+
+        With ``decode_processes`` the decode threads hand batches of
+        payloads to a process pool instead of decoding under the GIL.
+        """
+        cfg = self.config
+        processos = max(0, int(cfg.decode_processes))
+        pool = self.processos
+        if processos and pool is None:
+            pool = decodificacao.criar_pool(processos)
+        workers = processos or max(1, int(cfg.decode_workers))
+        queue_size = max(1, int(cfg.queue_size))
+        entrada: queue.Queue = queue.Queue(maxsize=queue_size)
+        saida: queue.Queue = queue.Queue(maxsize=queue_size)
+        checkpoint = NSUCheckpoint(nsu)
+        parar = threading.Event()
+        erros: list[BaseException] = []
+        st_busca = StageStats("busca")
+        st_decod = StageStats("decodificação")
+        st_grav = StageStats("gravação")
 
-        nsus_baixados = set()
-        total_baixados = 0
+        def ativo() -> bool:
+            return not parar.is_set() and running()
 
-        with self.pfx_to_pem(cert_path, cert_pass) as pem_cert:
-            self.session = requests.Session()
-            sess = self.session
-            sess.cert = pem_cert
-            sess.verify = True
-            pdf_dl = NFSePDFDownloader(sess, timeout)
+        def falhar(exc: BaseException) -> None:
+            erros.append(exc)
+            parar.set()
 
-            nsu = self.ler_ultimo_nsu(cnpj)
+        def buscar() -> None:
             try:
-                while running():
-                    query_nsu = max(0, nsu - 1)
-                    url = f"{base_url}/{query_nsu:020d}?cnpj={cnpj}"
-                    write(
-                        f"Consultando NSU {nsu} (consulta {query_nsu}) para CNPJ {cnpj}...",
-                        log=True,
-                    )
-                    try:
-                        resp = sess.get(url, timeout=timeout)
-                    except requests.exceptions.RequestException as e:
-                        self.logger.error("Erro de conexão: %s", e)
-                        write(f"Erro de conexão: {e}", log=True)
-                        self.salvar_ultimo_nsu(nsu, cnpj)
+                self._buscar_lotes(sess, nsu, entrada, checkpoint, st_busca, write, ativo)
+            except BaseException as e:  # propagated by the writer below
+                falhar(e)
+            finally:
+                for _ in range(workers):
+                    entrada.put(FIM)
+
+        def decodificar() -> None:
+            # Items are drained even after a stop so upstream never blocks.
+            while True:
+                item = entrada.get()
+                if item is FIM:
+                    saida.put(FIM)
+                    return
+                if not ativo():
+                    continue
+                inicio = time.perf_counter()
+                try:
+                    doc = self._decodificar(item)
+                except Exception as e:
+                    falhar(e)
+                    continue
+                st_decod.registrar(inicio, doc.tamanho)
+                saida.put(doc)
+
+        def decodificar_em_processos() -> None:
+            while True:
+                item = entrada.get()
+                lote = []
+                while item is not FIM:
+                    lote.append(item)
+                    if len(lote) >= decodificacao.LOTE_PROCESSOS:
                         break
-                    if resp.status_code == 200:
-                        resposta = resp.json()
-                        documentos = resposta.get("LoteDFe", [])
-                        if resposta.get("StatusProcessamento") == "DOCUMENTOS_LOCALIZADOS" and documentos:
-                            documentos = sorted(documentos, key=lambda d: int(d.get("NSU", 0)))
-                            nsu_maior = nsu
-                            stop_loop = False
-                            for nfse in documentos:
-                                if not running():
-                                    stop_loop = True
-                                    break
-                                nsu_item = int(nfse["NSU"])
-                                chave = nfse["ChaveAcesso"]
-                                if nsu_item in nsus_baixados:
-                                    continue
-                                nsus_baixados.add(nsu_item)
-                                arquivo_xml = nfse["ArquivoXml"]
-                                xml_gzip = base64.b64decode(arquivo_xml)
-                                xml_bytes = gzip.decompress(xml_gzip)
-                                ano, mes = self.extrair_ano_mes(xml_bytes)
-                                filename = os.path.join(
-                                    output_dir, f"{file_prefix}_{ano}-{mes}_{chave}.xml"
-                                )
-                                write(f"NSU {nsu_item}", log=True)
-                                existed = os.path.exists(filename)
-                                with open(filename, "wb") as fxml:
-                                    fxml.write(xml_bytes)
-                                action = "substituído" if existed else "salvo"
-                                write(
-                                    f"XML Baixado e {action}: {filename}",
-                                    log=True,
-                                )
-                                total_baixados += 1
-                                if download_pdf and running():
-                                    pdf_file = os.path.join(
-                                        output_dir,
-                                        f"{file_prefix}_{ano}-{mes}_{chave}.pdf",
-                                    )
-                                    pdf_existed = os.path.exists(pdf_file)
-                                    if pdf_dl.baixar(chave, pdf_file):
-                                        action = (
-                                            "substituído" if pdf_existed else "salvo"
-                                        )
-                                        write(
-                                            f"PDF baixado e {action}: {pdf_file}",
-                                            log=True,
-                                        )
-                                    else:
-                                        write(
-                                            f"Falha ao baixar PDF: {chave}",
-                                            log=True,
-                                        )
-                                nsu_maior = max(nsu_maior, nsu_item)
-                                self.salvar_ultimo_nsu(nsu_maior + 1, cnpj)
-                            if stop_loop or not running():
-                                self.salvar_ultimo_nsu(max(1, nsu_maior), cnpj)
-                                break
-                            self.salvar_ultimo_nsu(nsu_maior + 1, cnpj)
-                            nsu = nsu_maior + 1
-                        else:
-                            self.logger.error("Resposta inesperada ou nenhum documento localizado.")
-                            write("Resposta inesperada ou nenhum documento localizado.", log=True)
-                            self.salvar_ultimo_nsu(nsu, cnpj)
-                            break
-                        write(f"Aguardando {delay_seconds} segundos para o próximo lote...", log=True)
-                        for _ in range(delay_seconds):
-                            if not running():
-                                break
-                            time.sleep(1)
-                    elif resp.status_code == 204:
-                        write("Nenhuma nota encontrada. Fim da consulta.", log=True)
-                        self.salvar_ultimo_nsu(nsu, cnpj)
+                    try:
+                        item = entrada.get_nowait()
+                    except queue.Empty:
                         break
+                if lote and ativo():
+                    inicio = time.perf_counter()
+                    try:
+                        docs = self._decodificar_lote(pool, lote)
+                    except Exception as e:
+                        falhar(e)
                     else:
-                        self.logger.error("Erro: %s %s", resp.status_code, resp.text)
-                        write(f"Erro: {resp.status_code} {resp.text}", log=True)
-                        self.salvar_ultimo_nsu(nsu, cnpj)
-                        break
+                        st_decod.registrar(inicio, sum(d.tamanho for d in docs), len(docs))
+                        for doc in docs:
+                            saida.put(doc)
+                if item is FIM:
+                    saida.put(FIM)
+                    return
+
+        alvo = decodificar_em_processos if processos else decodificar
+        threads = [threading.Thread(target=buscar, daemon=True)]
+        threads += [threading.Thread(target=alvo, daemon=True) for _ in range(workers)]
+        for t in threads:
+            t.start()
+
+        registros: list[RegistroDocumento] = []
+        restantes = workers
+        while restantes:
+            doc = saida.get()
+            if doc is FIM:
+                restantes -= 1
+                continue
+            if not ativo():
+                doc.descartar()
+                continue
+            inicio = time.perf_counter()
+            try:
+                registros.append(self._gravar(doc, pdf_dl, write, running))
+            except Exception as e:
+                doc.descartar()
+                falhar(e)
+                continue
+            st_grav.registrar(inicio, doc.tamanho)
+            checkpoint.concluir(doc.nsu)
+            if checkpoint.lotes_concluidos():
+                self._concluir_lote(checkpoint.valor, registros)
+                registros = []
+
+        for t in threads:
+            t.join()
+        if pool is not None and pool is not self.processos:
+            pool.shutdown()
+        self._concluir_lote(max(1, checkpoint.valor), registros)
+        for stats in (st_busca, st_decod, st_grav):
+            write(stats.resumo(), log=True)
+        if erros:
+            raise erros[0]
+        return st_grav
+
+    def _concluir_lote(self, nsu: int, registros: list[RegistroDocumento]) -> None:
+        """Flush the page's files to disk, then record them with ``nsu``.
+
+        PDFs of the page that are not downloaded yet are queued in
+        :attr:`fila_pdf` by the same transaction, so a crash never leaves
+        the cursor past a PDF nobody will fetch.
+        """
+        self.armazenamento.sincronizar()
+        with self._lock_pdf:
+            for registro in registros:
+                if registro.pdf is None:
+                    continue
+                if registro.chave in self._pdfs_abertos:
+                    self._pdfs_abertos.discard(registro.chave)
+                else:
+                    registro.pdf = None
+            self._salvar_lote(nsu, registros)
+
+    def _salvar_lote(self, nsu: int, registros: list[RegistroDocumento]) -> None:
+        """Record the written ``registros`` and resume point ``nsu``."""
+        self.state.registrar_lote(self.config.cnpj, nsu, registros)
+
+    def _buscar_lotes(
+        self,
+        sess,
+        nsu: int,
+        entrada: queue.Queue,
+        checkpoint: NSUCheckpoint,
+        stats: StageStats,
+        write: Callable[[str, bool], None],
+        running: Callable[[], bool],
+    ) -> None:
+        """Fetch LoteDFe pages from ``nsu`` and queue their documents.
+
+        Each page is parsed while it streams in, so only one document of
+        it is held in memory before being queued. With ``prefetch_depth``
+        set, pages are read ahead instead (see
+        :meth:`_buscar_lotes_antecipados`).
+        """
+        profundidade = max(0, int(self.config.prefetch_depth))
+        if profundidade:
+            self._buscar_lotes_antecipados(
+                sess, nsu, entrada, checkpoint, stats, write, running, profundidade
+            )
+            return
+        vistos = NSUVistos(nsu)
+
+        def processar(resp, nsu_pagina: int) -> Optional[tuple[int, int, int]]:
+            lido = self._enfileirar_lote(resp, nsu_pagina, vistos, entrada, checkpoint, running)
+            if lido is not None and lido[0]:
+                checkpoint.avancar(lido[2] + 1)
+                vistos.avancar(lido[2])
+            return lido
+
+        self._percorrer_lotes(sess, nsu, processar, stats, write, running)
+
+    def _buscar_lotes_antecipados(
+        self,
+        sess,
+        nsu: int,
+        entrada: queue.Queue,
+        checkpoint: NSUCheckpoint,
+        stats: StageStats,
+        write: Callable[[str, bool], None],
+        running: Callable[[], bool],
+        profundidade: int,
+    ) -> None:
+        """Queue documents while a reader thread fetches pages ahead.
+
+        The next query only depends on the highest NSU of the current
+        page, so the reader requests page N+1 as soon as page N has been
+        read, keeping up to ``profundidade`` pages buffered. A page moves
+        the checkpoint only once all its documents are queued here; pages
+        still buffered when the run stops or fails are discarded, so the
+        saved cursor never skips documents.
+        """
+        paginas: queue.Queue = queue.Queue(maxsize=profundidade)
+        parar = threading.Event()
+        erros: list[BaseException] = []
+
+        def ativo() -> bool:
+            return not parar.is_set() and running()
+
+        def processar(resp, nsu_pagina: int) -> tuple[int, int, int]:
+            leitor = LeitorLote()
+            documentos = list(leitor.iterar(resp.iter_content(CHUNK_SIZE)))
+            if not self._lote_localizado(leitor.campos):
+                return 0, 0, nsu_pagina
+            nbytes = sum(len(d["ArquivoXml"]) for d in documentos)
+            nsu_maior = max([nsu_pagina] + [int(d["NSU"]) for d in documentos])
+            if documentos:
+                paginas.put((documentos, nsu_maior))
+            return len(documentos), nbytes, nsu_maior
+
+        def ler() -> None:
+            try:
+                self._percorrer_lotes(sess, nsu, processar, stats, write, ativo)
+            except BaseException as e:  # re-raised below
+                erros.append(e)
             finally:
-                sess.close()
-                self.session = None
+                paginas.put(FIM)
+
+        leitor = threading.Thread(target=ler, daemon=True, name="nfse-prefetch")
+        leitor.start()
+        vistos = NSUVistos(nsu)
+        # Pages are drained until FIM even after a stop so the reader never blocks.
+        while True:
+            pagina = paginas.get()
+            if pagina is FIM:
+                break
+            if not ativo():
+                parar.set()
+                continue
+            documentos, nsu_maior = pagina
+            for nfse in documentos:
+                if not running():
+                    parar.set()
+                    break
+                nsu_item = int(nfse["NSU"])
+                if not self._fora_do_limite(nsu_item) and vistos.adicionar(nsu_item):
+                    checkpoint.registrar(nsu_item)
+                    entrada.put(nfse)
+            else:
+                checkpoint.avancar(nsu_maior + 1)
+                vistos.avancar(nsu_maior)
+        leitor.join()
+        if erros:
+            raise erros[0]
 
-        write(f"Processo concluído. Total baixados: {total_baixados}", log=True)
+    def _percorrer_lotes(
+        self,
+        sess,
+        nsu: int,
+        processar: Callable[[object, int], Optional[tuple[int, int, int]]],
+        stats: StageStats,
+        write: Callable[[str, bool], None],
+        running: Callable[[], bool],
+    ) -> None:
+        """Request pages from ``nsu`` and hand each 200 response to ``processar``.
+
+        ``processar(resp, nsu)`` returns ``(documentos, bytes, maior NSU)``
+        or ``None`` when stopped. A page whose body breaks mid-stream is
+        requested again, up to ``max_retries`` times in a row. With
+        ``journal_dir`` every page read in full is also appended, as
+        received, to the :class:`DiarioDFe`.
+        """
+        cfg = self.config
+        cnpj = cfg.cnpj
+        diario = self.diario
+        pacer = self.pacer or PacingController.from_config(cfg)
+        falhas = 0
+        while not self._fora_do_limite(nsu) and pacer.aguardar(running):
+            query_nsu = max(0, nsu - 1)
+            url = f"{cfg.dfe_url}/{query_nsu:020d}?cnpj={cnpj}"
+            write(
+                f"Consultando NSU {nsu} (consulta {query_nsu}) para CNPJ {cnpj}...",
+                log=True,
+            )
+            inicio = time.perf_counter()
+            resp = self._consultar(sess, url, pacer, write, running)
+            if resp is None:
+                return
+            try:
+                if resp.status_code == 200:
+                    if diario is not None:
+                        resp = CapturaPagina(resp)
+                    try:
+                        lido = processar(resp, nsu)
+                    except (requests.exceptions.RequestException, ValueError) as e:
+                        # Documents already queued are skipped when the page is retried.
+                        falhas += 1
+                        self.metricas.erros.inc(tipo="leitura")
+                        self.logger.error("Erro ao ler lote: %s", e)
+                        write(f"Erro ao ler lote: {e}", log=True)
+                        if falhas > int(cfg.max_retries):
+                            return
+                        continue
+                    falhas = 0
+                    if lido is None:
+                        return
+                    documentos, nbytes, nsu_maior = lido
+                    if not documentos:
+                        self.logger.error("Resposta inesperada ou nenhum documento localizado.")
+                        write("Resposta inesperada ou nenhum documento localizado.", log=True)
+                        return
+                    self.metricas.paginas.inc()
+                    stats.registrar(inicio, nbytes, itens=documentos)
+                    if diario is not None:
+                        diario.registrar(nsu, nsu_maior, resp.comprimido())
+                    nsu = nsu_maior + 1
+                    write(f"Aguardando {pacer.intervalo:.1f} segundos para o próximo lote...", log=True)
+                elif resp.status_code == 204:
+                    write("Nenhuma nota encontrada. Fim da consulta.", log=True)
+                    return
+                else:
+                    self.logger.error("Erro: %s %s", resp.status_code, resp.text)
+                    write(f"Erro: {resp.status_code} {resp.text}", log=True)
+                    return
+            finally:
+                # Streamed responses only return their connection to the pool once closed.
+                resp.close()
+
+    def _enfileirar_lote(
+        self,
+        resp,
+        nsu: int,
+        vistos: NSUVistos,
+        entrada: queue.Queue,
+        checkpoint: NSUCheckpoint,
+        running: Callable[[], bool],
+    ) -> Optional[tuple[int, int, int]]:
+        """Stream the documents of one page into ``entrada``.
+
+        Documents are held back until ``StatusProcessamento`` has been
+        read, and a page with any other status than
+        ``DOCUMENTOS_LOCALIZADOS`` counts as empty. Returns ``(documentos,
+        bytes, maior NSU)`` or ``None`` if stopped.
+        """
+        leitor = LeitorLote()
+        documentos = nbytes = 0
+        nsu_maior = nsu
+        retidos: list[dict] = []
+
+        def enfileirar(nfse: dict) -> None:
+            nonlocal documentos, nbytes, nsu_maior
+            documentos += 1
+            nsu_item = int(nfse["NSU"])
+            nsu_maior = max(nsu_maior, nsu_item)
+            if self._fora_do_limite(nsu_item) or not vistos.adicionar(nsu_item):
+                return
+            nbytes += len(nfse["ArquivoXml"])
+            checkpoint.registrar(nsu_item)
+            entrada.put(nfse)
+
+        for nfse in leitor.iterar(resp.iter_content(CHUNK_SIZE)):
+            if not running():
+                return None
+            retidos.append(nfse)
+            status = leitor.campos.get(CAMPO_STATUS)
+            if status is None:
+                continue
+            if status != DOCUMENTOS_LOCALIZADOS:
+                break
+            for retido in retidos:
+                enfileirar(retido)
+            retidos.clear()
+        if not self._lote_localizado(leitor.campos):
+            return 0, 0, nsu
+        for retido in retidos:
+            enfileirar(retido)
+        return documentos, nbytes, nsu_maior
+
+    def _lote_localizado(self, campos: dict) -> bool:
+        """Whether a page reports documents; logs what the portal said otherwise."""
+        status = campos.get(CAMPO_STATUS)
+        if status == DOCUMENTOS_LOCALIZADOS:
+            return True
+        self.logger.error(
+            "StatusProcessamento %s: %s", status, campos.get("Erros") or campos.get("Alertas")
+        )
+        return False
+
+    def _fora_do_limite(self, nsu: int) -> bool:
+        """Whether ``nsu`` lies past :attr:`limite`, the last NSU to fetch."""
+        return self.limite is not None and nsu > self.limite
+
+    def _consultar(
+        self,
+        sess,
+        url: str,
+        pacer: PacingController,
+        write: Callable[[str, bool], None],
+        running: Callable[[], bool],
+    ):
+        """GET ``url``, retrying 429/5xx and connection errors with backoff.
+
+        The caller must already hold a ``pacer`` token. Returns the final
+        response, or ``None`` when stopped or out of retries.
+        """
+        cfg = self.config
+        max_retries = int(cfg.max_retries)
+        tentativa = 0
+        while True:
+            espera = 0.0
+            inicio = time.perf_counter()
+            try:
+                resp = sess.get(url, timeout=int(cfg.timeout), stream=True)
+            except requests.exceptions.RequestException as e:
+                self.metricas.erros.inc(tipo="conexao")
+                self.logger.error("Erro de conexão: %s", e)
+                motivo = f"Erro de conexão: {e}"
+            else:
+                self.metricas.latencia.observar(time.perf_counter() - inicio, servico="dfe")
+                self.metricas.respostas.inc(servico="dfe", status=resp.status_code)
+                if resp.status_code != 429 and resp.status_code < 500:
+                    pacer.sucesso()
+                    return resp
+                espera = parse_retry_after(resp.headers.get("Retry-After"))
+                pacer.penalizar(espera)
+                self.logger.error("Erro: %s %s", resp.status_code, resp.text)
+                motivo = f"Erro: {resp.status_code} {resp.text}"
+            tentativa += 1
+            if tentativa > max_retries:
+                write(motivo, log=True)
+                return None
+            espera = espera or pacer.backoff(tentativa)
+            write(
+                f"{motivo}. Nova tentativa em {espera:.1f}s ({tentativa}/{max_retries}).",
+                log=True,
+            )
+            if not dormir(espera, running) or not pacer.aguardar(running):
+                return None
+
+    def _decodificar(self, nfse: dict) -> Documento:
+        """Decode the gzip+base64 ``ArquivoXml`` of a LoteDFe entry.
+
+        Compressed output formats keep the gzip payload and only inflate
+        the beginning of it to find the date (and the indexed fields).
+        Payloads over ``LIMITE_MEMORIA`` are streamed to a spool file in
+        ``output_dir`` instead of being decoded in memory.
+        """
+        m = self.metricas
+        indexar = bool(self.config.index_documents)
+        with m.decodificacao.cronometrar():
+            arquivo = nfse["ArquivoXml"]
+            nsu, chave = int(nfse["NSU"]), nfse["ChaveAcesso"]
+            if len(arquivo) > decodificacao.LIMITE_MEMORIA:
+                return decodificacao.decodificar_em_arquivo(
+                    nsu,
+                    chave,
+                    arquivo,
+                    self.config.output_dir,
+                    self.armazenamento.comprimido,
+                    indexar,
+                )
+            xml_gzip = base64.b64decode(arquivo)
+            if self.armazenamento.comprimido:
+                with m.extrair_data.cronometrar():
+                    ano, mes = datas.extrair_ano_mes_gzip(xml_gzip)
+                campos = campos_ou_nada(xml_gzip, chave, True) if indexar else None
+                return Documento(nsu, chave, b"", ano, mes, gzip_bytes=xml_gzip, campos=campos)
+            xml_bytes = gzip.decompress(xml_gzip)
+            with m.extrair_data.cronometrar():
+                ano, mes = self.extrair_ano_mes(xml_bytes)
+            campos = campos_ou_nada(xml_bytes, chave, False) if indexar else None
+            return Documento(nsu, chave, xml_bytes, ano, mes, campos=campos)
+
+    def _decodificar_lote(self, pool: Executor, lote: list[dict]) -> list[Documento]:
+        """Decode ``lote`` in a worker process of ``pool``."""
+        inicio = time.perf_counter()
+        docs = pool.submit(
+            decodificacao.decodificar_lote,
+            [(int(nfse["NSU"]), nfse["ChaveAcesso"], nfse["ArquivoXml"]) for nfse in lote],
+            self.armazenamento.comprimido,
+            bool(self.config.index_documents),
+            self.config.output_dir,
+        ).result()
+        # Workers cannot record metrics; spread the batch time over its documents.
+        media = (time.perf_counter() - inicio) / len(lote)
+        for _ in docs:
+            self.metricas.decodificacao.observar(media)
+        return docs
+
+    def _gravar(
+        self,
+        doc: Documento,
+        pdf_dl: NFSePDFDownloader,
+        write: Callable[[str, bool], None],
+        running: Callable[[], bool],
+    ) -> RegistroDocumento:
+        """Write ``doc`` to ``output_dir`` and queue its PDF if configured.
+
+        The PDF is submitted even after a stop: the downloader is cancelled
+        by then and hands it to :attr:`fila_pdf`, since the NSU of ``doc``
+        is about to be committed.
+        """
+        cfg = self.config
+        registro = self._gravar_xml(doc, write)
+        if cfg.download_pdf:
+            pdf_file = self._caminho_pdf(doc)
+            self._abrir_pdf(registro, pdf_file)
+            pdf_dl.submeter(doc.chave, pdf_file, self._pdf_callback(write))
+        return registro
+
+    def _abrir_pdf(self, registro: RegistroDocumento, pdf_file: str) -> None:
+        """Attach the PDF of ``registro`` to its row until it is downloaded.
+
+        :meth:`_concluir_lote` writes it to :attr:`fila_pdf` unless the
+        download finished first; if the process dies meanwhile, it is
+        retried after the first backoff.
+        """
+        registro.pdf = PDFPendente(
+            registro.chave, pdf_file, 0, time.time() + self.fila_pdf.atraso(1)
+        )
+        with self._lock_pdf:
+            self._pdfs_abertos.add(registro.chave)
+
+    def _caminho_pdf(self, doc: Documento) -> str:
+        """Return the PDF path that sits next to the XML of ``doc``."""
+        arm = self.armazenamento
+        return os.path.join(arm.diretorio(doc.ano, doc.mes), f"{arm.nome_base(doc)}.pdf")
+
+    def _gravar_xml(
+        self, doc: Documento, write: Callable[[str, bool], None]
+    ) -> RegistroDocumento:
+        """Write the XML of ``doc`` and return its state row."""
+        write(f"NSU {doc.nsu}", log=True)
+        anterior = self.state.documento(self.config.cnpj, doc.nsu)
+        with self.metricas.gravacao.cronometrar():
+            gravacao = self.armazenamento.gravar(doc, anterior)
+        self.metricas.documentos.inc()
+        self.metricas.bytes.inc(gravacao.nbytes, tipo="xml")
+        if gravacao.acao == "inalterado":
+            write(f"XML inalterado: {gravacao.caminho}", log=True)
+        else:
+            write(f"XML Baixado e {gravacao.acao}: {gravacao.caminho}", log=True)
+        return RegistroDocumento(
+            doc.nsu, doc.chave, gravacao.acao, gravacao.caminho, gravacao.sha256, doc.campos
+        )
+
+    def _pdf_callback(
+        self, write: Callable[[str, bool], None]
+    ) -> Callable[[str, str, bool, bool, float], None]:
+        """Return the completion callback used for queued PDF downloads.
+
+        Failed downloads go to :attr:`fila_pdf` to be retried later.
+        """
+        fila = self.fila_pdf
+
+        def concluido(chave: str, pdf_file: str, ok: bool, existed: bool, segundos: float) -> None:
+            if ok:
+                with self._lock_pdf:
+                    self._pdfs_abertos.discard(chave)
+                    fila.concluiu(chave)
+                action = "substituído" if existed else "salvo"
+                write(f"PDF baixado e {action}: {pdf_file} ({segundos:.2f}s)", log=True)
+            else:
+                pendente = fila.falhou(chave, pdf_file)
+                write(
+                    f"Falha ao baixar PDF: {chave}. Nova tentativa em "
+                    f"{pendente.proxima_em - time.time():.0f}s.",
+                    log=True,
+                )
+
+        return concluido
 
     def close(self) -> None:
-        """Close the internal requests session if it exists."""
+        """Close the internal requests session and open archives."""
+        if self._armazenamento is not None:
+            self._armazenamento.close()
         if self.session is not None:
             try:
                 self.session.close()
@@ -258,3 +906,12 @@ class NFSeDownloader:
                 self.session = None
 
 
+def criar_downloader(config: Config, state: Optional[StateStore] = None) -> NFSeDownloader:
+    """Return the download engine selected by ``config.engine``."""
+    if config.engine == "asyncio":
+        from .async_downloader import AsyncNFSeDownloader
+
+        return AsyncNFSeDownloader(config, state)
+    if config.engine != "threads":
+        raise ValueError(f"Motor de download desconhecido: {config.engine}")
+    return NFSeDownloader(config, state)
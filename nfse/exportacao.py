@@ -0,0 +1,183 @@
+from __future__ import annotations
+
+import csv
+import logging
+import os
+import threading
+from dataclasses import asdict, dataclass, fields
+from typing import Callable, Optional
+
+from . import datas
+from .campos import VALORES, CamposNFSe, extrair_campos
+from .config import Config
+from .state import RegistroDocumento, StateStore
+from .storage import ler_xml
+
+FORMATOS_EXPORTACAO = ("csv", "parquet")
+"""Values accepted by ``Config.export_format``."""
+
+LOTE_EXPORTACAO = 5000
+"""Documents read between two part files and state store updates."""
+
+COLUNAS = ("nsu",) + tuple(f.name for f in fields(CamposNFSe))
+"""Columns of every part file; ``cnpj``, ``ano`` and ``mes`` are in its path."""
+
+
+def _pyarrow():
+    """Import ``pyarrow`` on demand; it is only needed for Parquet."""
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError as e:
+        raise RuntimeError(
+            "A exportação Parquet requer o pacote pyarrow (pip install pyarrow)."
+        ) from e
+    return pyarrow
+
+
+@dataclass
+class ExportacaoStats:
+    """Documents handled by an export."""
+
+    exportados: int = 0
+    falhas: int = 0
+    arquivos: int = 0
+
+    def resumo(self) -> str:
+        return (
+            f"Exportação: {self.exportados} documentos em {self.arquivos} arquivos, "
+            f"{self.falhas} falhas"
+        )
+
+
+class Exportador:
+    """Append the key fields of downloaded documents to a partitioned dataset.
+
+    Rows go to ``<export_dir>/cnpj=<cnpj>/ano=<AAAA>/mes=<MM>/`` (the
+    Hive layout read by pandas, pyarrow, DuckDB and Spark) as one
+    ``part-<primeiro NSU>-<último NSU>`` file per partition and batch.
+    Exported NSUs are recorded in the state store, so each run only
+    handles the documents written since the previous export. Rows are
+    built from the query index; only documents missing from it are read
+    from disk. A document rewritten with new content is exported again
+    in a new part; readers should keep, for each ``nsu``, the row of the
+    most recently written part. A part file is written under a temporary name and
+    renamed before its NSUs are recorded; a batch interrupted in between
+    is exported again under the same name.
+    """
+
+    def __init__(
+        self,
+        config: Config,
+        state: Optional[StateStore] = None,
+        formato: Optional[str] = None,
+        destino: Optional[str] = None,
+    ):
+        self.config = config
+        self.formato = formato or config.export_format
+        if self.formato not in FORMATOS_EXPORTACAO:
+            raise ValueError(f"Formato de exportação desconhecido: {self.formato}")
+        if self.formato == "parquet":
+            _pyarrow()
+        self.destino = destino or config.export_dir
+        self._state = state
+        self.logger = logging.getLogger(__name__)
+
+    @property
+    def state(self) -> StateStore:
+        if self._state is None:
+            self._state = StateStore(self.config.state_db)
+        return self._state
+
+    def _ler(self, registro: RegistroDocumento) -> tuple[tuple[str, str], dict]:
+        """Return the partition and the row of one stored document."""
+        campos = registro.campos
+        ano_mes = campos.ano_mes if campos is not None else None
+        if ano_mes is None:
+            xml_bytes = ler_xml(registro.caminho)
+            campos = campos or extrair_campos(xml_bytes, registro.chave)
+            ano_mes = campos.ano_mes or datas.extrair_ano_mes(xml_bytes)
+        return ano_mes, {"nsu": registro.nsu, **asdict(campos)}
+
+    def run(
+        self,
+        write: Callable[[str, bool], None] = lambda msg, log=True: None,
+        running: Callable[[], bool] = lambda: True,
+        cnpj: Optional[str] = None,
+    ) -> ExportacaoStats:
+        """Export every document of ``cnpj`` not exported yet."""
+        cnpj = cnpj or self.config.cnpj
+        stats = ExportacaoStats()
+        apos = -1
+        while running():
+            registros = self.state.documentos_para_exportar(cnpj, apos, LOTE_EXPORTACAO)
+            if not registros:
+                break
+            apos = registros[-1].nsu
+            particoes: dict[tuple[str, str], list[dict]] = {}
+            for registro in registros:
+                try:
+                    particao, linha = self._ler(registro)
+                except (OSError, KeyError, ValueError) as e:
+                    # Left unmarked, so the next export tries it again.
+                    stats.falhas += 1
+                    self.logger.error("Erro ao exportar NSU %s: %s", registro.nsu, e)
+                    write(f"Erro ao exportar {registro.caminho}: {e}", log=True)
+                    continue
+                particoes.setdefault(particao, []).append(linha)
+            nsus = []
+            for (ano, mes), linhas in sorted(particoes.items()):
+                self._gravar_parte(cnpj, ano, mes, linhas)
+                stats.arquivos += 1
+                nsus.extend(linha["nsu"] for linha in linhas)
+            self.state.marcar_exportados(cnpj, nsus)
+            stats.exportados += len(nsus)
+            write(f"{stats.exportados} documentos exportados.", log=True)
+        return stats
+
+    def diretorio(self, cnpj: str, ano: str, mes: str) -> str:
+        """Return the partition directory of ``cnpj`` for ``ano``/``mes``."""
+        return os.path.join(self.destino, f"cnpj={cnpj}", f"ano={ano}", f"mes={mes}")
+
+    def _gravar_parte(self, cnpj: str, ano: str, mes: str, linhas: list[dict]) -> str:
+        diretorio = self.diretorio(cnpj, ano, mes)
+        os.makedirs(diretorio, exist_ok=True)
+        nome = f"part-{linhas[0]['nsu']:020d}-{linhas[-1]['nsu']:020d}.{self.formato}"
+        caminho = os.path.join(diretorio, nome)
+        tmp = f"{caminho}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            if self.formato == "parquet":
+                self._gravar_parquet(tmp, linhas)
+            else:
+                self._gravar_csv(tmp, linhas)
+            os.replace(tmp, caminho)
+        except BaseException:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            raise
+        return caminho
+
+    @staticmethod
+    def _gravar_csv(caminho: str, linhas: list[dict]) -> None:
+        with open(caminho, "w", encoding="utf-8", newline="") as f:
+            escritor = csv.DictWriter(f, fieldnames=COLUNAS)
+            escritor.writeheader()
+            escritor.writerows(linhas)
+            f.flush()
+            os.fsync(f.fileno())
+
+    @staticmethod
+    def _gravar_parquet(caminho: str, linhas: list[dict]) -> None:
+        pa = _pyarrow()
+        esquema = pa.schema(
+            [
+                (c, pa.int64() if c == "nsu" else pa.float64() if c in VALORES else pa.string())
+                for c in COLUNAS
+            ]
+        )
+        with open(caminho, "wb") as f:
+            pa.parquet.write_table(pa.Table.from_pylist(linhas, schema=esquema), f)
+            f.flush()
+            os.fsync(f.fileno())
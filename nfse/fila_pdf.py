@@ -0,0 +1,168 @@
+from __future__ import annotations
+
+import logging
+import random
+import threading
+import time
+from typing import Callable, Optional
+
+from .config import Config
+from .pdf_downloader import NFSePDFDownloader
+from .state import PDFPendente, StateStore
+
+INTERVALO_VERIFICACAO = 30.0
+"""Longest sleep of the background worker between two looks at the queue."""
+
+
+class FilaPDF:
+    """Durable queue of pending DANFSe downloads, kept in the state store.
+
+    A run queues the PDFs of each page together with its NSU and removes
+    them as they are downloaded, so whatever failed or was still in flight
+    when the process stopped is retried later.
+    Each failure of a ``chave`` increments its attempt count and schedules
+    the next try ``backoff * 2 ** (tentativas - 1)`` seconds later (capped
+    at ``backoff_max``, with 20% jitter so an outage does not end in a
+    burst). After ``max_tentativas`` failures the entry stays in the queue
+    for inspection but is no longer retried automatically.
+    """
+
+    def __init__(
+        self,
+        state: StateStore,
+        cnpj: str,
+        backoff: float = 60.0,
+        backoff_max: float = 6 * 3600.0,
+        max_tentativas: int = 10,
+    ):
+        self.state = state
+        self.cnpj = cnpj
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.max_tentativas = max_tentativas
+        self.logger = logging.getLogger(__name__)
+
+    @classmethod
+    def from_config(cls, state: StateStore, config: Config) -> "FilaPDF":
+        return cls(
+            state,
+            config.cnpj,
+            float(config.pdf_retry_backoff_seconds),
+            float(config.pdf_retry_backoff_max_seconds),
+            int(config.pdf_retry_max_attempts),
+        )
+
+    def atraso(self, tentativas: int) -> float:
+        """Seconds to wait after ``tentativas`` failures."""
+        base = min(self.backoff_max, self.backoff * 2 ** max(0, tentativas - 1))
+        return base * random.uniform(0.8, 1.2)
+
+    def falhou(self, chave: str, destino: str, erro: Optional[str] = None) -> PDFPendente:
+        """Record a failed download of ``chave`` and schedule its retry."""
+        return self.state.adiar_pdf(self.cnpj, chave, destino, self.atraso, erro)
+
+    def concluiu(self, chave: str) -> None:
+        """Forget ``chave`` after a successful download."""
+        self.state.remover_pdf(self.cnpj, chave)
+
+    def vencidos(self, todos: bool = False, limite: int = 100) -> list[PDFPendente]:
+        """Return entries whose retry time has come (every retriable one with ``todos``)."""
+        return self.state.pdfs_pendentes(
+            self.cnpj, None if todos else time.time(), self.max_tentativas, limite
+        )
+
+    def espera(self) -> Optional[float]:
+        """Seconds until the next retry is due, or ``None`` if nothing is queued."""
+        proximos = self.state.pdfs_pendentes(self.cnpj, None, self.max_tentativas, 1)
+        if not proximos:
+            return None
+        return max(0.0, proximos[0].proxima_em - time.time())
+
+    def drenar(
+        self,
+        pdf_dl: NFSePDFDownloader,
+        write: Callable[[str, bool], None] = lambda msg, log=True: None,
+        running: Callable[[], bool] = lambda: True,
+        todos: bool = False,
+    ) -> tuple[int, int]:
+        """Retry every due entry with ``pdf_dl`` and return ``(ok, falhas)``."""
+        resultado = [0, 0]
+        lock = threading.Lock()
+
+        def concluido(chave: str, destino: str, ok: bool, existed: bool, segundos: float) -> None:
+            with lock:
+                resultado[0 if ok else 1] += 1
+            if ok:
+                self.concluiu(chave)
+                write(f"PDF baixado na nova tentativa: {destino} ({segundos:.2f}s)", log=True)
+            else:
+                pendente = self.falhou(chave, destino, "falha no download")
+                write(
+                    f"Falha ao baixar PDF: {chave} (tentativa {pendente.tentativas}, "
+                    f"próxima em {pendente.proxima_em - time.time():.0f}s)",
+                    log=True,
+                )
+
+        vistos: set[str] = set()
+        try:
+            while running():
+                # Entries still in flight are due too; skip past them.
+                lote = [
+                    p
+                    for p in self.vencidos(todos, limite=len(vistos) + 100)
+                    if p.chave not in vistos
+                ]
+                if not lote:
+                    break
+                for pendente in lote:
+                    if not running():
+                        break
+                    vistos.add(pendente.chave)
+                    pdf_dl.submeter(pendente.chave, pendente.destino, concluido)
+        finally:
+            if not running():
+                pdf_dl.cancelar()
+            pdf_dl.aguardar()
+        return resultado[0], resultado[1]
+
+
+class TrabalhadorFilaPDF:
+    """Background thread draining a :class:`FilaPDF` while a run is active."""
+
+    def __init__(
+        self,
+        fila: FilaPDF,
+        pdf_dl: NFSePDFDownloader,
+        write: Callable[[str, bool], None],
+        running: Callable[[], bool],
+    ):
+        self.fila = fila
+        self.pdf_dl = pdf_dl
+        self.write = write
+        self.running = running
+        self._parar = threading.Event()
+        self._thread = threading.Thread(target=self._loop, daemon=True, name="nfse-fila-pdf")
+
+    def _ativo(self) -> bool:
+        return not self._parar.is_set() and self.running()
+
+    def _loop(self) -> None:
+        while self._ativo():
+            try:
+                self.fila.drenar(self.pdf_dl, self.write, self._ativo)
+                espera = self.fila.espera()
+            except Exception as e:
+                self.fila.logger.error("Erro na fila de PDFs: %s", e)
+                espera = None
+            if espera is None:
+                espera = INTERVALO_VERIFICACAO
+            self._parar.wait(min(max(espera, 0.1), INTERVALO_VERIFICACAO))
+
+    def iniciar(self) -> "TrabalhadorFilaPDF":
+        self._thread.start()
+        return self
+
+    def parar(self) -> None:
+        """Stop after the downloads in flight finish."""
+        self._parar.set()
+        self._thread.join()
@@ -0,0 +1,105 @@
+from __future__ import annotations
+
+import logging
+import os
+from dataclasses import dataclass
+from typing import Callable, Optional, Union
+
+from . import decodificacao
+from .campos import CamposNFSe, extrair_campos
+from .config import Config
+from .state import StateStore
+from .storage import ler_xml
+
+LOTE_INDICE = 500
+"""Documents read by a worker process between two state store updates."""
+
+
+def indexar_arquivos(itens: list[tuple[str, str]]) -> list[Union[CamposNFSe, str]]:
+    """Return the fields of each stored ``(caminho, chave)``; runs in a worker process.
+
+    A document that cannot be read yields the error message instead.
+    """
+    resultado: list[Union[CamposNFSe, str]] = []
+    for caminho, chave in itens:
+        try:
+            resultado.append(extrair_campos(ler_xml(caminho), chave))
+        except (OSError, KeyError, ValueError) as e:
+            resultado.append(str(e) or type(e).__name__)
+    return resultado
+
+
+@dataclass
+class ReindexacaoStats:
+    """Documents handled by an index rebuild."""
+
+    indexados: int = 0
+    falhas: int = 0
+
+    def resumo(self) -> str:
+        return f"Índice: {self.indexados} documentos indexados, {self.falhas} falhas"
+
+
+class ReconstrucaoIndice:
+    """Rebuild the query index from the documents already on disk.
+
+    The index is normally filled as ``run`` writes each document; this is
+    for archives downloaded before it existed, or after
+    ``index_documents`` was turned off. Every document with a stored
+    path is read again by a pool of ``workers`` processes (one per CPU by
+    default), in batches of :data:`LOTE_INDICE`, and the rows of each
+    batch are written in one transaction. Rows are replaced, so an
+    interrupted rebuild can simply be started again.
+    """
+
+    def __init__(self, config: Config, state: Optional[StateStore] = None, workers: int = 0):
+        self.config = config
+        self.workers = max(1, workers or os.cpu_count() or 1)
+        self._state = state
+        self.logger = logging.getLogger(__name__)
+
+    @property
+    def state(self) -> StateStore:
+        if self._state is None:
+            self._state = StateStore(self.config.state_db)
+        return self._state
+
+    def run(
+        self,
+        write: Callable[[str, bool], None] = lambda msg, log=True: None,
+        running: Callable[[], bool] = lambda: True,
+    ) -> ReindexacaoStats:
+        """Read every stored document and replace its index row."""
+        stats = ReindexacaoStats()
+        documentos = self.state.documentos_armazenados()
+        lotes = [
+            documentos[i : i + LOTE_INDICE] for i in range(0, len(documentos), LOTE_INDICE)
+        ]
+        write(
+            f"Reindexando {len(documentos)} documentos com {self.workers} processos.", log=True
+        )
+        pool = decodificacao.criar_pool(self.workers)
+        try:
+            futuros = [
+                pool.submit(indexar_arquivos, [(caminho, chave) for _, _, chave, caminho in lote])
+                for lote in lotes
+            ]
+            for lote, futuro in zip(lotes, futuros):
+                if not running():
+                    write("Reindexação interrompida; execute novamente para continuar.", log=True)
+                    break
+                por_cnpj: dict[str, list[tuple[int, CamposNFSe]]] = {}
+                for (cnpj, nsu, _chave, caminho), campos in zip(lote, futuro.result()):
+                    if isinstance(campos, str):
+                        stats.falhas += 1
+                        self.logger.error("Erro ao indexar NSU %s: %s", nsu, campos)
+                        write(f"Erro ao indexar {caminho}: {campos}", log=True)
+                        continue
+                    por_cnpj.setdefault(cnpj, []).append((nsu, campos))
+                for cnpj, entradas in por_cnpj.items():
+                    self.state.indexar(cnpj, entradas)
+                    stats.indexados += len(entradas)
+                write(f"{stats.indexados}/{len(documentos)} documentos indexados.", log=True)
+        finally:
+            pool.shutdown(wait=True, cancel_futures=True)
+        return stats
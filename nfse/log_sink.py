@@ -0,0 +1,48 @@
+from __future__ import annotations
+
+import threading
+from collections import deque
+from typing import Optional
+
+
+class LogSink:
+    """Bounded, non-blocking buffer between download threads and a GUI.
+
+    Worker threads call :meth:`push`, which only appends under a short
+    lock and never waits on the GUI. The GUI thread periodically calls
+    :meth:`drain` and renders the lines in one batch. When the GUI falls
+    behind, the oldest pending lines are dropped and counted.
+    """
+
+    def __init__(self, max_pendentes: int = 5000):
+        self._lock = threading.Lock()
+        self._linhas: deque[str] = deque()
+        self.max_pendentes = max_pendentes
+        self.descartadas = 0
+        self.status: Optional[str] = None
+
+    def push(self, linha: str, status: Optional[str] = None) -> None:
+        """Queue ``linha`` and remember ``status`` as the latest status text."""
+        with self._lock:
+            if len(self._linhas) >= self.max_pendentes:
+                self._linhas.popleft()
+                self.descartadas += 1
+            self._linhas.append(linha)
+            if status is not None:
+                self.status = status
+
+    def drain(self, limite: Optional[int] = None) -> list[str]:
+        """Return and remove up to ``limite`` pending lines (all by default)."""
+        with self._lock:
+            if limite is None or limite >= len(self._linhas):
+                linhas = list(self._linhas)
+                self._linhas.clear()
+            else:
+                linhas = [self._linhas.popleft() for _ in range(limite)]
+        return linhas
+
+    def clear(self) -> None:
+        """Drop every pending line."""
+        with self._lock:
+            self._linhas.clear()
+            self.status = None
@@ -0,0 +1,190 @@
+from __future__ import annotations
+
+import json
+import re
+from typing import Iterable, Iterator
+
+CAMPO_LOTE = "LoteDFe"
+CAMPO_STATUS = "StatusProcessamento"
+DOCUMENTOS_LOCALIZADOS = "DOCUMENTOS_LOCALIZADOS"
+"""Status of a page that carries documents."""
+CHUNK_SIZE = 64 * 1024
+
+_ESPACOS = b" \t\n\r"
+_ESPECIAIS = re.compile(rb'[\[\]{}"]')
+_ESPECIAIS_STRING = re.compile(rb'["\\]')
+_FIM_ESCALAR = re.compile(rb"[,\]}\s]")
+
+
+class LeitorLote:
+    """Incremental parser of a DFe distribution response.
+
+    Feed the body in chunks with :meth:`alimentar`; each call returns the
+    ``LoteDFe`` entries completed so far, so only one document (plus the
+    unread tail of the chunk) is held in memory at a time. The other
+    top-level fields, such as ``StatusProcessamento``, end up in
+    :attr:`campos`.
+
+    Each byte is scanned once: a value split over many chunks is only
+    decoded after its closing delimiter has arrived.
+    """
+
+    def __init__(self):
+        self._buf = bytearray()
+        self._pos = 0
+        self._estado = "inicio"
+        self._chave = ""
+        self._varredura = -1
+        self._profundidade = 0
+        self._em_string = False
+        self._escalar = False
+        self.campos: dict = {}
+
+    def _pular_espacos(self) -> bool:
+        """Skip whitespace; returns ``False`` when the buffer is exhausted."""
+        buf, pos = self._buf, self._pos
+        while pos < len(buf) and buf[pos] in _ESPACOS:
+            pos += 1
+        self._pos = pos
+        return pos < len(buf)
+
+    def _delimitar(self) -> int:
+        """Return the end of the value at the cursor, or ``-1`` if it is incomplete.
+
+        Scanning resumes where the previous call stopped, tracking the
+        nesting depth and whether it is inside a string. A number or
+        literal must be followed by a delimiter so that one split between
+        chunks is not taken for a shorter one.
+        """
+        buf = self._buf
+        if self._varredura < 0:
+            self._escalar = buf[self._pos] not in b'{["'
+            self._profundidade = 0
+            self._em_string = False
+            self._varredura = self._pos
+        i = self._varredura
+        if self._escalar:
+            m = _FIM_ESCALAR.search(buf, i)
+            if m is None:
+                self._varredura = len(buf)
+                return -1
+            return m.start()
+        profundidade, em_string = self._profundidade, self._em_string
+        fim = -1
+        while True:
+            m = (_ESPECIAIS_STRING if em_string else _ESPECIAIS).search(buf, i)
+            if m is None:
+                i = len(buf)
+                break
+            j = m.start()
+            c = buf[j : j + 1]
+            if em_string:
+                if c == b"\\":
+                    if j + 1 == len(buf):
+                        i = j
+                        break
+                    i = j + 2
+                    continue
+                em_string = False
+            elif c == b'"':
+                em_string = True
+            elif c in b"[{":
+                profundidade += 1
+            else:
+                profundidade -= 1
+            i = j + 1
+            if profundidade == 0 and not em_string:
+                fim = i
+                break
+        self._varredura = i
+        self._profundidade, self._em_string = profundidade, em_string
+        return fim
+
+    def _valor(self):
+        """Decode the value at the cursor, or return ``_INCOMPLETO``."""
+        fim = self._delimitar()
+        if fim < 0:
+            return _INCOMPLETO
+        self._varredura = -1
+        try:
+            valor = json.loads(self._buf[self._pos : fim])
+        except ValueError as e:
+            raise ValueError("JSON inválido na resposta do lote") from e
+        self._pos = fim
+        return valor
+
+    def alimentar(self, dados: bytes) -> list[dict]:
+        """Parse ``dados`` and return the ``LoteDFe`` entries it completed."""
+        if self._pos:
+            del self._buf[: self._pos]
+            if self._varredura >= 0:
+                self._varredura -= self._pos
+            self._pos = 0
+        self._buf += dados
+        documentos: list[dict] = []
+        while self._pular_espacos():
+            c = self._buf[self._pos : self._pos + 1]
+            estado = self._estado
+            if estado == "inicio":
+                if c != b"{":
+                    raise ValueError("Resposta do lote não é um objeto JSON")
+                self._pos += 1
+                self._estado = "chave"
+            elif estado == "chave":
+                if c == b"}":
+                    self._pos += 1
+                    self._estado = "fim"
+                    continue
+                if c == b",":
+                    self._pos += 1
+                    continue
+                chave = self._valor()
+                if chave is _INCOMPLETO:
+                    break
+                self._chave = chave
+                self._estado = "dois_pontos"
+            elif estado == "dois_pontos":
+                if c != b":":
+                    raise ValueError("JSON inválido na resposta do lote")
+                self._pos += 1
+                self._estado = "valor"
+            elif estado == "valor":
+                if self._chave == CAMPO_LOTE and c == b"[":
+                    self._pos += 1
+                    self._estado = "lote"
+                    continue
+                valor = self._valor()
+                if valor is _INCOMPLETO:
+                    break
+                self.campos[self._chave] = valor
+                self._estado = "chave"
+            elif estado == "lote":
+                if c == b"]":
+                    self._pos += 1
+                    self._estado = "chave"
+                    continue
+                if c == b",":
+                    self._pos += 1
+                    continue
+                doc = self._valor()
+                if doc is _INCOMPLETO:
+                    break
+                documentos.append(doc)
+            else:
+                raise ValueError("Dados após o fim da resposta do lote")
+        return documentos
+
+    def finalizar(self) -> None:
+        """Check that the whole response was read."""
+        if self._estado != "fim":
+            raise ValueError("Resposta do lote incompleta")
+
+    def iterar(self, chunks: Iterable[bytes]) -> Iterator[dict]:
+        """Yield every ``LoteDFe`` entry from ``chunks`` as soon as it is complete."""
+        for chunk in chunks:
+            if chunk:
+                yield from self.alimentar(chunk)
+        self.finalizar()
+
+
+_INCOMPLETO = object()
@@ -0,0 +1,263 @@
+from __future__ import annotations
+
+import bisect
+import logging
+import math
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Iterator, Optional
+
+Rotulos = tuple[tuple[str, str], ...]
+
+BUCKETS_PADRAO = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _formatar(nome: str, rotulos: Rotulos) -> str:
+    if not rotulos:
+        return nome
+    corpo = ",".join(
+        '{}="{}"'.format(k, v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for k, v in rotulos
+    )
+    return f"{nome}{{{corpo}}}"
+
+
+def _numero(valor: float) -> str:
+    if math.isinf(valor):
+        return "+Inf"
+    return repr(float(valor)) if not float(valor).is_integer() else str(int(valor))
+
+
+class _Familia:
+    """Metric family whose samples are keyed by their label set.
+
+    :meth:`vincular` returns a view with extra fixed labels that shares
+    the storage of the family, so per-CNPJ views all show up in one
+    exposition.
+    """
+
+    tipo = ""
+
+    def __init__(self, nome: str, ajuda: str, _fixos: Rotulos = (), _base=None):
+        self.nome = nome
+        self.ajuda = ajuda
+        self._fixos = _fixos
+        self._base = _base or self
+        if _base is None:
+            self._lock = threading.Lock()
+            self._valores: dict = {}
+
+    def vincular(self, **rotulos: str):
+        fixos = tuple(sorted(dict(self._fixos, **rotulos).items()))
+        vista = object.__new__(type(self))
+        vista.__dict__.update(self.__dict__)
+        vista._fixos = fixos
+        return vista
+
+    def _chave(self, rotulos: dict) -> Rotulos:
+        return tuple(sorted(dict(self._fixos, **{k: str(v) for k, v in rotulos.items()}).items()))
+
+    def _casa(self, chave: Rotulos) -> bool:
+        return set(self._fixos) <= set(chave)
+
+
+class Contador(_Familia):
+    """Monotonic counter."""
+
+    tipo = "counter"
+
+    def inc(self, valor: float = 1, **rotulos) -> None:
+        chave = self._chave(rotulos)
+        base = self._base
+        with base._lock:
+            base._valores[chave] = base._valores.get(chave, 0) + valor
+
+    def amostras(self) -> Iterator[tuple[str, Rotulos, float]]:
+        base = self._base
+        with base._lock:
+            itens = sorted(base._valores.items())
+        for chave, valor in itens:
+            if self._casa(chave):
+                yield self.nome, chave, valor
+
+
+class Histograma(_Familia):
+    """Cumulative histogram with fixed upper bounds (in seconds)."""
+
+    tipo = "histogram"
+
+    def __init__(self, nome: str, ajuda: str, buckets=BUCKETS_PADRAO, **kw):
+        super().__init__(nome, ajuda, **kw)
+        self.buckets = tuple(buckets)
+
+    def observar(self, valor: float, **rotulos) -> None:
+        chave = self._chave(rotulos)
+        base = self._base
+        with base._lock:
+            contagens, soma = base._valores.get(chave, ([0] * (len(self.buckets) + 1), 0.0))
+            contagens[bisect.bisect_left(self.buckets, valor)] += 1
+            base._valores[chave] = (contagens, soma + valor)
+
+    @contextmanager
+    def cronometrar(self, **rotulos) -> Iterator[None]:
+        """Observe the time spent inside the ``with`` block."""
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observar(time.perf_counter() - inicio, **rotulos)
+
+    def amostras(self) -> Iterator[tuple[str, Rotulos, float]]:
+        base = self._base
+        with base._lock:
+            itens = sorted((k, (list(c), s)) for k, (c, s) in base._valores.items())
+        for chave, (contagens, soma) in itens:
+            if not self._casa(chave):
+                continue
+            acumulado = 0
+            for limite, n in zip(self.buckets + (math.inf,), contagens):
+                acumulado += n
+                yield f"{self.nome}_bucket", chave + (("le", _numero(limite)),), acumulado
+            yield f"{self.nome}_count", chave, acumulado
+            yield f"{self.nome}_sum", chave, soma
+
+
+class Metricas:
+    """Counters and histograms recorded by the download engines."""
+
+    def __init__(self):
+        self.paginas = Contador("nfse_paginas_total", "Páginas LoteDFe com documentos recebidas.")
+        self.documentos = Contador("nfse_documentos_total", "Documentos gravados.")
+        self.pdfs = Contador("nfse_pdfs_total", "Downloads de PDF por resultado.")
+        self.bytes = Contador("nfse_bytes_total", "Bytes gravados por tipo de arquivo.")
+        self.respostas = Contador(
+            "nfse_http_respostas_total", "Respostas HTTP por serviço e status."
+        )
+        self.requisicoes = Contador(
+            "nfse_http_requisicoes_total", "Requisições HTTP enviadas por host."
+        )
+        self.conexoes = Contador(
+            "nfse_http_conexoes_total", "Conexões HTTP abertas por host (as demais reutilizam uma aberta)."
+        )
+        self.erros = Contador("nfse_erros_total", "Erros por tipo.")
+        self.latencia = Histograma(
+            "nfse_http_latencia_segundos", "Latência das requisições HTTP por serviço."
+        )
+        self.decodificacao = Histograma(
+            "nfse_decodificacao_segundos", "Tempo de base64 + gzip + data por documento."
+        )
+        self.extrair_data = Histograma(
+            "nfse_extrair_ano_mes_segundos", "Tempo de extração da data por documento."
+        )
+        self.gravacao = Histograma(
+            "nfse_gravacao_segundos", "Tempo de gravação em disco por documento."
+        )
+
+    def familias(self) -> list[_Familia]:
+        return [v for v in vars(self).values() if isinstance(v, _Familia)]
+
+    def vincular(self, **rotulos: str) -> "Metricas":
+        """Return a view that adds ``rotulos`` to every sample it records."""
+        vista = object.__new__(Metricas)
+        for nome, familia in vars(self).items():
+            setattr(vista, nome, familia.vincular(**rotulos))
+        return vista
+
+    def exposicao(self) -> str:
+        """Return every sample in the Prometheus text format."""
+        linhas = []
+        for familia in self.familias():
+            linhas.append(f"# HELP {familia.nome} {familia.ajuda}")
+            linhas.append(f"# TYPE {familia.nome} {familia.tipo}")
+            for nome, rotulos, valor in familia.amostras():
+                linhas.append(f"{_formatar(nome, rotulos)} {_numero(valor)}")
+        return "\n".join(linhas) + "\n"
+
+    def amostras(self) -> dict[str, float]:
+        """Return counter values and histogram counts/sums by sample name."""
+        return {
+            _formatar(nome, rotulos): valor
+            for familia in self.familias()
+            for nome, rotulos, valor in familia.amostras()
+            if not nome.endswith("_bucket")
+        }
+
+    def resumo(self, antes: Optional[dict[str, float]] = None) -> dict[str, float]:
+        """Return the samples that changed since ``antes`` (an :meth:`amostras`)."""
+        antes = antes or {}
+        resumo = {}
+        for chave, valor in self.amostras().items():
+            delta = valor - antes.get(chave, 0)
+            if delta:
+                resumo[chave] = round(delta, 6)
+        return resumo
+
+
+REGISTRO = Metricas()
+"""Process-wide registry used by the engines unless given another one."""
+
+
+class ServidorMetricas:
+    """Background HTTP server exposing a registry on ``/metrics``."""
+
+    def __init__(self, metricas: Metricas, porta: int, host: str = "127.0.0.1"):
+        self.metricas = metricas
+        self._server = ThreadingHTTPServer((host, porta), self._handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def porta(self) -> int:
+        return self._server.server_address[1]
+
+    def _handler(self) -> type[BaseHTTPRequestHandler]:
+        metricas = self.metricas
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args) -> None:
+                pass
+
+            def do_GET(self) -> None:
+                if self.path.split("?", 1)[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                corpo = metricas.exposicao().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(corpo)))
+                self.end_headers()
+                self.wfile.write(corpo)
+
+        return Handler
+
+    def iniciar(self) -> "ServidorMetricas":
+        self._thread.start()
+        return self
+
+    def parar(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+
+_servidores: dict[int, ServidorMetricas] = {}
+_servidores_lock = threading.Lock()
+
+
+def iniciar_servidor(porta: int, metricas: Metricas = REGISTRO) -> Optional[ServidorMetricas]:
+    """Start (once per port) the ``/metrics`` endpoint; ``porta <= 0`` disables it."""
+    if porta <= 0:
+        return None
+    with _servidores_lock:
+        servidor = _servidores.get(porta)
+        if servidor is None:
+            try:
+                servidor = ServidorMetricas(metricas, porta).iniciar()
+            except OSError as e:
+                logging.getLogger(__name__).error(
+                    "Não foi possível abrir /metrics na porta %s: %s", porta, e
+                )
+                return None
+            _servidores[porta] = servidor
+        return servidor
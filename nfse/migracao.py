@@ -0,0 +1,166 @@
+from __future__ import annotations
+
+import logging
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+from .config import Config
+from .state import StateStore
+from .storage import SEPARADOR_MEMBRO, sha256_arquivo, subdiretorio
+
+LOTE_MIGRACAO = 500
+"""Files moved between two state store updates."""
+
+
+@dataclass
+class MigracaoStats:
+    """Files handled by a layout migration."""
+
+    movidos: int = 0
+    duplicados: int = 0
+    conflitos: int = 0
+    reparados: int = 0
+
+    def resumo(self) -> str:
+        return (
+            f"Migração: {self.movidos} arquivos movidos, {self.duplicados} duplicados "
+            f"removidos, {self.conflitos} conflitos, {self.reparados} registros reparados"
+        )
+
+
+class MigracaoLayout:
+    """Move a flat ``output_dir`` into the directories of ``output_layout``.
+
+    Every XML, ``.xml.gz``, PDF and monthly ``.tar`` left directly in
+    ``output_dir`` is renamed into its layout directory by a pool of
+    ``workers`` threads. After each batch the state rows pointing at the
+    moved files are updated in one transaction. Rows whose file was moved
+    but not yet updated (a crash between the two) are repaired on the next
+    run, so the migration can simply be started again until it reports
+    nothing left. Run it while no download is running.
+    """
+
+    def __init__(self, config: Config, state: Optional[StateStore] = None, workers: int = 8):
+        if not config.output_layout:
+            raise ValueError("Defina output_layout no config antes de migrar.")
+        self.config = config
+        self.workers = max(1, workers)
+        self._state = state
+        self.logger = logging.getLogger(__name__)
+        self._padrao = re.compile(
+            rf"^{re.escape(config.file_prefix)}_(\d{{4}})-(\d{{2}})(?:_[^.]+)?"
+            r"\.(?:xml|xml\.gz|pdf|tar)$"
+        )
+
+    @property
+    def state(self) -> StateStore:
+        if self._state is None:
+            self._state = StateStore(self.config.state_db)
+        return self._state
+
+    def destino(self, nome: str, cnpj: str) -> Optional[str]:
+        """Return the layout path of the flat file ``nome``, or ``None`` if not ours."""
+        m = self._padrao.match(nome)
+        if m is None:
+            return None
+        cfg = self.config
+        relativo = subdiretorio(cfg.output_layout, cnpj, m.group(1), m.group(2))
+        return os.path.join(cfg.output_dir, relativo, nome)
+
+    def planejar(self) -> tuple[list[tuple[str, str]], list[tuple[str, str]]]:
+        """Return the files to move and the rows to repair, as ``(origem, destino)``."""
+        cfg = self.config
+        raiz = os.path.normpath(cfg.output_dir)
+        # The file names do not carry the CNPJ; take it from the state rows.
+        cnpj_por_nome: dict[str, str] = {}
+        linhas: dict[str, str] = {}
+        for cnpj, _nsu, caminho in self.state.caminhos():
+            arquivo = caminho.partition(SEPARADOR_MEMBRO)[0]
+            if os.path.dirname(os.path.normpath(arquivo)) != raiz:
+                continue
+            nome = os.path.basename(arquivo)
+            cnpj_por_nome.setdefault(nome.split(".")[0], cnpj)
+            linhas[arquivo] = cnpj
+
+        movimentos = []
+        if os.path.isdir(cfg.output_dir):
+            with os.scandir(cfg.output_dir) as it:
+                for entry in it:
+                    if not entry.is_file():
+                        continue
+                    cnpj = cnpj_por_nome.get(entry.name.split(".")[0], cfg.cnpj)
+                    destino = self.destino(entry.name, cnpj)
+                    if destino is not None:
+                        movimentos.append((entry.path, destino))
+
+        reparos = []
+        for arquivo, cnpj in linhas.items():
+            destino = self.destino(os.path.basename(arquivo), cnpj)
+            if destino and not os.path.exists(arquivo) and os.path.exists(destino):
+                reparos.append((arquivo, destino))
+        # A queued PDF has no file yet; point it at the layout so the retry
+        # does not recreate the flat tree.
+        for cnpj, arquivo in self.state.destinos_pdf():
+            if os.path.dirname(os.path.normpath(arquivo)) != raiz or os.path.exists(arquivo):
+                continue
+            destino = self.destino(os.path.basename(arquivo), cnpj)
+            if destino:
+                reparos.append((arquivo, destino))
+        return movimentos, reparos
+
+    @staticmethod
+    def _mover(origem: str, destino: str) -> str:
+        """Rename ``origem`` to ``destino``; returns what happened."""
+        os.makedirs(os.path.dirname(destino), exist_ok=True)
+        if os.path.exists(destino):
+            if sha256_arquivo(destino) == sha256_arquivo(origem):
+                os.remove(origem)
+                return "duplicado"
+            return "conflito"
+        os.replace(origem, destino)
+        return "movido"
+
+    def run(
+        self,
+        write: Callable[[str, bool], None] = lambda msg, log=True: None,
+        running: Callable[[], bool] = lambda: True,
+    ) -> MigracaoStats:
+        """Move every flat file and update the state store; safe to resume."""
+        stats = MigracaoStats()
+        movimentos, reparos = self.planejar()
+        write(
+            f"Migrando {len(movimentos)} arquivos para {self.config.output_layout} "
+            f"com {self.workers} workers.",
+            log=True,
+        )
+        if reparos:
+            self.state.atualizar_caminhos(reparos)
+            stats.reparados = len(reparos)
+
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="nfse-migra") as pool:
+            for i in range(0, len(movimentos), LOTE_MIGRACAO):
+                if not running():
+                    write("Migração interrompida; execute novamente para continuar.", log=True)
+                    break
+                lote = movimentos[i : i + LOTE_MIGRACAO]
+                pares = []
+                for (origem, destino), resultado in zip(
+                    lote, pool.map(lambda par: self._mover(*par), lote)
+                ):
+                    if resultado == "conflito":
+                        stats.conflitos += 1
+                        self.logger.error("Conflito ao migrar %s: %s já existe", origem, destino)
+                        write(f"Conflito: {destino} já existe com outro conteúdo.", log=True)
+                        continue
+                    if resultado == "movido":
+                        stats.movidos += 1
+                    else:
+                        stats.duplicados += 1
+                    pares.append((origem, destino))
+                self.state.atualizar_caminhos(pares)
+                write(f"{min(i + LOTE_MIGRACAO, len(movimentos))}/{len(movimentos)} arquivos.", log=True)
+        write(stats.resumo(), log=True)
+        return stats
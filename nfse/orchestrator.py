@@ -0,0 +1,204 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import AsyncExitStack, ExitStack, asynccontextmanager, contextmanager
+from typing import (
+    AsyncContextManager,
+    AsyncIterator,
+    Callable,
+    ContextManager,
+    Iterator,
+    Optional,
+)
+
+from . import credentials, metrics, transport
+from .async_downloader import criar_sessao_async
+from .config import Config
+from .downloader import criar_downloader
+from .pipeline import RunSummary
+from .state import StateStore
+
+
+class MultiCNPJOrchestrator:
+    """Run every CNPJ listed in ``config.clients`` from a single process.
+
+    Clients run concurrently up to ``max_concurrent``. Clients sharing a
+    certificate share one pooled session, so a certificate is loaded once
+    per orchestrator run instead of once per CNPJ. With ``engine:
+    "asyncio"`` the clients run as coroutines of a single event loop,
+    sharing one ``aiohttp`` session per certificate in the same way.
+    """
+
+    def __init__(
+        self,
+        config: Config,
+        session_factory: Optional[Callable[[str, str, int], ContextManager]] = None,
+        async_session_factory: Optional[Callable[[str, str, int], AsyncContextManager]] = None,
+    ):
+        self.config = config
+        self.session_factory = session_factory or self._sessao
+        self.async_session_factory = async_session_factory or self._sessao_async
+        self.logger = logging.getLogger(__name__)
+
+    def clientes(self) -> list[Config]:
+        """Return one ``Config`` per client (the base config when none)."""
+        if not self.config.clients:
+            return [self.config]
+        return [self.config.para_cliente(c) for c in self.config.clients]
+
+    def _credencial(self, cert_path: str, cert_pass: str) -> credentials.Credencial:
+        cred = credentials.CACHE.obter(cert_path, cert_pass)
+        self.logger.info(
+            "Certificado %s %s em %.2fs",
+            cert_path,
+            "reutilizado (carga original)" if cred.reutilizada else "carregado",
+            cred.segundos,
+        )
+        return cred
+
+    @contextmanager
+    def _sessao(self, cert_path: str, cert_pass: str, execucoes: int) -> Iterator:
+        """Yield a session authenticated with ``cert_path`` for ``execucoes`` concurrent runs."""
+        cred = self._credencial(cert_path, cert_pass)
+        sess = transport.criar_sessao(cred.contexto, self.config, metrics.REGISTRO, execucoes)
+        try:
+            yield sess
+        finally:
+            sess.close()
+            self.logger.info("%s: %s", cert_path, sess.transporte.resumo())
+
+    @asynccontextmanager
+    async def _sessao_async(self, cert_path: str, cert_pass: str, execucoes: int) -> AsyncIterator:
+        """Yield an ``aiohttp`` session authenticated with ``cert_path``."""
+        cred = await asyncio.to_thread(self._credencial, cert_path, cert_pass)
+        sess = criar_sessao_async(cred.contexto, self.config)
+        try:
+            yield sess
+        finally:
+            await sess.close()
+
+    def run(
+        self,
+        write: Callable[[str, bool], None] = lambda msg, log=True: None,
+        running: Callable[[], bool] = lambda: True,
+    ) -> list[RunSummary]:
+        """Download every client and return one summary per CNPJ."""
+        clientes = self.clientes()
+        limite = max(1, int(self.config.max_concurrent))
+        grupos: dict[tuple[str, str], list[Config]] = {}
+        for cfg in clientes:
+            grupos.setdefault((cfg.cert_path, cfg.cert_pass), []).append(cfg)
+        write(
+            f"Processando {len(clientes)} CNPJs com {len(grupos)} certificados "
+            f"({limite} simultâneos).",
+            log=True,
+        )
+
+        with ExitStack() as stack:
+            state = StateStore(self.config.state_db)
+            stack.callback(state.close)
+            if self.config.engine == "asyncio":
+                resumos = asyncio.run(
+                    self._executar_loop(clientes, grupos, state, limite, write, running)
+                )
+            else:
+                sessoes = {}
+                for (cert_path, cert_pass), membros in grupos.items():
+                    sessoes[(cert_path, cert_pass)] = stack.enter_context(
+                        self.session_factory(cert_path, cert_pass, min(limite, len(membros)))
+                    )
+                with ThreadPoolExecutor(
+                    max_workers=limite, thread_name_prefix="nfse-cnpj"
+                ) as pool:
+                    futures = [
+                        pool.submit(
+                            self._executar,
+                            cfg,
+                            sessoes[(cfg.cert_path, cfg.cert_pass)],
+                            state,
+                            write,
+                            running,
+                        )
+                        for cfg in clientes
+                    ]
+                    resumos = [f.result() for f in futures]
+
+        for resumo in resumos:
+            write(resumo.resumo(), log=True)
+        return resumos
+
+    def _executar(
+        self,
+        cfg: Config,
+        sess,
+        state: StateStore,
+        write: Callable[[str, bool], None],
+        running: Callable[[], bool],
+    ) -> RunSummary:
+        """Run a single client, turning failures into its summary."""
+        write_cnpj = self._write_cnpj(cfg, write)
+        if not running():
+            return RunSummary(cfg.cnpj)
+        inicio = time.perf_counter()
+        try:
+            return criar_downloader(cfg, state).run(
+                write=write_cnpj, running=running, session=sess
+            )
+        except Exception as e:
+            return self._falha(cfg, e, inicio, write_cnpj)
+
+    async def _executar_loop(
+        self,
+        clientes: list[Config],
+        grupos: dict[tuple[str, str], list[Config]],
+        state: StateStore,
+        limite: int,
+        write: Callable[[str, bool], None],
+        running: Callable[[], bool],
+    ) -> list[RunSummary]:
+        """Run every client on the current event loop, ``limite`` at a time."""
+        slots = asyncio.Semaphore(limite)
+
+        async with AsyncExitStack() as stack:
+            sessoes = {}
+            for (cert_path, cert_pass), membros in grupos.items():
+                sessoes[(cert_path, cert_pass)] = await stack.enter_async_context(
+                    self.async_session_factory(cert_path, cert_pass, min(limite, len(membros)))
+                )
+
+            async def executar(cfg: Config) -> RunSummary:
+                write_cnpj = self._write_cnpj(cfg, write)
+                async with slots:
+                    if not running():
+                        return RunSummary(cfg.cnpj)
+                    inicio = time.perf_counter()
+                    try:
+                        return await criar_downloader(cfg, state).run_async(
+                            write=write_cnpj,
+                            running=running,
+                            session=sessoes[(cfg.cert_path, cfg.cert_pass)],
+                        )
+                    except Exception as e:
+                        return self._falha(cfg, e, inicio, write_cnpj)
+
+            return list(await asyncio.gather(*(executar(cfg) for cfg in clientes)))
+
+    @staticmethod
+    def _write_cnpj(cfg: Config, write: Callable[[str, bool], None]) -> Callable[..., None]:
+        """Return ``write`` with messages prefixed by the CNPJ of ``cfg``."""
+
+        def write_cnpj(msg: str, log: bool = True) -> None:
+            write(f"[{cfg.cnpj}] {msg}", log)
+
+        return write_cnpj
+
+    def _falha(
+        self, cfg: Config, erro: Exception, inicio: float, write: Callable[..., None]
+    ) -> RunSummary:
+        """Log ``erro`` and return it as the summary of ``cfg``."""
+        self.logger.error("Erro no CNPJ %s: %s", cfg.cnpj, erro)
+        write(f"Erro inesperado: {erro}", log=True)
+        return RunSummary(cfg.cnpj, segundos=time.perf_counter() - inicio, erro=str(erro))
@@ -0,0 +1,140 @@
+from __future__ import annotations
+
+import datetime
+import email.utils
+import math
+import random
+import threading
+import time
+from typing import Callable, Optional
+
+from .config import Config
+
+
+def parse_retry_after(valor: Optional[str]) -> float:
+    """Return the seconds requested by a ``Retry-After`` header value."""
+    if not valor:
+        return 0.0
+    valor = valor.strip()
+    try:
+        return max(0.0, float(valor))
+    except ValueError:
+        pass
+    try:
+        quando = email.utils.parsedate_to_datetime(valor)
+    except (TypeError, ValueError):
+        return 0.0
+    if quando.tzinfo is None:
+        quando = quando.replace(tzinfo=datetime.timezone.utc)
+    agora = datetime.datetime.now(datetime.timezone.utc)
+    return max(0.0, (quando - agora).total_seconds())
+
+
+def dormir(segundos: float, running: Callable[[], bool], passo: float = 0.5) -> bool:
+    """Sleep ``segundos`` in small steps. Returns ``False`` if stopped."""
+    fim = time.monotonic() + segundos
+    while running():
+        restante = fim - time.monotonic()
+        if restante <= 0:
+            return True
+        time.sleep(min(passo, restante))
+    return False
+
+
+class PacingController:
+    """Token bucket whose refill rate adapts AIMD-style to portal health.
+
+    The rate starts at one request per ``max_interval`` seconds, grows
+    additively after each healthy response up to one request per
+    ``min_interval`` and is halved on 429/5xx. ``Retry-After`` blocks every
+    request until the requested instant. The controller is thread-safe so
+    several fetchers can share one global budget.
+    """
+
+    MIN_INTERVAL_FLOOR = 0.05
+
+    def __init__(
+        self,
+        min_interval: float,
+        max_interval: float,
+        burst: int = 1,
+        backoff_base: float = 2.0,
+        backoff_max: float = 300.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self._lock = threading.Lock()
+        self._clock = clock
+        if max_interval <= 0:
+            self.rate_min = self.rate_max = math.inf
+        else:
+            min_interval = max(self.MIN_INTERVAL_FLOOR, min(min_interval, max_interval))
+            self.rate_min = 1.0 / max_interval
+            self.rate_max = 1.0 / min_interval
+        self.passo = (
+            (self.rate_max - self.rate_min) / 10 if math.isfinite(self.rate_max) else 0.0
+        )
+        self.rate = self.rate_min
+        self.burst = max(1, burst)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._tokens = float(self.burst)
+        self._ultimo = clock()
+        self._bloqueado_ate = 0.0
+
+    @classmethod
+    def from_config(cls, cfg: Config) -> "PacingController":
+        """Build a controller from the pacing fields of ``cfg``."""
+        return cls(
+            float(cfg.min_delay_seconds),
+            float(cfg.delay_seconds),
+            backoff_base=float(cfg.retry_backoff_seconds),
+        )
+
+    @property
+    def intervalo(self) -> float:
+        """Current target interval between requests in seconds."""
+        return 0.0 if math.isinf(self.rate) else 1.0 / self.rate
+
+    def reservar(self) -> float:
+        """Take a token if available; otherwise return the seconds to wait."""
+        with self._lock:
+            agora = self._clock()
+            if math.isinf(self.rate):
+                self._tokens = float(self.burst)
+            else:
+                decorrido = max(0.0, agora - self._ultimo)
+                self._tokens = min(self.burst, self._tokens + decorrido * self.rate)
+            self._ultimo = agora
+            if agora < self._bloqueado_ate:
+                return self._bloqueado_ate - agora
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.rate
+
+    def aguardar(self, running: Callable[[], bool] = lambda: True) -> bool:
+        """Block until a request may be sent. Returns ``False`` if stopped."""
+        while running():
+            espera = self.reservar()
+            if espera <= 0:
+                return True
+            dormir(min(espera, 0.5), running)
+        return False
+
+    def sucesso(self) -> None:
+        """Additive increase after a healthy response."""
+        with self._lock:
+            self.rate = min(self.rate_max, self.rate + self.passo)
+
+    def penalizar(self, retry_after: float = 0.0) -> None:
+        """Multiplicative decrease after 429/5xx, honouring ``Retry-After``."""
+        with self._lock:
+            self.rate = max(self.rate_min, self.rate / 2)
+            self._tokens = 0.0
+            if retry_after > 0:
+                self._bloqueado_ate = max(self._bloqueado_ate, self._clock() + retry_after)
+
+    def backoff(self, tentativa: int) -> float:
+        """Return the jittered exponential delay before retry ``tentativa``."""
+        teto = min(self.backoff_max, self.backoff_base * 2 ** max(0, tentativa - 1))
+        return teto / 2 + random.uniform(0, teto / 2)
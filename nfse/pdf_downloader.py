@@ -1,18 +1,165 @@
+from __future__ import annotations
+
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable, Optional
+
+from .metrics import Metricas
+
+
+@dataclass
+class PDFStats:
+    """Success/failure counters and latency of PDF downloads."""
+
+    sucesso: int = 0
+    falha: int = 0
+    segundos: float = 0.0
+    max_segundos: float = 0.0
+    _lock: threading.Lock = field(
+        default_factory=threading.Lock, repr=False, compare=False
+    )
+
+    def registrar(self, ok: bool, segundos: float) -> None:
+        """Account one download that took ``segundos``."""
+        with self._lock:
+            if ok:
+                self.sucesso += 1
+            else:
+                self.falha += 1
+            self.segundos += segundos
+            self.max_segundos = max(self.max_segundos, segundos)
+
+    def resumo(self) -> str:
+        """Return a human readable summary line."""
+        total = self.sucesso + self.falha
+        media = self.segundos / total if total else 0.0
+        return (
+            f"PDFs: {self.sucesso} baixados, {self.falha} falhas, "
+            f"latência média {media:.2f}s (máx {self.max_segundos:.2f}s)"
+        )
+
+
 class NFSePDFDownloader:
     """Simple helper to download PDF documents from the national portal."""
 
     BASE_URL = "https://sefin.nfse.gov.br/sefinnacional/danfse"
+    CHUNK_SIZE = 64 * 1024
 
-    def __init__(self, session, timeout: int = 30):
+    def __init__(
+        self,
+        session,
+        timeout: int = 30,
+        workers: int = 0,
+        base_url: Optional[str] = None,
+        metricas: Optional[Metricas] = None,
+    ):
         self.session = session
+        self.base_url = base_url or self.BASE_URL
+        self.metricas = metricas
         self.timeout = timeout
+        self.workers = workers
+        self.stats = PDFStats()
+        self.logger = logging.getLogger(__name__)
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._slots: Optional[threading.BoundedSemaphore] = None
+        self._cancelado = threading.Event()
 
     def baixar(self, chave: str, dest_path: str) -> bool:
         """Download ``chave`` to ``dest_path``. Returns ``True`` on success."""
-        url = f"{self.BASE_URL}/{chave}"
-        resp = self.session.get(url, timeout=self.timeout)
-        if resp.status_code == 200:
-            with open(dest_path, "wb") as f:
-                f.write(resp.content)
-            return True
-        return False
+        url = f"{self.base_url}/{chave}"
+        inicio = time.perf_counter()
+        ok = False
+        nbytes = 0
+        try:
+            resp = self.session.get(url, timeout=self.timeout, stream=True)
+            if self.metricas is not None:
+                self.metricas.latencia.observar(time.perf_counter() - inicio, servico="danfse")
+                self.metricas.respostas.inc(servico="danfse", status=resp.status_code)
+            try:
+                if resp.status_code == 200:
+                    tmp_path = f"{dest_path}.part"
+                    try:
+                        with open(tmp_path, "wb") as f:
+                            for chunk in resp.iter_content(self.CHUNK_SIZE):
+                                if chunk:
+                                    f.write(chunk)
+                                    nbytes += len(chunk)
+                        os.replace(tmp_path, dest_path)
+                    except BaseException:
+                        # A broken stream must not leave a partial file behind.
+                        try:
+                            os.remove(tmp_path)
+                        except OSError:
+                            pass
+                        raise
+                    ok = True
+            finally:
+                close = getattr(resp, "close", None)
+                if close is not None:
+                    close()
+        finally:
+            self.stats.registrar(ok, time.perf_counter() - inicio)
+            if self.metricas is not None:
+                self.metricas.pdfs.inc(resultado="ok" if ok else "falha")
+                self.metricas.bytes.inc(nbytes, tipo="pdf")
+        return ok
+
+    def submeter(
+        self,
+        chave: str,
+        dest_path: str,
+        callback: Callable[[str, str, bool, bool, float], None],
+    ) -> None:
+        """Queue ``chave`` for download and call ``callback`` when done.
+
+        ``callback`` receives ``(chave, dest_path, ok, existed, segundos)``.
+        With ``workers <= 0`` the download runs inline. Otherwise it runs
+        on a bounded pool and this call blocks only while the pool is full.
+        Jobs skipped by :meth:`cancelar` still get the callback, with
+        ``ok=False``, so the caller can queue them for a retry.
+        """
+        if self.workers <= 0:
+            self._executar(chave, dest_path, callback)
+            return
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.workers, thread_name_prefix="nfse-pdf"
+            )
+            self._slots = threading.BoundedSemaphore(self.workers * 2)
+        slots = self._slots
+        slots.acquire()
+        future = self._executor.submit(self._executar, chave, dest_path, callback)
+        future.add_done_callback(lambda _f: slots.release())
+
+    def _executar(
+        self,
+        chave: str,
+        dest_path: str,
+        callback: Callable[[str, str, bool, bool, float], None],
+    ) -> None:
+        existed = os.path.exists(dest_path)
+        if self._cancelado.is_set():
+            callback(chave, dest_path, False, existed, 0.0)
+            return
+        inicio = time.perf_counter()
+        try:
+            ok = self.baixar(chave, dest_path)
+        except Exception as e:
+            self.logger.error("Erro ao baixar PDF %s: %s", chave, e)
+            ok = False
+        callback(chave, dest_path, ok, existed, time.perf_counter() - inicio)
+
+    def cancelar(self) -> None:
+        """Skip downloads that have not started yet, reporting them as failed."""
+        self._cancelado.set()
+
+    def aguardar(self) -> None:
+        """Block until every queued download has finished."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+            self._slots = None
@@ -0,0 +1,193 @@
+from __future__ import annotations
+
+import os
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Optional
+
+from .campos import CamposNFSe
+
+FIM = object()
+"""Sentinel pushed downstream when a stage has no more items."""
+
+
+@dataclass
+class Documento:
+    """Decoded document travelling from the decode stage to the writer."""
+
+    nsu: int
+    chave: str
+    xml_bytes: bytes
+    ano: str
+    mes: str
+    gzip_bytes: Optional[bytes] = None
+    """Payload as received, kept only by the compressed output formats."""
+    campos: Optional[CamposNFSe] = None
+    """Fields for the query index, when ``index_documents`` is on."""
+    arquivo: Optional[str] = None
+    """Spool file already holding the payload to store, for large documents.
+
+    The decode stage streams those straight to disk (see
+    :func:`nfse.decodificacao.decodificar_em_arquivo`) and leaves
+    ``xml_bytes``/``gzip_bytes`` empty; the writer renames the file into
+    place.
+    """
+    sha256: Optional[str] = None
+    """Hash of the spooled payload."""
+    nbytes: int = 0
+    """Size of the spooled payload."""
+
+    @property
+    def tamanho(self) -> int:
+        """Size in bytes of the payload that will be written."""
+        if self.arquivo is not None:
+            return self.nbytes
+        return len(self.gzip_bytes if self.gzip_bytes is not None else self.xml_bytes)
+
+    def descartar(self) -> None:
+        """Remove the spool file of a document that will not be written."""
+        if self.arquivo is not None:
+            try:
+                os.remove(self.arquivo)
+            except OSError:
+                pass
+
+
+@dataclass
+class StageStats:
+    """Counters and busy time of a single pipeline stage."""
+
+    nome: str
+    itens: int = 0
+    bytes: int = 0
+    segundos: float = 0.0
+    _lock: threading.Lock = field(
+        default_factory=threading.Lock, repr=False, compare=False
+    )
+
+    def registrar(self, inicio: float, nbytes: int = 0, itens: int = 1) -> None:
+        """Account ``itens`` processed since ``inicio`` (``perf_counter``)."""
+        elapsed = time.perf_counter() - inicio
+        with self._lock:
+            self.itens += itens
+            self.bytes += nbytes
+            self.segundos += elapsed
+
+    @property
+    def vazao(self) -> float:
+        """Items per second of busy time."""
+        return self.itens / self.segundos if self.segundos > 0 else 0.0
+
+    def resumo(self) -> str:
+        """Return a human readable summary line."""
+        return (
+            f"Estágio {self.nome}: {self.itens} documentos, {self.bytes} bytes "
+            f"em {self.segundos:.2f}s ({self.vazao:.1f} docs/s)"
+        )
+
+
+@dataclass
+class RunSummary:
+    """Outcome of one ``run`` for a single CNPJ."""
+
+    cnpj: str
+    documentos: int = 0
+    bytes: int = 0
+    segundos: float = 0.0
+    erro: Optional[str] = None
+    metricas: dict = field(default_factory=dict)
+    """Metric samples recorded during the run (see ``Metricas.resumo``)."""
+
+    def resumo(self) -> str:
+        """Return a human readable summary line."""
+        linha = (
+            f"CNPJ {self.cnpj}: {self.documentos} documentos, {self.bytes} bytes "
+            f"em {self.segundos:.1f}s"
+        )
+        if self.erro:
+            linha += f" (erro: {self.erro})"
+        return linha
+
+
+class NSUCheckpoint:
+    """Track in-flight NSUs so the saved cursor never skips unwritten documents."""
+
+    def __init__(self, nsu: int):
+        self._lock = threading.Lock()
+        self._pendentes: set[int] = set()
+        self._cursor = nsu
+        self._lotes: deque[int] = deque()
+
+    def registrar(self, nsu: int) -> None:
+        """Mark ``nsu`` as handed to the pipeline."""
+        with self._lock:
+            self._pendentes.add(nsu)
+
+    def concluir(self, nsu: int) -> None:
+        """Mark ``nsu`` as durably written."""
+        with self._lock:
+            self._pendentes.discard(nsu)
+
+    def avancar(self, nsu: int) -> None:
+        """Close a page: every NSU below ``nsu`` has been registered."""
+        with self._lock:
+            self._cursor = max(self._cursor, nsu)
+            self._lotes.append(nsu)
+
+    def lotes_concluidos(self) -> int:
+        """Return how many closed pages became fully written since last call."""
+        with self._lock:
+            menor = min(self._pendentes) if self._pendentes else None
+            concluidos = 0
+            while self._lotes and (menor is None or menor >= self._lotes[0]):
+                self._lotes.popleft()
+                concluidos += 1
+            return concluidos
+
+    @property
+    def valor(self) -> int:
+        """Return the NSU from which a new run must resume.
+
+        Pages are queued in the order the portal sends them, so while a
+        page is open NSUs below one already registered may still arrive;
+        until :meth:`avancar` closes it the cursor stays at the page start.
+        """
+        with self._lock:
+            if self._pendentes:
+                return min(min(self._pendentes), self._cursor)
+            return self._cursor
+
+
+class NSUVistos:
+    """Bounded record of the NSUs already queued during a run.
+
+    Every NSU up to :attr:`contiguo` counts as seen. NSUs seen above it,
+    out of order or past a gap, sit in a small set that is folded into
+    the watermark as gaps close and dropped by :meth:`avancar` when a page
+    closes, so memory stays proportional to a page instead of the run.
+    """
+
+    def __init__(self, nsu: int):
+        self.contiguo = nsu - 1
+        self._acima: set[int] = set()
+
+    def adicionar(self, nsu: int) -> bool:
+        """Record ``nsu``; returns ``False`` if it had already been seen."""
+        if nsu <= self.contiguo or nsu in self._acima:
+            return False
+        self._acima.add(nsu)
+        while self.contiguo + 1 in self._acima:
+            self.contiguo += 1
+            self._acima.discard(self.contiguo)
+        return True
+
+    def avancar(self, nsu: int) -> None:
+        """Mark every NSU up to ``nsu`` as seen."""
+        if nsu > self.contiguo:
+            self.contiguo = nsu
+            self._acima = {n for n in self._acima if n > nsu}
+
+    def __len__(self) -> int:
+        return len(self._acima)
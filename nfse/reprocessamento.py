@@ -0,0 +1,85 @@
+from __future__ import annotations
+
+from dataclasses import replace
+from typing import Callable, Optional
+
+from .config import Config
+from .diario import DiarioDFe, SessaoDiario
+from .downloader import NFSeDownloader
+from .metrics import Metricas
+from .pacing import PacingController
+from .pipeline import RunSummary
+from .state import RegistroDocumento, StateStore
+
+
+class _DownloaderReplay(NFSeDownloader):
+    """Engine that reads pages from the journal and leaves the cursor alone."""
+
+    def __init__(
+        self,
+        config: Config,
+        state: Optional[StateStore],
+        metricas: Optional[Metricas],
+        sessao: SessaoDiario,
+        inicio: int,
+    ):
+        super().__init__(config, state, metricas)
+        self.sessao_diario = sessao
+        self.inicio = inicio
+        self.pacer = PacingController(0, 0)
+
+    def ler_ultimo_nsu(self, cnpj: Optional[str] = None) -> int:
+        return self.inicio
+
+    def _abrir_sessao(self, write: Callable[[str, bool], None]):
+        return self.sessao_diario
+
+    def _salvar_lote(self, nsu: int, registros: list[RegistroDocumento]) -> None:
+        self.state.registrar_documentos(self.config.cnpj, registros)
+
+
+class Reprocessamento:
+    """Run the journal of ``config.cnpj`` through the normal pipeline offline.
+
+    Pages go through the same parse, decode, index and write stages as
+    live ones, with no pacing and without PDFs, so the archive can be
+    rebuilt with a new ``file_prefix``, ``output_layout`` or
+    ``output_format`` at disk speed. Documents are recorded in the state
+    store as usual, but the NSU cursor is not moved.
+    """
+
+    def __init__(
+        self,
+        config: Config,
+        state: Optional[StateStore] = None,
+        metricas: Optional[Metricas] = None,
+    ):
+        if not config.journal_dir:
+            raise ValueError("Defina journal_dir no config para reprocessar o diário.")
+        self.config = config
+        self.state = state
+        self.metricas = metricas
+        self.diario = DiarioDFe(config.journal_dir, config.cnpj)
+
+    def run(
+        self,
+        write: Callable[[str, bool], None] = lambda msg, log=True: None,
+        running: Callable[[], bool] = lambda: True,
+        inicio: int = 0,
+        fim: Optional[int] = None,
+    ) -> RunSummary:
+        """Replay the journaled pages from NSU ``inicio`` up to ``fim``."""
+        sessao = SessaoDiario(self.diario.paginas())
+        write(
+            f"Reprocessando {len(sessao.paginas)} páginas do diário de {self.config.cnpj}.",
+            log=True,
+        )
+        cfg = replace(self.config, journal_dir="", download_pdf=False)
+        dl = _DownloaderReplay(cfg, self.state, self.metricas, sessao, inicio)
+        dl.limite = fim
+        try:
+            return dl.run(write, running)
+        finally:
+            dl.close()
+            if self.state is None:
+                dl.state.close()
@@ -0,0 +1,598 @@
+from __future__ import annotations
+
+import datetime
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, fields
+from typing import Callable, Iterable, Iterator, Optional
+
+from .campos import CamposNFSe
+
+
+@dataclass
+class RegistroDocumento:
+    """State row of a document written by a run."""
+
+    nsu: int
+    chave: str
+    status: str
+    caminho: Optional[str] = None
+    sha256: Optional[str] = None
+    campos: Optional[CamposNFSe] = None
+    """Fields for the query index; rows without them are not indexed."""
+    pdf: Optional[PDFPendente] = None
+    """DANFSe still to download, queued together with the row."""
+
+
+@dataclass
+class FiltroIndice:
+    """Conditions of :meth:`StateStore.buscar`; ``None`` matches anything.
+
+    ``participante`` matches either the prestador or the tomador, and
+    ``de``/``ate`` bound the emission date (``AAAA-MM-DD``, inclusive).
+    """
+
+    chave: Optional[str] = None
+    cnpj: Optional[str] = None
+    participante: Optional[str] = None
+    prestador: Optional[str] = None
+    tomador: Optional[str] = None
+    de: Optional[str] = None
+    ate: Optional[str] = None
+    valor_min: Optional[float] = None
+    valor_max: Optional[float] = None
+    tipo: Optional[str] = None
+
+
+@dataclass
+class EntradaIndice:
+    """Document found in the query index."""
+
+    cnpj: str
+    nsu: int
+    caminho: Optional[str]
+    campos: CamposNFSe
+
+
+@dataclass
+class Faixa:
+    """NSU range ``inicio..fim`` of a backfill shard and its own cursor."""
+
+    inicio: int
+    fim: int
+    cursor: int
+
+    @property
+    def concluida(self) -> bool:
+        return self.cursor > self.fim
+
+
+@dataclass
+class PDFPendente:
+    """DANFSe download waiting in the retry queue."""
+
+    chave: str
+    destino: str
+    tentativas: int
+    proxima_em: float
+    ultimo_erro: Optional[str] = None
+
+
+def cursor_mesclado(faixas: list[Faixa]) -> int:
+    """Return the contiguous resume point of consecutive ``faixas``.
+
+    Shards finish out of order; everything before the first unfinished
+    shard is written, so its cursor is where an incremental run can resume.
+    """
+    for faixa in faixas:
+        if not faixa.concluida:
+            return faixa.cursor
+    return faixas[-1].fim + 1
+
+
+_COLUNAS_INDICE = tuple(f.name for f in fields(CamposNFSe))
+"""Columns of the ``indice`` table filled from :class:`CamposNFSe`."""
+
+
+def _agora() -> str:
+    return datetime.datetime.now().isoformat(timespec="seconds")
+
+
+class StateStore:
+    """SQLite store with the NSU cursor per CNPJ and one row per document.
+
+    The database runs in WAL mode and each page is committed in a single
+    transaction together with the cursor, so a crash never leaves the
+    cursor ahead of the documents recorded for it.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS cursor (
+            cnpj TEXT PRIMARY KEY,
+            nsu INTEGER NOT NULL,
+            atualizado_em TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS documentos (
+            cnpj TEXT NOT NULL,
+            nsu INTEGER NOT NULL,
+            chave TEXT NOT NULL,
+            status TEXT NOT NULL,
+            caminho TEXT,
+            sha256 TEXT,
+            criado_em TEXT NOT NULL,
+            atualizado_em TEXT NOT NULL,
+            PRIMARY KEY (cnpj, nsu)
+        );
+        CREATE INDEX IF NOT EXISTS idx_documentos_chave ON documentos (chave);
+        CREATE TABLE IF NOT EXISTS backfill (
+            cnpj TEXT NOT NULL,
+            inicio INTEGER NOT NULL,
+            fim INTEGER NOT NULL,
+            cursor INTEGER NOT NULL,
+            atualizado_em TEXT NOT NULL,
+            PRIMARY KEY (cnpj, inicio)
+        );
+        CREATE TABLE IF NOT EXISTS pdf_pendentes (
+            cnpj TEXT NOT NULL,
+            chave TEXT NOT NULL,
+            destino TEXT NOT NULL,
+            tentativas INTEGER NOT NULL,
+            proxima_em REAL NOT NULL,
+            ultimo_erro TEXT,
+            criado_em TEXT NOT NULL,
+            atualizado_em TEXT NOT NULL,
+            PRIMARY KEY (cnpj, chave)
+        );
+        CREATE INDEX IF NOT EXISTS idx_pdf_pendentes_proxima ON pdf_pendentes (cnpj, proxima_em);
+        CREATE TABLE IF NOT EXISTS indice (
+            cnpj TEXT NOT NULL,
+            nsu INTEGER NOT NULL,
+            chave TEXT NOT NULL,
+            tipo TEXT NOT NULL,
+            numero TEXT,
+            data_emissao TEXT,
+            data TEXT,
+            competencia TEXT,
+            prestador TEXT,
+            tomador TEXT,
+            codigo_servico TEXT,
+            valor_servico REAL,
+            base_calculo REAL,
+            valor_issqn REAL,
+            valor_liquido REAL,
+            tipo_evento TEXT,
+            chave_nfse TEXT,
+            PRIMARY KEY (cnpj, nsu)
+        );
+        CREATE INDEX IF NOT EXISTS idx_indice_chave ON indice (chave);
+        CREATE INDEX IF NOT EXISTS idx_indice_data ON indice (data);
+        CREATE INDEX IF NOT EXISTS idx_indice_prestador ON indice (prestador, data);
+        CREATE INDEX IF NOT EXISTS idx_indice_tomador ON indice (tomador, data);
+        CREATE INDEX IF NOT EXISTS idx_indice_chave_nfse ON indice (chave_nfse);
+        CREATE TABLE IF NOT EXISTS exportados (
+            cnpj TEXT NOT NULL,
+            nsu INTEGER NOT NULL,
+            exportado_em TEXT NOT NULL,
+            PRIMARY KEY (cnpj, nsu)
+        );
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(
+            path, timeout=30, check_same_thread=False, isolation_level=None
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(self.SCHEMA)
+
+    def ler_cursor(self, cnpj: str) -> Optional[int]:
+        """Return the stored NSU cursor for ``cnpj`` or ``None``."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT nsu FROM cursor WHERE cnpj = ?", (cnpj,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def salvar_cursor(self, cnpj: str, nsu: int) -> None:
+        """Persist ``nsu`` as the cursor of ``cnpj``."""
+        self.registrar_lote(cnpj, nsu, ())
+
+    @contextmanager
+    def _transacao(self) -> Iterator[sqlite3.Connection]:
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    @staticmethod
+    def _inserir_documentos(
+        conn: sqlite3.Connection, cnpj: str, registros: Iterable[RegistroDocumento], agora: str
+    ) -> None:
+        # A document whose content changed is exported again.
+        conn.executemany(
+            """
+            DELETE FROM exportados WHERE cnpj = :cnpj AND nsu = :nsu AND EXISTS (
+                SELECT 1 FROM documentos
+                WHERE cnpj = :cnpj AND nsu = :nsu AND sha256 IS NOT :sha256
+            )
+            """,
+            [{"cnpj": cnpj, "nsu": r.nsu, "sha256": r.sha256} for r in registros],
+        )
+        conn.executemany(
+            """
+            INSERT INTO documentos
+                (cnpj, nsu, chave, status, caminho, sha256, criado_em, atualizado_em)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (cnpj, nsu) DO UPDATE SET
+                chave = excluded.chave,
+                status = excluded.status,
+                caminho = excluded.caminho,
+                sha256 = excluded.sha256,
+                atualizado_em = excluded.atualizado_em
+            """,
+            [(cnpj, r.nsu, r.chave, r.status, r.caminho, r.sha256, agora, agora) for r in registros],
+        )
+        StateStore._inserir_indice(
+            conn, cnpj, [(r.nsu, r.campos) for r in registros if r.campos is not None]
+        )
+        # An entry already queued by a failed attempt keeps its count.
+        conn.executemany(
+            """
+            INSERT INTO pdf_pendentes
+                (cnpj, chave, destino, tentativas, proxima_em, ultimo_erro, criado_em, atualizado_em)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (cnpj, chave) DO NOTHING
+            """,
+            [
+                (cnpj, p.chave, p.destino, p.tentativas, p.proxima_em, p.ultimo_erro, agora, agora)
+                for p in (r.pdf for r in registros)
+                if p is not None
+            ],
+        )
+
+    @staticmethod
+    def _inserir_indice(
+        conn: sqlite3.Connection, cnpj: str, entradas: Iterable[tuple[int, CamposNFSe]]
+    ) -> None:
+        colunas = ("cnpj", "nsu", "data") + _COLUNAS_INDICE
+        conn.executemany(
+            f"INSERT OR REPLACE INTO indice ({', '.join(colunas)}) "
+            f"VALUES ({', '.join('?' * len(colunas))})",
+            [
+                (cnpj, nsu, c.data) + tuple(getattr(c, nome) for nome in _COLUNAS_INDICE)
+                for nsu, c in entradas
+            ],
+        )
+
+    def registrar_lote(
+        self, cnpj: str, nsu: int, registros: Iterable[RegistroDocumento]
+    ) -> None:
+        """Record ``registros`` and move the cursor to ``nsu`` atomically."""
+        agora = _agora()
+        with self._transacao() as conn:
+            self._inserir_documentos(conn, cnpj, registros, agora)
+            conn.execute(
+                """
+                INSERT INTO cursor (cnpj, nsu, atualizado_em) VALUES (?, ?, ?)
+                ON CONFLICT (cnpj) DO UPDATE SET
+                    nsu = excluded.nsu, atualizado_em = excluded.atualizado_em
+                """,
+                (cnpj, nsu, agora),
+            )
+
+    def registrar_documentos(self, cnpj: str, registros: Iterable[RegistroDocumento]) -> None:
+        """Record ``registros`` without moving the cursor."""
+        with self._transacao() as conn:
+            self._inserir_documentos(conn, cnpj, registros, _agora())
+
+    def ler_faixas(self, cnpj: str) -> list[Faixa]:
+        """Return the backfill shards of ``cnpj`` ordered by ``inicio``."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT inicio, fim, cursor FROM backfill WHERE cnpj = ? ORDER BY inicio",
+                (cnpj,),
+            ).fetchall()
+        return [Faixa(*row) for row in rows]
+
+    def salvar_faixas(self, cnpj: str, faixas: Iterable[Faixa]) -> None:
+        """Replace the backfill plan of ``cnpj`` with ``faixas``."""
+        agora = _agora()
+        with self._transacao() as conn:
+            conn.execute("DELETE FROM backfill WHERE cnpj = ?", (cnpj,))
+            conn.executemany(
+                "INSERT INTO backfill (cnpj, inicio, fim, cursor, atualizado_em) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [(cnpj, f.inicio, f.fim, f.cursor, agora) for f in faixas],
+            )
+
+    def registrar_faixa(
+        self, cnpj: str, inicio: int, nsu: int, registros: Iterable[RegistroDocumento]
+    ) -> int:
+        """Record a page of the shard starting at ``inicio`` atomically.
+
+        Moves the shard cursor to ``nsu`` and the CNPJ cursor to the merged
+        resume point of the plan (never backwards). Returns that point.
+        """
+        agora = _agora()
+        with self._transacao() as conn:
+            self._inserir_documentos(conn, cnpj, registros, agora)
+            conn.execute(
+                "UPDATE backfill SET cursor = ?, atualizado_em = ? WHERE cnpj = ? AND inicio = ?",
+                (nsu, agora, cnpj, inicio),
+            )
+            faixas = [
+                Faixa(*row)
+                for row in conn.execute(
+                    "SELECT inicio, fim, cursor FROM backfill WHERE cnpj = ? ORDER BY inicio",
+                    (cnpj,),
+                )
+            ]
+            mesclado = cursor_mesclado(faixas)
+            conn.execute(
+                """
+                INSERT INTO cursor (cnpj, nsu, atualizado_em) VALUES (?, ?, ?)
+                ON CONFLICT (cnpj) DO UPDATE SET
+                    nsu = MAX(cursor.nsu, excluded.nsu), atualizado_em = excluded.atualizado_em
+                """,
+                (cnpj, mesclado, agora),
+            )
+        return mesclado
+
+    def limpar_faixas(self, cnpj: str) -> None:
+        """Forget the backfill plan of ``cnpj``."""
+        with self._transacao() as conn:
+            conn.execute("DELETE FROM backfill WHERE cnpj = ?", (cnpj,))
+
+    def documento(self, cnpj: str, nsu: int) -> Optional[RegistroDocumento]:
+        """Return the stored row for ``nsu`` of ``cnpj``."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT nsu, chave, status, caminho, sha256 FROM documentos "
+                "WHERE cnpj = ? AND nsu = ?",
+                (cnpj, nsu),
+            ).fetchone()
+        return RegistroDocumento(*row) if row else None
+
+    def contar_documentos(self, cnpj: str) -> int:
+        """Return how many documents are recorded for ``cnpj``."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT COUNT(*) FROM documentos WHERE cnpj = ?", (cnpj,)
+            ).fetchone()
+        return row[0]
+
+    def caminhos(self) -> list[tuple[str, int, str]]:
+        """Return ``(cnpj, nsu, caminho)`` of every document with a stored path."""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT cnpj, nsu, caminho FROM documentos WHERE caminho IS NOT NULL"
+            ).fetchall()
+
+    def documentos_armazenados(self) -> list[tuple[str, int, str, str]]:
+        """Return ``(cnpj, nsu, chave, caminho)`` of every stored document, by NSU."""
+        with self._lock:
+            return self._conn.execute(
+                """
+                SELECT cnpj, nsu, chave, caminho FROM documentos
+                WHERE caminho IS NOT NULL ORDER BY cnpj, nsu
+                """
+            ).fetchall()
+
+    def atualizar_caminhos(self, pares: Iterable[tuple[str, str]]) -> None:
+        """Repoint rows from each old path to the new one in one transaction.
+
+        Rows of members of a moved archive (``arquivo.tar#membro``) follow
+        the archive, and so does the destination of a queued PDF.
+        """
+        agora = _agora()
+        parametros = [{"antigo": a, "novo": n, "agora": agora} for a, n in pares]
+        with self._transacao() as conn:
+            conn.executemany(
+                """
+                UPDATE documentos
+                SET caminho = :novo || substr(caminho, length(:antigo) + 1), atualizado_em = :agora
+                WHERE caminho = :antigo OR substr(caminho, 1, length(:antigo) + 1) = :antigo || '#'
+                """,
+                parametros,
+            )
+            conn.executemany(
+                "UPDATE pdf_pendentes SET destino = :novo WHERE destino = :antigo", parametros
+            )
+
+    def adiar_pdf(
+        self,
+        cnpj: str,
+        chave: str,
+        destino: str,
+        atraso: Callable[[int], float],
+        erro: Optional[str] = None,
+    ) -> PDFPendente:
+        """Count a failed attempt of ``chave`` and schedule the next one.
+
+        ``atraso(tentativas)`` returns the seconds to wait after that many
+        failures. Returns the updated queue entry.
+        """
+        agora = _agora()
+        with self._transacao() as conn:
+            row = conn.execute(
+                "SELECT tentativas FROM pdf_pendentes WHERE cnpj = ? AND chave = ?",
+                (cnpj, chave),
+            ).fetchone()
+            tentativas = (row[0] if row else 0) + 1
+            pendente = PDFPendente(chave, destino, tentativas, time.time() + atraso(tentativas), erro)
+            conn.execute(
+                """
+                INSERT INTO pdf_pendentes
+                    (cnpj, chave, destino, tentativas, proxima_em, ultimo_erro, criado_em, atualizado_em)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (cnpj, chave) DO UPDATE SET
+                    destino = excluded.destino,
+                    tentativas = excluded.tentativas,
+                    proxima_em = excluded.proxima_em,
+                    ultimo_erro = excluded.ultimo_erro,
+                    atualizado_em = excluded.atualizado_em
+                """,
+                (cnpj, chave, destino, tentativas, pendente.proxima_em, erro, agora, agora),
+            )
+        return pendente
+
+    def pdfs_pendentes(
+        self,
+        cnpj: str,
+        ate: Optional[float] = None,
+        max_tentativas: Optional[int] = None,
+        limite: int = 100,
+    ) -> list[PDFPendente]:
+        """Return queued PDFs of ``cnpj`` due by ``ate`` (epoch), oldest first."""
+        sql = (
+            "SELECT chave, destino, tentativas, proxima_em, ultimo_erro FROM pdf_pendentes "
+            "WHERE cnpj = ? AND proxima_em <= ? AND tentativas < ? ORDER BY proxima_em LIMIT ?"
+        )
+        parametros = (
+            cnpj,
+            float("inf") if ate is None else ate,
+            max_tentativas if max_tentativas is not None else 2**62,
+            limite,
+        )
+        with self._lock:
+            return [PDFPendente(*row) for row in self._conn.execute(sql, parametros)]
+
+    def remover_pdf(self, cnpj: str, chave: str) -> None:
+        """Drop ``chave`` from the retry queue (downloaded or no longer wanted)."""
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM pdf_pendentes WHERE cnpj = ? AND chave = ?", (cnpj, chave)
+            )
+
+    def destinos_pdf(self) -> list[tuple[str, str]]:
+        """Return ``(cnpj, destino)`` of every queued PDF."""
+        with self._lock:
+            return self._conn.execute("SELECT cnpj, destino FROM pdf_pendentes").fetchall()
+
+    def contar_pdfs_pendentes(self, cnpj: str) -> int:
+        """Return how many PDFs of ``cnpj`` are in the retry queue."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT COUNT(*) FROM pdf_pendentes WHERE cnpj = ?", (cnpj,)
+            ).fetchone()
+        return row[0]
+
+    def indexar(self, cnpj: str, entradas: Iterable[tuple[int, CamposNFSe]]) -> None:
+        """Add or replace the index rows of already recorded documents."""
+        with self._transacao() as conn:
+            self._inserir_indice(conn, cnpj, entradas)
+
+    def limpar_indice(self) -> None:
+        """Drop every row of the query index."""
+        with self._transacao() as conn:
+            conn.execute("DELETE FROM indice")
+
+    def contar_indexados(self, cnpj: str) -> int:
+        """Return how many documents of ``cnpj`` are in the query index."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT COUNT(*) FROM indice WHERE cnpj = ?", (cnpj,)
+            ).fetchone()
+        return row[0]
+
+    def buscar(self, filtro: FiltroIndice, limite: int = 1000) -> list[EntradaIndice]:
+        """Return indexed documents matching ``filtro``, oldest emission first."""
+        condicoes = []
+        parametros: list = []
+        for coluna, operador, valor in (
+            ("i.chave", "=", filtro.chave),
+            ("i.cnpj", "=", filtro.cnpj),
+            ("i.prestador", "=", filtro.prestador),
+            ("i.tomador", "=", filtro.tomador),
+            ("i.data", ">=", filtro.de),
+            ("i.data", "<=", filtro.ate),
+            ("i.valor_servico", ">=", filtro.valor_min),
+            ("i.valor_servico", "<=", filtro.valor_max),
+            ("i.tipo", "=", filtro.tipo),
+        ):
+            if valor is not None:
+                condicoes.append(f"{coluna} {operador} ?")
+                parametros.append(valor)
+        if filtro.participante is not None:
+            condicoes.append("(i.prestador = ? OR i.tomador = ?)")
+            parametros += [filtro.participante, filtro.participante]
+        onde = " AND ".join(condicoes) or "1"
+        colunas = ", ".join(f"i.{nome}" for nome in _COLUNAS_INDICE)
+        with self._lock:
+            rows = self._conn.execute(
+                f"""
+                SELECT i.cnpj, i.nsu, d.caminho, {colunas}
+                FROM indice i
+                LEFT JOIN documentos d ON d.cnpj = i.cnpj AND d.nsu = i.nsu
+                WHERE {onde}
+                ORDER BY i.data, i.nsu LIMIT ?
+                """,
+                (*parametros, limite),
+            ).fetchall()
+        return [EntradaIndice(r[0], r[1], r[2], CamposNFSe(*r[3:])) for r in rows]
+
+    def documentos_para_exportar(
+        self, cnpj: str, apos: int = -1, limite: int = 1000
+    ) -> list[RegistroDocumento]:
+        """Return stored documents of ``cnpj`` after NSU ``apos`` not exported yet.
+
+        ``campos`` comes from the query index, or is ``None`` for documents
+        that are not indexed.
+        """
+        colunas = ", ".join(f"i.{nome}" for nome in _COLUNAS_INDICE)
+        with self._lock:
+            rows = self._conn.execute(
+                f"""
+                SELECT d.nsu, d.chave, d.status, d.caminho, d.sha256, i.nsu, {colunas}
+                FROM documentos d
+                LEFT JOIN exportados e ON e.cnpj = d.cnpj AND e.nsu = d.nsu
+                LEFT JOIN indice i ON i.cnpj = d.cnpj AND i.nsu = d.nsu
+                WHERE d.cnpj = ? AND d.nsu > ? AND d.caminho IS NOT NULL AND e.nsu IS NULL
+                ORDER BY d.nsu LIMIT ?
+                """,
+                (cnpj, apos, limite),
+            ).fetchall()
+        return [
+            RegistroDocumento(*r[:5], campos=CamposNFSe(*r[6:]) if r[5] is not None else None)
+            for r in rows
+        ]
+
+    def marcar_exportados(self, cnpj: str, nsus: Iterable[int]) -> None:
+        """Record ``nsus`` of ``cnpj`` as exported."""
+        agora = _agora()
+        with self._transacao() as conn:
+            conn.executemany(
+                "INSERT OR IGNORE INTO exportados (cnpj, nsu, exportado_em) VALUES (?, ?, ?)",
+                [(cnpj, nsu, agora) for nsu in nsus],
+            )
+
+    def importar_txt(self, cnpj: str, path: Optional[str] = None) -> Optional[int]:
+        """Import the legacy ``ultimo_nsu_<cnpj>.txt`` if no cursor exists.
+
+        Returns the imported NSU, or ``None`` when there was nothing to do.
+        """
+        if path is None:
+            path = f"ultimo_nsu_{cnpj}.txt"
+        if self.ler_cursor(cnpj) is not None or not os.path.exists(path):
+            return None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                nsu = int(f.read().strip())
+        except (OSError, ValueError):
+            return None
+        self.salvar_cursor(cnpj, nsu)
+        return nsu
+
+    def close(self) -> None:
+        """Close the database connection."""
+        with self._lock:
+            self._conn.close()
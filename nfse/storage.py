@@ -0,0 +1,352 @@
+from __future__ import annotations
+
+import gzip
+import hashlib
+import io
+import os
+import tarfile
+import threading
+import time
+from dataclasses import dataclass
+from typing import IO, Optional
+
+from .config import Config
+from .pipeline import Documento
+from .state import RegistroDocumento
+
+FORMATOS = ("xml", "gzip", "mensal")
+"""Values accepted by ``Config.output_format``."""
+
+SEPARADOR_MEMBRO = "#"
+"""Separates an archive path from the member name in stored paths."""
+
+CAMPOS_LAYOUT = ("cnpj", "ano", "mes")
+"""Placeholders accepted by ``Config.output_layout``."""
+
+
+def subdiretorio(layout: str, cnpj: str, ano: str, mes: str) -> str:
+    """Return the directory ``layout`` gives a document, relative to ``output_dir``.
+
+    An empty layout keeps everything directly in ``output_dir``.
+    """
+    if not layout:
+        return ""
+    try:
+        relativo = layout.format(cnpj=cnpj, ano=ano, mes=mes)
+    except (KeyError, IndexError, ValueError) as e:
+        raise ValueError(f"Layout de saída inválido: {layout} ({e})") from None
+    relativo = os.path.normpath(relativo)
+    if os.path.isabs(relativo) or relativo.split(os.sep)[0] == "..":
+        raise ValueError(f"Layout de saída inválido: {layout}")
+    return relativo
+
+
+@dataclass
+class Gravacao:
+    """Outcome of :meth:`Armazenamento.gravar`.
+
+    ``acao`` is ``salvo``, ``substituído`` or ``inalterado`` (identical
+    content already on disk, nothing written, ``nbytes`` is 0).
+    """
+
+    caminho: str
+    acao: str
+    sha256: str
+    nbytes: int
+
+
+def sha256_arquivo(caminho: str) -> Optional[str]:
+    """Return the SHA-256 of the file at ``caminho``, or ``None`` if unreadable."""
+    h = hashlib.sha256()
+    try:
+        with open(caminho, "rb") as f:
+            for bloco in iter(lambda: f.read(1024 * 1024), b""):
+                h.update(bloco)
+    except OSError:
+        return None
+    return h.hexdigest()
+
+
+def _fsync(caminho: str) -> None:
+    with open(caminho, "rb+") as f:
+        os.fsync(f.fileno())
+
+
+def _fsync_diretorio(caminho: str) -> None:
+    # Windows cannot open directories; NTFS journals the rename itself.
+    if not hasattr(os, "O_DIRECTORY"):
+        return
+    fd = os.open(caminho, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class Armazenamento:
+    """Write decoded documents to ``output_dir`` in the configured format.
+
+    ``xml`` writes the plain XML, ``gzip`` writes the payload exactly as
+    the portal sent it to ``.xml.gz`` and ``mensal`` appends those gzip
+    payloads to one ``.tar`` per month. ``output_layout`` (for example
+    ``{cnpj}/{ano}/{mes}``) spreads the files over subdirectories. Open
+    monthly archives are kept until :meth:`close` so each append does not
+    rescan the archive; appends are serialized so several engines may
+    share one instance.
+
+    Files are written to a temporary name and renamed over the final one,
+    so a crash never leaves a truncated document under its real name;
+    large documents arrive already spooled to such a file by the decode
+    stage.
+    Content identical to what is already stored is not rewritten. Nothing
+    is fsynced per document: :meth:`sincronizar` flushes the files and
+    directories touched since its last call, once per page, before the
+    page is recorded in the state store.
+
+    Monthly archives cannot be renamed into place per document, so
+    :meth:`sincronizar` also ends each one with a tar end-of-archive
+    marker; the next append overwrites it. An archive cut short by a
+    crash is truncated back to its last complete member when reopened,
+    which only drops documents of a page the state store never recorded.
+    A changed document is appended again under the same name and
+    :meth:`close` rewrites such archives without the stale copies.
+    """
+
+    def __init__(self, config: Config):
+        if config.output_format not in FORMATOS:
+            raise ValueError(f"Formato de saída desconhecido: {config.output_format}")
+        subdiretorio(config.output_layout, config.cnpj, "2000", "01")
+        self.config = config
+        self._arquivos: dict[str, tuple[tarfile.TarFile, set[str]]] = {}
+        self._repetidos: set[str] = set()
+        self._lock = threading.Lock()
+        self._sujos: set[str] = set()
+        self._diretorios: set[str] = set()
+
+    @property
+    def comprimido(self) -> bool:
+        """Whether documents are kept as the gzip payload from the portal."""
+        return self.config.output_format != "xml"
+
+    def nome_base(self, doc: Documento) -> str:
+        """Return ``<prefix>_AAAA-MM_<chave>`` for ``doc``."""
+        return f"{self.config.file_prefix}_{doc.ano}-{doc.mes}_{doc.chave}"
+
+    def diretorio(self, ano: str, mes: str) -> str:
+        """Return (creating it once) the directory for documents of ``ano``/``mes``."""
+        cfg = self.config
+        relativo = subdiretorio(cfg.output_layout, cfg.cnpj, ano, mes)
+        diretorio = os.path.join(cfg.output_dir, relativo) if relativo else cfg.output_dir
+        if relativo and diretorio not in self._diretorios:
+            os.makedirs(diretorio, exist_ok=True)
+            with self._lock:
+                self._diretorios.add(diretorio)
+                # New entries up to output_dir are flushed with the next page.
+                parte = relativo
+                while parte:
+                    self._sujos.add(os.path.join(cfg.output_dir, parte))
+                    parte = os.path.dirname(parte)
+        return diretorio
+
+    def gravar(self, doc: Documento, anterior: Optional[RegistroDocumento] = None) -> Gravacao:
+        """Write ``doc`` unless the same content is already stored.
+
+        ``anterior`` is the state row of a previous write of ``doc``; when
+        it points at the same path its hash is trusted, otherwise an
+        existing file is hashed to decide whether to rewrite it.
+        """
+        cfg = self.config
+        try:
+            if cfg.output_format == "mensal":
+                return self._anexar(doc, anterior)
+            diretorio = self.diretorio(doc.ano, doc.mes)
+            extensao = ".xml.gz" if cfg.output_format == "gzip" else ".xml"
+            caminho = os.path.join(diretorio, f"{self.nome_base(doc)}{extensao}")
+            if doc.arquivo is not None:
+                sha256, nbytes = doc.sha256, doc.nbytes
+            else:
+                dados = doc.gzip_bytes if cfg.output_format == "gzip" else doc.xml_bytes
+                sha256, nbytes = hashlib.sha256(dados).hexdigest(), len(dados)
+            existed = os.path.exists(caminho)
+            if existed:
+                if anterior is not None and anterior.caminho == caminho and anterior.sha256:
+                    atual = anterior.sha256
+                else:
+                    atual = sha256_arquivo(caminho)
+                if atual == sha256:
+                    return Gravacao(caminho, "inalterado", sha256, 0)
+            if doc.arquivo is not None:
+                os.replace(doc.arquivo, caminho)
+                with self._lock:
+                    self._sujos.add(caminho)
+            else:
+                self._gravar_atomico(caminho, dados)
+            return Gravacao(caminho, "substituído" if existed else "salvo", sha256, nbytes)
+        finally:
+            # A spooled payload that was not moved into place is not needed.
+            doc.descartar()
+
+    def _gravar_atomico(self, caminho: str, dados: bytes) -> None:
+        tmp = f"{caminho}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp, "wb") as f:
+                f.write(dados)
+            os.replace(tmp, caminho)
+        except BaseException:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            raise
+        with self._lock:
+            self._sujos.add(caminho)
+
+    def _anexar(self, doc: Documento, anterior: Optional[RegistroDocumento]) -> Gravacao:
+        """Append ``doc`` to the archive of its month."""
+        cfg = self.config
+        arquivo = os.path.join(
+            self.diretorio(doc.ano, doc.mes), f"{cfg.file_prefix}_{doc.ano}-{doc.mes}.tar"
+        )
+        membro = f"{self.nome_base(doc)}.xml.gz"
+        caminho = f"{arquivo}{SEPARADOR_MEMBRO}{membro}"
+        if doc.arquivo is not None:
+            sha256, nbytes = doc.sha256, doc.nbytes
+        else:
+            sha256, nbytes = hashlib.sha256(doc.gzip_bytes).hexdigest(), len(doc.gzip_bytes)
+        info = tarfile.TarInfo(membro)
+        info.size = nbytes
+        info.mtime = int(time.time())
+        with self._lock:
+            tar, nomes = self._abrir(arquivo)
+            existed = membro in nomes
+            # Archive members cannot be hashed cheaply, so only the state row counts.
+            if existed and anterior is not None and (anterior.caminho, anterior.sha256) == (
+                caminho,
+                sha256,
+            ):
+                return Gravacao(caminho, "inalterado", sha256, 0)
+            if doc.arquivo is not None:
+                with open(doc.arquivo, "rb") as f:
+                    tar.addfile(info, f)
+            else:
+                tar.addfile(info, io.BytesIO(doc.gzip_bytes))
+            tar.fileobj.flush()
+            nomes.add(membro)
+            self._sujos.add(arquivo)
+            if existed:
+                self._repetidos.add(arquivo)
+        return Gravacao(caminho, "substituído" if existed else "salvo", sha256, nbytes)
+
+    def _abrir(self, arquivo: str) -> tuple[tarfile.TarFile, set[str]]:
+        if arquivo not in self._arquivos:
+            try:
+                tar = tarfile.open(arquivo, "a")
+            except tarfile.ReadError:
+                _recuperar_tar(arquivo)
+                tar = tarfile.open(arquivo, "a")
+            self._arquivos[arquivo] = (tar, set(tar.getnames()))
+        return self._arquivos[arquivo]
+
+    def sincronizar(self) -> None:
+        """Flush the files written since the last call and their directories."""
+        with self._lock:
+            sujos, self._sujos = self._sujos, set()
+            for caminho in sujos:
+                if caminho in self._arquivos:
+                    _fechar_tar(self._arquivos[caminho][0])
+        diretorios = set()
+        for caminho in sujos:
+            if not os.path.isdir(caminho):
+                _fsync(caminho)
+            diretorios.add(os.path.dirname(caminho) or ".")
+        for diretorio in diretorios:
+            _fsync_diretorio(diretorio)
+
+    def close(self) -> None:
+        """Close every monthly archive opened by this instance.
+
+        Archives holding a document more than once are rewritten with
+        only its latest copy.
+        """
+        with self._lock:
+            arquivos, self._arquivos = self._arquivos, {}
+            repetidos, self._repetidos = self._repetidos, set()
+            for tar, _ in arquivos.values():
+                tar.close()
+            for arquivo in repetidos:
+                _compactar_tar(arquivo)
+
+
+def _fechar_tar(tar: tarfile.TarFile) -> None:
+    # Two zero blocks end a tar; the next member is written over them.
+    tar.fileobj.write(tarfile.NUL * (tarfile.BLOCKSIZE * 2))
+    tar.fileobj.seek(tar.offset)
+    tar.fileobj.flush()
+
+
+def _recuperar_tar(arquivo: str) -> None:
+    """Truncate ``arquivo`` after its last complete member and end it.
+
+    A process killed while appending leaves a torn header or member at
+    the end, which ``tarfile`` refuses to append to.
+    """
+    fim = 0
+    tamanho = os.path.getsize(arquivo)
+    try:
+        with tarfile.open(arquivo, "r") as tar:
+            for info in tar:
+                blocos = -(-info.size // tarfile.BLOCKSIZE)
+                final = info.offset_data + blocos * tarfile.BLOCKSIZE
+                if final > tamanho:
+                    break
+                fim = final
+    except tarfile.ReadError:
+        # Not even the first header is complete.
+        pass
+    with open(arquivo, "rb+") as f:
+        f.truncate(fim)
+        f.seek(fim)
+        f.write(tarfile.NUL * (tarfile.BLOCKSIZE * 2))
+
+
+def _compactar_tar(arquivo: str) -> None:
+    """Rewrite ``arquivo`` keeping only the latest copy of each member."""
+    tmp = f"{arquivo}.{os.getpid()}.tmp"
+    try:
+        with tarfile.open(arquivo, "r") as origem:
+            # Later copies replace earlier ones; the first position is kept.
+            membros = {info.name: info for info in origem}
+            with tarfile.open(tmp, "w") as destino:
+                for info in membros.values():
+                    destino.addfile(info, origem.extractfile(info))
+        _fsync(tmp)
+        os.replace(tmp, arquivo)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+    _fsync_diretorio(os.path.dirname(arquivo) or ".")
+
+
+def ler_xml(caminho: str) -> bytes:
+    """Return the plain XML stored at ``caminho`` in any output format.
+
+    ``caminho`` is the path recorded in the state store: a ``.xml`` file,
+    a ``.xml.gz`` file or ``<arquivo>.tar#<membro>``. Until the archive
+    is compacted on close it may hold the same member more than once;
+    the latest copy is returned.
+    """
+    arquivo, sep, membro = caminho.partition(SEPARADOR_MEMBRO)
+    if sep and arquivo.endswith(".tar"):
+        with tarfile.open(arquivo, "r") as tar:
+            f: Optional[IO[bytes]] = tar.extractfile(tar.getmember(membro))
+            if f is None:
+                raise FileNotFoundError(caminho)
+            return gzip.decompress(f.read())
+    if caminho.endswith(".gz"):
+        with gzip.open(caminho, "rb") as f:
+            return f.read()
+    with open(caminho, "rb") as f:
+        return f.read()
@@ -0,0 +1,300 @@
+from __future__ import annotations
+
+import functools
+import socket
+import ssl
+import threading
+from dataclasses import dataclass
+from typing import Optional
+from urllib.parse import urlsplit
+
+from .config import Config
+from .metrics import Metricas
+
+
+@dataclass
+class EstatisticasHost:
+    """Requests sent to one host and connections opened to serve them."""
+
+    requisicoes: int = 0
+    conexoes: int = 0
+
+    @property
+    def reutilizadas(self) -> int:
+        """Requests served by an already open connection."""
+        return max(0, self.requisicoes - self.conexoes)
+
+    def resumo(self, host: str) -> str:
+        taxa = self.reutilizadas / self.requisicoes * 100 if self.requisicoes else 0.0
+        return (
+            f"{host} {self.conexoes} conexões para {self.requisicoes} requisições "
+            f"({taxa:.0f}% reutilizadas)"
+        )
+
+
+def origem(url: str) -> str:
+    """Return ``scheme://host[:port]/`` of ``url``, the prefix its pool is mounted on."""
+    partes = urlsplit(url)
+    return f"{partes.scheme}://{partes.netloc}/".lower()
+
+
+def tamanhos_pool(config: Config, execucoes: int = 1) -> dict[str, int]:
+    """Return the pool size of the ADN and DANFSe hosts for ``execucoes`` concurrent runs.
+
+    A run sends one page request at a time and up to ``pdf_workers``
+    PDF requests plus one from the retry queue. ``http_pool_size``
+    overrides the computed sizes.
+    """
+    execucoes = max(1, execucoes)
+    tamanhos: dict[str, int] = {}
+    for url, por_execucao in (
+        (config.dfe_url, 1),
+        (config.danfse_url, max(0, int(config.pdf_workers)) + 1),
+    ):
+        chave = origem(url)
+        tamanhos[chave] = tamanhos.get(chave, 0) + execucoes * por_execucao
+    if int(config.http_pool_size) > 0:
+        return dict.fromkeys(tamanhos, int(config.http_pool_size))
+    return tamanhos
+
+
+def opcoes_socket(keepalive: int) -> list[tuple[int, int, int]]:
+    """Return the socket options of new connections.
+
+    With ``keepalive > 0`` idle pooled connections send TCP keep-alive
+    probes after that many seconds, so neither side silently drops them
+    between pages.
+    """
+    from urllib3.connection import HTTPConnection
+
+    opcoes = list(HTTPConnection.default_socket_options)
+    if keepalive > 0:
+        opcoes.append((socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1))
+        for nome, valor in (("TCP_KEEPIDLE", keepalive), ("TCP_KEEPINTVL", max(1, keepalive // 4))):
+            if hasattr(socket, nome):
+                opcoes.append((socket.IPPROTO_TCP, getattr(socket, nome), valor))
+    return opcoes
+
+
+@functools.lru_cache(maxsize=None)
+def _classes_pool() -> dict[str, type]:
+    """Connection pool classes that report to ``Transporte``; urllib3 is imported lazily."""
+    from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+    def contada(base: type) -> type:
+        class PoolContado(base):
+            transporte: Optional["Transporte"] = None
+
+            def _new_conn(self):
+                if self.transporte is not None:
+                    self.transporte._registrar(self.host, conexao=True)
+                return super()._new_conn()
+
+            def urlopen(self, method, url, *args, **kwargs):
+                if self.transporte is not None:
+                    self.transporte._registrar(self.host, conexao=False)
+                return super().urlopen(method, url, *args, **kwargs)
+
+        PoolContado.__name__ = f"{base.__name__}Contado"
+        return PoolContado
+
+    return {"http": contada(HTTPConnectionPool), "https": contada(HTTPSConnectionPool)}
+
+
+@functools.lru_cache(maxsize=None)
+def _classe_adaptador():
+    """Create the adapter class on first use; ``requests`` is imported lazily."""
+    from requests.adapters import HTTPAdapter
+
+    class SSLContextAdapter(HTTPAdapter):
+        """``HTTPAdapter`` whose connections use a prebuilt ``SSLContext``.
+
+        Its pools count the connections and requests of ``transporte``.
+        """
+
+        def __init__(self, contexto: ssl.SSLContext, transporte=None, socket_options=None, **kwargs):
+            self.contexto = contexto
+            self.transporte = transporte
+            self.socket_options = socket_options
+            super().__init__(**kwargs)
+
+        def _kwargs_pool(self, kwargs: dict) -> dict:
+            kwargs["ssl_context"] = self.contexto
+            if self.socket_options is not None:
+                kwargs["socket_options"] = self.socket_options
+            return kwargs
+
+        def init_poolmanager(self, *args, **kwargs):
+            super().init_poolmanager(*args, **self._kwargs_pool(kwargs))
+            if self.transporte is not None:
+                classes = {}
+                for esquema, base in _classes_pool().items():
+                    classes[esquema] = type(base.__name__, (base,), {"transporte": self.transporte})
+                self.poolmanager.pool_classes_by_scheme = classes
+
+        def proxy_manager_for(self, *args, **kwargs):
+            return super().proxy_manager_for(*args, **self._kwargs_pool(kwargs))
+
+    return SSLContextAdapter
+
+
+class Transporte:
+    """HTTP(S) connections shared by the page and PDF downloads of a session.
+
+    Each portal host gets its own connection pool, sized by
+    :func:`tamanhos_pool` so concurrent PDF workers never open a
+    connection only to throw it away because the pool was full. All pools
+    use the same client ``SSLContext`` and keep their connections alive,
+    so a certificate handshake is paid once per pooled connection instead
+    of once per request. Connections opened and requests sent are counted
+    per host (:meth:`resumo`, ``nfse_http_conexoes_total``).
+
+    With ``http2`` the session is an ``httpx`` client speaking HTTP/2,
+    which multiplexes every request to a host over one connection; it
+    requires ``pip install httpx[http2]``.
+    """
+
+    def __init__(
+        self,
+        contexto: ssl.SSLContext,
+        config: Config,
+        metricas: Optional[Metricas] = None,
+        execucoes: int = 1,
+    ):
+        self.contexto = contexto
+        self.config = config
+        self.metricas = metricas
+        self.tamanhos = tamanhos_pool(config, execucoes)
+        self.estatisticas: dict[str, EstatisticasHost] = {}
+        self._lock = threading.Lock()
+
+    def _registrar(self, host: str, conexao: bool) -> None:
+        with self._lock:
+            est = self.estatisticas.setdefault(host, EstatisticasHost())
+            if conexao:
+                est.conexoes += 1
+            else:
+                est.requisicoes += 1
+        if self.metricas is not None:
+            familia = self.metricas.conexoes if conexao else self.metricas.requisicoes
+            familia.inc(host=host)
+
+    def sessao(self):
+        """Return a new session whose pools report to this transport."""
+        if self.config.http2:
+            return _SessaoHTTP2(self)
+        import requests
+
+        adaptador = _classe_adaptador()
+        opcoes = opcoes_socket(int(self.config.http_keepalive_seconds))
+        sess = requests.Session()
+        for esquema in ("https://", "http://"):
+            sess.mount(esquema, adaptador(self.contexto, self, opcoes))
+        for prefixo, tamanho in self.tamanhos.items():
+            sess.mount(
+                prefixo,
+                adaptador(self.contexto, self, opcoes, pool_connections=1, pool_maxsize=tamanho),
+            )
+        sess.verify = True
+        sess.transporte = self
+        return sess
+
+    def resumo(self) -> str:
+        """Return one line with the connection reuse of every host."""
+        with self._lock:
+            itens = sorted(self.estatisticas.items())
+        if not itens:
+            return "Conexões: nenhuma requisição."
+        return "Conexões: " + "; ".join(est.resumo(host) for host, est in itens)
+
+
+def criar_sessao(
+    contexto: ssl.SSLContext,
+    config: Config,
+    metricas: Optional[Metricas] = None,
+    execucoes: int = 1,
+):
+    """Return a session authenticated by ``contexto`` for ``execucoes`` concurrent runs.
+
+    The :class:`Transporte` behind it is available as ``sess.transporte``.
+    """
+    return Transporte(contexto, config, metricas, execucoes).sessao()
+
+
+def _httpx():
+    """Import ``httpx`` on demand; it is only needed for HTTP/2."""
+    try:
+        import httpx
+        import h2  # noqa: F401
+    except ImportError as e:
+        raise RuntimeError(
+            "HTTP/2 requer os pacotes httpx e h2 (pip install httpx[http2])."
+        ) from e
+    return httpx
+
+
+class _RespostaHTTP2:
+    """The part of ``requests.Response`` the engines use, over ``httpx``."""
+
+    def __init__(self, resp):
+        self._resp = resp
+        self.status_code = resp.status_code
+        self.headers = resp.headers
+
+    def iter_content(self, chunk_size: int = 1024):
+        httpx = _httpx()
+        import requests
+
+        try:
+            yield from self._resp.iter_bytes(chunk_size)
+        except httpx.HTTPError as e:
+            raise requests.exceptions.ConnectionError(str(e)) from e
+
+    @property
+    def text(self) -> str:
+        self._resp.read()
+        return self._resp.text
+
+    def close(self) -> None:
+        self._resp.close()
+
+
+class _SessaoHTTP2:
+    """The part of ``requests.Session`` the engines use, over an HTTP/2 client."""
+
+    def __init__(self, transporte: Transporte):
+        httpx = _httpx()
+        self.transporte = transporte
+        maximo = max(transporte.tamanhos.values(), default=10)
+        self._cliente = httpx.Client(
+            http2=True,
+            verify=transporte.contexto,
+            limits=httpx.Limits(max_connections=maximo, max_keepalive_connections=maximo),
+        )
+
+    def _rastrear(self, host: str):
+        def evento(nome: str, info: dict) -> None:
+            if nome == "connection.connect_tcp.complete":
+                self.transporte._registrar(host, conexao=True)
+
+        return evento
+
+    def get(self, url: str, timeout=None, stream: bool = False) -> _RespostaHTTP2:
+        httpx = _httpx()
+        import requests
+
+        host = urlsplit(url).hostname or ""
+        self.transporte._registrar(host, conexao=False)
+        pedido = self._cliente.build_request(
+            "GET", url, timeout=timeout, extensions={"trace": self._rastrear(host)}
+        )
+        try:
+            resp = self._cliente.send(pedido, stream=True)
+        except httpx.HTTPError as e:
+            raise requests.exceptions.ConnectionError(str(e)) from e
+        if not stream:
+            resp.read()
+        return _RespostaHTTP2(resp)
+
+    def close(self) -> None:
+        self._cliente.close()
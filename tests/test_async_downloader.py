@@ -0,0 +1,258 @@
+import asyncio
+import base64
+import gzip
+import json
+import os
+import sys
+import types
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+# Stub external dependencies used by nfse.downloader
+sys.modules.setdefault("requests", types.ModuleType("requests"))
+crypto = types.ModuleType("cryptography")
+hazmat = types.ModuleType("cryptography.hazmat")
+primitives = types.ModuleType("cryptography.hazmat.primitives")
+serialization = types.ModuleType("cryptography.hazmat.primitives.serialization")
+pkcs12 = types.ModuleType("cryptography.hazmat.primitives.serialization.pkcs12")
+serialization.Encoding = object()
+serialization.PrivateFormat = object()
+serialization.NoEncryption = object()
+pkcs12.load_key_and_certificates = lambda data, pwd, backend: (None, None, None)
+crypto.hazmat = hazmat
+hazmat.primitives = primitives
+primitives.serialization = serialization
+serialization.pkcs12 = pkcs12
+sys.modules["cryptography"] = crypto
+sys.modules["cryptography.hazmat"] = hazmat
+sys.modules["cryptography.hazmat.primitives"] = primitives
+sys.modules["cryptography.hazmat.primitives.serialization"] = serialization
+sys.modules["cryptography.hazmat.primitives.serialization.pkcs12"] = pkcs12
+
+from nfse.async_downloader import AsyncNFSeDownloader
+from nfse.config import Config
+from nfse.credentials import Credencial
+from nfse.state import StateStore
+from nfse.downloader import NFSeDownloader
+
+
+class FakeContent:
+    def __init__(self, body):
+        self.body = body
+
+    async def iter_chunked(self, size):
+        for i in range(0, len(self.body), size):
+            yield self.body[i : i + size]
+
+
+class FakeResp:
+    def __init__(self, status, data=None, body=b""):
+        self.status = status
+        self.content = FakeContent(json.dumps(data).encode() if data else body)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def text(self):
+        return ""
+
+
+class FakeSession:
+    def __init__(self):
+        self.urls = []
+        self.closed = False
+
+    def get(self, url):
+        self.urls.append(url)
+        if "/danfse/" in url:
+            return FakeResp(200, body=b"%PDF-1.4")
+        if len([u for u in self.urls if "/DFe/" in u]) == 1:
+            docs = []
+            for nsu in (2, 1):
+                xml = b"<r><dhEmi>2025-01-02T00:00:00</dhEmi></r>"
+                docs.append(
+                    {
+                        "NSU": str(nsu),
+                        "ChaveAcesso": f"k{nsu}",
+                        "ArquivoXml": base64.b64encode(gzip.compress(xml)).decode(),
+                    }
+                )
+            data = {"StatusProcessamento": "DOCUMENTOS_LOCALIZADOS", "LoteDFe": docs}
+            return FakeResp(200, data)
+        return FakeResp(204)
+
+    async def close(self):
+        self.closed = True
+
+
+def test_async_run_writes_documents_and_pdfs(tmp_path, monkeypatch):
+    monkeypatch.setattr(NFSeDownloader, "credencial", lambda self: Credencial(None, 0.0))
+    session = FakeSession()
+    cfg = Config(
+        cnpj="321",
+        output_dir=str(tmp_path / "xml"),
+        log_dir=str(tmp_path),
+        delay_seconds=0,
+        download_pdf=True,
+        pdf_workers=2,
+    )
+    dl = AsyncNFSeDownloader(cfg, session_factory=lambda pem: session)
+    msgs = []
+    cwd = os.getcwd()
+    os.chdir(tmp_path)
+    try:
+        dl.run(write=lambda m, log=True: msgs.append(m))
+    finally:
+        os.chdir(cwd)
+
+    names = sorted(p.name for p in (tmp_path / "xml").iterdir())
+    assert names == [
+        "NFS-e_2025-01_k1.pdf",
+        "NFS-e_2025-01_k1.xml",
+        "NFS-e_2025-01_k2.pdf",
+        "NFS-e_2025-01_k2.xml",
+    ]
+    assert StateStore(str(tmp_path / "nfse_state.db")).ler_cursor("321") == 3
+    assert session.closed
+    assert "PDFs: 2 baixados, 0 falhas" in " ".join(msgs)
+    assert msgs[-1] == "Processo concluído. Total baixados: 2"
+
+
+def test_async_stop_queues_pdf_of_written_document(tmp_path, monkeypatch):
+    monkeypatch.setattr(NFSeDownloader, "credencial", lambda self: Credencial(None, 0.0))
+    session = FakeSession()
+    cfg = Config(
+        cnpj="321",
+        output_dir=str(tmp_path / "xml"),
+        log_dir=str(tmp_path),
+        state_db=str(tmp_path / "state.db"),
+        delay_seconds=0,
+        download_pdf=True,
+        pdf_workers=2,
+    )
+    gravados = []
+
+    def write(msg, log=True):
+        if msg.startswith("XML Baixado"):
+            gravados.append(msg)
+
+    AsyncNFSeDownloader(cfg, session_factory=lambda pem: session).run(
+        write=write, running=lambda: not gravados
+    )
+
+    assert not [u for u in session.urls if "/danfse/" in u]
+    store = StateStore(cfg.state_db)
+    assert [p.chave for p in store.pdfs_pendentes("321")] == ["k1"]
+
+
+def test_async_pdf_stream_error_removes_partial_file(tmp_path, monkeypatch):
+    class Quebrado(FakeContent):
+        async def iter_chunked(self, size):
+            yield b"%PDF"
+            raise ConnectionError("reset")
+
+    class Sessao(FakeSession):
+        def get(self, url):
+            resp = super().get(url)
+            if "/danfse/" in url:
+                resp.content = Quebrado(b"")
+            return resp
+
+    monkeypatch.setattr(NFSeDownloader, "credencial", lambda self: Credencial(None, 0.0))
+    cfg = Config(
+        cnpj="321",
+        output_dir=str(tmp_path / "xml"),
+        log_dir=str(tmp_path),
+        state_db=str(tmp_path / "state.db"),
+        delay_seconds=0,
+        download_pdf=True,
+        pdf_workers=2,
+    )
+    AsyncNFSeDownloader(cfg, session_factory=lambda pem: Sessao()).run()
+
+    names = sorted(p.name for p in (tmp_path / "xml").iterdir())
+    assert names == ["NFS-e_2025-01_k1.xml", "NFS-e_2025-01_k2.xml"]
+    store = StateStore(cfg.state_db)
+    assert sorted(p.chave for p in store.pdfs_pendentes("321")) == ["k1", "k2"]
+
+
+class PaginasSession(FakeSession):
+    """Two documents per page, from NSU 1 to 8."""
+
+    def get(self, url):
+        self.urls.append(url)
+        inicio = int(url.rsplit("/", 1)[1].split("?")[0]) + 1
+        if inicio > 8:
+            return FakeResp(204)
+        xml = b"<r><dhEmi>2025-01-02T00:00:00</dhEmi></r>"
+        docs = [
+            {
+                "NSU": str(nsu),
+                "ChaveAcesso": f"k{nsu}",
+                "ArquivoXml": base64.b64encode(gzip.compress(xml)).decode(),
+            }
+            for nsu in (inicio, inicio + 1)
+        ]
+        return FakeResp(200, {"StatusProcessamento": "DOCUMENTOS_LOCALIZADOS", "LoteDFe": docs})
+
+
+@pytest.mark.parametrize("processos", [0, 2])
+def test_async_run_honours_prefetch_processes_and_limit(tmp_path, monkeypatch, processos):
+    monkeypatch.setattr(NFSeDownloader, "credencial", lambda self: Credencial(None, 0.0))
+    session = PaginasSession()
+    cfg = Config(
+        cnpj="321",
+        output_dir=str(tmp_path / "xml"),
+        log_dir=str(tmp_path),
+        state_db=str(tmp_path / "state.db"),
+        delay_seconds=0,
+        min_delay_seconds=0,
+        prefetch_depth=2,
+        decode_workers=3,
+        decode_processes=processos,
+    )
+    dl = AsyncNFSeDownloader(cfg, session_factory=lambda pem: session)
+    dl.limite = 5
+    resumo = dl.run()
+
+    names = sorted(p.name for p in (tmp_path / "xml").iterdir())
+    assert names == [f"NFS-e_2025-01_k{n}.xml" for n in range(1, 6)]
+    assert resumo.documentos == 5
+    assert StateStore(cfg.state_db).ler_cursor("321") == 7
+    # Nothing past the limit is requested.
+    assert len(session.urls) == 3
+
+
+def test_async_run_retries_a_malformed_page(tmp_path, monkeypatch):
+    class Truncada(PaginasSession):
+        def get(self, url):
+            resp = super().get(url)
+            if len(self.urls) == 1:
+                resp.content = FakeContent(resp.content.body[:-10])
+            return resp
+
+    monkeypatch.setattr(NFSeDownloader, "credencial", lambda self: Credencial(None, 0.0))
+    session = Truncada()
+    cfg = Config(
+        cnpj="321",
+        output_dir=str(tmp_path / "xml"),
+        log_dir=str(tmp_path),
+        state_db=str(tmp_path / "state.db"),
+        delay_seconds=0,
+        min_delay_seconds=0,
+        retry_backoff_seconds=0,
+    )
+    msgs = []
+    AsyncNFSeDownloader(cfg, session_factory=lambda pem: session).run(
+        write=lambda m, log=True: msgs.append(m)
+    )
+
+    assert any(m.startswith("Erro ao ler lote") for m in msgs)
+    assert session.urls[0] == session.urls[1]
+    assert StateStore(cfg.state_db).ler_cursor("321") == 9
@@ -0,0 +1,225 @@
+import base64
+import gzip
+import json
+import sys
+import threading
+import types
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+# Stub cryptography modules
+sys.modules.setdefault("requests", types.ModuleType("requests"))
+crypto = types.ModuleType("cryptography")
+hazmat = types.ModuleType("cryptography.hazmat")
+primitives = types.ModuleType("cryptography.hazmat.primitives")
+serialization = types.ModuleType("cryptography.hazmat.primitives.serialization")
+pkcs12 = types.ModuleType("cryptography.hazmat.primitives.serialization.pkcs12")
+serialization.Encoding = object()
+serialization.PrivateFormat = object()
+serialization.NoEncryption = object()
+pkcs12.load_key_and_certificates = lambda data, pwd, backend: (None, None, None)
+crypto.hazmat = hazmat
+hazmat.primitives = primitives
+primitives.serialization = serialization
+serialization.pkcs12 = pkcs12
+sys.modules["cryptography"] = crypto
+sys.modules["cryptography.hazmat"] = hazmat
+sys.modules["cryptography.hazmat.primitives"] = primitives
+sys.modules["cryptography.hazmat.primitives.serialization"] = serialization
+sys.modules["cryptography.hazmat.primitives.serialization.pkcs12"] = pkcs12
+
+
+from nfse.backfill import Backfill, dividir
+from nfse.config import Config
+from nfse.metrics import Metricas
+from nfse.state import Faixa, StateStore
+
+
+class DummyResp:
+    def __init__(self, status, data=None):
+        self.status_code = status
+        self._data = data or {}
+        self.text = ""
+        self.headers = {}
+
+    def iter_content(self, chunk_size=1):
+        corpo = json.dumps(self._data).encode()
+        for i in range(0, len(corpo), 11):
+            yield corpo[i : i + 11]
+
+    def close(self):
+        pass
+
+
+class PortalSession:
+    """Thread-safe fake portal returning up to ``pagina`` documents after the queried NSU."""
+
+    def __init__(self, nsus, pagina=3):
+        self.nsus = sorted(nsus)
+        self.pagina = pagina
+        self.consultas = []
+        self.lock = threading.Lock()
+
+    def get(self, url, timeout=0, stream=False):
+        consulta = int(url.rsplit("/", 1)[1].split("?")[0])
+        with self.lock:
+            self.consultas.append(consulta)
+        nsus = [n for n in self.nsus if n > consulta][: self.pagina]
+        if not nsus:
+            return DummyResp(204)
+        docs = [
+            {
+                "NSU": str(n),
+                "ChaveAcesso": f"k{n}",
+                "ArquivoXml": base64.b64encode(gzip.compress(b"<r/>")).decode(),
+            }
+            for n in nsus
+        ]
+        return DummyResp(200, {"StatusProcessamento": "DOCUMENTOS_LOCALIZADOS", "LoteDFe": docs})
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def cfg(tmp_path, monkeypatch):
+    req_mod = types.ModuleType("requests")
+    req_mod.exceptions = types.SimpleNamespace(RequestException=ConnectionError)
+    import nfse.downloader as dl_mod
+
+    monkeypatch.setattr(dl_mod, "requests", req_mod)
+    return Config(
+        cnpj="123",
+        output_dir=str(tmp_path / "xml"),
+        log_dir=str(tmp_path),
+        state_db=str(tmp_path / "state.db"),
+        delay_seconds=0,
+        queue_size=2,
+    )
+
+
+def _chaves(cfg):
+    return sorted(int(p.name.split("_k")[1].split(".")[0]) for p in Path(cfg.output_dir).iterdir())
+
+
+def test_dividir_covers_range_without_overlap():
+    faixas = dividir(10, 20, 3)
+    assert [(f.inicio, f.fim) for f in faixas] == [(10, 13), (14, 17), (18, 20)]
+    assert all(f.cursor == f.inicio for f in faixas)
+    assert dividir(5, 6, 4) == [Faixa(5, 5, 5), Faixa(6, 6, 6)]
+    assert dividir(5, 4, 2) == []
+
+
+def test_descobrir_limite_finds_last_nsu(cfg):
+    nsus = list(range(1, 30)) + [900, 2500, 7000, 7001]
+    sess = PortalSession(nsus)
+    bf = Backfill(cfg, metricas=Metricas())
+
+    assert bf.descobrir_limite(sess, 1) == 7001
+    assert len(sess.consultas) < 30
+    assert bf.descobrir_limite(PortalSession([]), 1) == 0
+
+
+def test_backfill_downloads_shards_and_merges_cursor(cfg):
+    nsus = [n for n in range(1, 61) if n % 7]
+    sess = PortalSession(nsus)
+    msgs = []
+
+    resumo = Backfill(cfg, metricas=Metricas()).run(
+        write=lambda m, log=True: msgs.append(m), partes=4, session=sess
+    )
+
+    assert resumo.documentos == len(nsus)
+    assert _chaves(cfg) == nsus
+    store = StateStore(cfg.state_db)
+    assert store.ler_cursor("123") == 61
+    assert store.contar_documentos("123") == len(nsus)
+    assert store.ler_faixas("123") == []
+    assert "Backfill do NSU 1 a 60 em 4 faixas." in msgs
+
+
+def test_backfill_resumes_interrupted_shards(cfg):
+    nsus = list(range(1, 41))
+    sess = PortalSession(nsus, pagina=2)
+
+    Backfill(cfg, metricas=Metricas()).run(
+        running=lambda: len(sess.consultas) < 12, fim=40, partes=4, session=sess
+    )
+
+    store = StateStore(cfg.state_db)
+    faixas = store.ler_faixas("123")
+    assert len(faixas) == 4 and not all(f.concluida for f in faixas)
+    cursor = store.ler_cursor("123")
+    # The merged cursor never passes a document that was not written.
+    assert set(range(1, cursor)) <= set(_chaves(cfg))
+
+    msgs = []
+    resumo = Backfill(cfg, metricas=Metricas()).run(
+        write=lambda m, log=True: msgs.append(m), session=sess
+    )
+
+    assert any(m.startswith("Retomando backfill de 4 faixas") for m in msgs)
+    assert _chaves(cfg) == nsus
+    assert store.ler_cursor("123") == 41
+    assert store.contar_documentos("123") == 40
+    assert resumo.erro is None
+
+
+def test_backfill_caps_fim_at_last_nsu(cfg):
+    sess = PortalSession(list(range(1, 11)))
+    msgs = []
+
+    Backfill(cfg, metricas=Metricas()).run(
+        write=lambda m, log=True: msgs.append(m), fim=100, partes=4, session=sess
+    )
+
+    assert "Backfill do NSU 1 a 10 em 4 faixas." in msgs
+    store = StateStore(cfg.state_db)
+    assert store.ler_faixas("123") == []
+    assert store.ler_cursor("123") == 11
+    assert _chaves(cfg) == list(range(1, 11))
+
+
+def test_backfill_drains_pdf_queue_with_one_worker(cfg, monkeypatch):
+    from nfse.fila_pdf import TrabalhadorFilaPDF
+
+    iniciados = []
+    iniciar = TrabalhadorFilaPDF.iniciar
+
+    def contar(self):
+        iniciados.append(self)
+        return iniciar(self)
+
+    monkeypatch.setattr(TrabalhadorFilaPDF, "iniciar", contar)
+    cfg.download_pdf = True
+    cfg.pdf_workers = 0
+    sess = PortalSession(list(range(1, 13)))
+
+    Backfill(cfg, metricas=Metricas()).run(partes=4, session=sess)
+
+    assert len(iniciados) == 1
+    # The fake portal fails every DANFSe request, so all PDFs wait for a retry.
+    assert StateStore(cfg.state_db).contar_pdfs_pendentes("123") == 12
+
+
+def test_shards_leave_shared_archives_open_until_the_end(cfg, monkeypatch):
+    from nfse.storage import Armazenamento
+
+    fechamentos = []
+    close = Armazenamento.close
+
+    def contar(self):
+        fechamentos.append(len(self._arquivos))
+        close(self)
+
+    monkeypatch.setattr(Armazenamento, "close", contar)
+    cfg.output_format = "mensal"
+    sess = PortalSession(list(range(1, 41)), pagina=2)
+
+    Backfill(cfg, metricas=Metricas()).run(partes=4, session=sess)
+
+    # Only Backfill.run closes the archives the shards append to.
+    assert fechamentos == [1]
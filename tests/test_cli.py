@@ -0,0 +1,105 @@
+import json
+import os
+import re
+import subprocess
+import sys
+import types
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+# Stub cryptography modules
+sys.modules.setdefault("requests", types.ModuleType("requests"))
+crypto = types.ModuleType("cryptography")
+hazmat = types.ModuleType("cryptography.hazmat")
+primitives = types.ModuleType("cryptography.hazmat.primitives")
+serialization = types.ModuleType("cryptography.hazmat.primitives.serialization")
+pkcs12 = types.ModuleType("cryptography.hazmat.primitives.serialization.pkcs12")
+serialization.Encoding = object()
+serialization.PrivateFormat = object()
+serialization.NoEncryption = object()
+pkcs12.load_key_and_certificates = lambda data, pwd, backend: (None, None, None)
+crypto.hazmat = hazmat
+hazmat.primitives = primitives
+primitives.serialization = serialization
+serialization.pkcs12 = pkcs12
+sys.modules["cryptography"] = crypto
+sys.modules["cryptography.hazmat"] = hazmat
+sys.modules["cryptography.hazmat.primitives"] = primitives
+sys.modules["cryptography.hazmat.primitives.serialization"] = serialization
+sys.modules["cryptography.hazmat.primitives.serialization.pkcs12"] = pkcs12
+
+
+from nfse import cli
+from nfse.config import Config
+from nfse.pipeline import RunSummary
+
+# Cumulative import time allowed for ``nfse.cli`` (measured ~50 ms).
+IMPORT_BUDGET_US = 150_000
+
+
+def _config(tmp_path, **kw) -> str:
+    path = tmp_path / "config.json"
+    Config(state_db=str(tmp_path / "state.db"), log_dir=str(tmp_path), **kw).save(str(path))
+    return str(path)
+
+
+def _linhas(capsys) -> list[dict]:
+    return [json.loads(l) for l in capsys.readouterr().out.splitlines()]
+
+
+def test_set_nsu_and_status_json(tmp_path, capsys):
+    path = _config(tmp_path, cnpj="123")
+    assert cli.main(["--config", path, "set-nsu", "42"]) == 0
+    assert capsys.readouterr().out == "NSU de 123 definido para 42\n"
+    assert cli.main(["--config", path, "--json", "status"]) == 0
+    status = _linhas(capsys)[-1]
+    assert status["evento"] == "status"
+    assert (status["cnpj"], status["nsu"], status["documentos"]) == ("123", 42, 0)
+
+
+def test_status_imports_legacy_nsu_file(tmp_path, capsys, monkeypatch):
+    path = _config(tmp_path, cnpj="123")
+    (tmp_path / "ultimo_nsu_123.txt").write_text("77")
+    monkeypatch.chdir(tmp_path)
+    assert cli.main(["--config", path, "--json", "status"]) == 0
+    assert _linhas(capsys)[-1]["nsu"] == 77
+
+
+def test_run_prints_summary(tmp_path, capsys, monkeypatch):
+    class FakeDownloader:
+        def run(self, write, running):
+            write("NSU 1", log=False)
+            return RunSummary("123", documentos=1, bytes=10)
+
+        def close(self):
+            pass
+
+    import nfse.downloader as dl_mod
+
+    monkeypatch.setattr(dl_mod, "criar_downloader", lambda cfg: FakeDownloader())
+    path = _config(tmp_path, cnpj="123")
+    assert cli.main(["--config", path, "--json", "run"]) == 0
+    eventos = _linhas(capsys)
+    assert eventos[0] == {"evento": "log", "mensagem": "NSU 1"}
+    assert eventos[-1]["evento"] == "resumo" and eventos[-1]["documentos"] == 1
+
+
+def test_status_stays_light(tmp_path):
+    path = _config(tmp_path)
+    codigo = (
+        "import sys\n"
+        "from nfse import cli\n"
+        f"cli.main(['--config', {path!r}, 'status'])\n"
+        "pesados = ('requests', 'cryptography', 'aiohttp', 'tkinter', 'nfse.downloader')\n"
+        "print([m for m in sys.modules if m.startswith(pesados)])\n"
+    )
+    env = dict(os.environ, PYTHONPATH=str(ROOT))
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", codigo],
+        capture_output=True, text=True, env=env, cwd=tmp_path, check=True,
+    )
+    assert proc.stdout.splitlines()[-1] == "[]"
+    tempos = re.findall(r"import time:\s+\d+ \|\s+(\d+) \| nfse\.cli$", proc.stderr, re.M)
+    assert tempos and int(tempos[0]) < IMPORT_BUDGET_US
@@ -0,0 +1,56 @@
+import os
+import sys
+import types
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+# Stub cryptography modules
+sys.modules.setdefault("requests", types.ModuleType("requests"))
+crypto = types.ModuleType("cryptography")
+hazmat = types.ModuleType("cryptography.hazmat")
+primitives = types.ModuleType("cryptography.hazmat.primitives")
+serialization = types.ModuleType("cryptography.hazmat.primitives.serialization")
+pkcs12 = types.ModuleType("cryptography.hazmat.primitives.serialization.pkcs12")
+serialization.Encoding = object()
+serialization.PrivateFormat = object()
+serialization.NoEncryption = object()
+pkcs12.load_key_and_certificates = lambda data, pwd, backend: (None, None, None)
+crypto.hazmat = hazmat
+hazmat.primitives = primitives
+primitives.serialization = serialization
+serialization.pkcs12 = pkcs12
+sys.modules["cryptography"] = crypto
+sys.modules["cryptography.hazmat"] = hazmat
+sys.modules["cryptography.hazmat.primitives"] = primitives
+sys.modules["cryptography.hazmat.primitives.serialization"] = serialization
+sys.modules["cryptography.hazmat.primitives.serialization.pkcs12"] = pkcs12
+
+from nfse.credentials import CacheCredenciais
+
+
+def test_cache_reuses_context_until_certificate_changes(tmp_path):
+    pfx = tmp_path / "cert.pfx"
+    pfx.write_bytes(b"pfx")
+    cargas = []
+
+    def carregar(path, senha):
+        cargas.append((path, senha))
+        return object()
+
+    cache = CacheCredenciais(carregar)
+    primeira = cache.obter(str(pfx), "senha")
+    segunda = cache.obter(str(pfx), "senha")
+    assert len(cargas) == 1
+    assert not primeira.reutilizada and segunda.reutilizada
+    assert segunda.contexto is primeira.contexto
+
+    cache.obter(str(pfx), "outra")
+    assert len(cargas) == 2
+
+    st = pfx.stat()
+    os.utime(pfx, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000_000))
+    nova = cache.obter(str(pfx), "senha")
+    assert len(cargas) == 3 and nova.contexto is not primeira.contexto
+    # Entries of the previous file version are dropped.
+    assert len(cache._entradas) == 1
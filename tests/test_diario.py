@@ -0,0 +1,145 @@
+import base64
+import gzip
+import json
+import sys
+import types
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+# Stub cryptography modules
+sys.modules.setdefault("requests", types.ModuleType("requests"))
+crypto = types.ModuleType("cryptography")
+hazmat = types.ModuleType("cryptography.hazmat")
+primitives = types.ModuleType("cryptography.hazmat.primitives")
+serialization = types.ModuleType("cryptography.hazmat.primitives.serialization")
+pkcs12 = types.ModuleType("cryptography.hazmat.primitives.serialization.pkcs12")
+serialization.Encoding = object()
+serialization.PrivateFormat = object()
+serialization.NoEncryption = object()
+pkcs12.load_key_and_certificates = lambda data, pwd, backend: (None, None, None)
+crypto.hazmat = hazmat
+hazmat.primitives = primitives
+primitives.serialization = serialization
+serialization.pkcs12 = pkcs12
+sys.modules["cryptography"] = crypto
+sys.modules["cryptography.hazmat"] = hazmat
+sys.modules["cryptography.hazmat.primitives"] = primitives
+sys.modules["cryptography.hazmat.primitives.serialization"] = serialization
+sys.modules["cryptography.hazmat.primitives.serialization.pkcs12"] = pkcs12
+
+
+
+from nfse.config import Config
+from nfse.diario import DiarioDFe, SessaoDiario
+from nfse.downloader import NFSeDownloader
+from nfse.reprocessamento import Reprocessamento
+from nfse.state import StateStore
+from nfse.storage import ler_xml
+
+
+class Resp:
+    def __init__(self, status, data=None):
+        self.status_code = status
+        self.text = ""
+        self.headers = {}
+        self._corpo = json.dumps(data or {}).encode()
+
+    def iter_content(self, chunk_size=1):
+        for i in range(0, len(self._corpo), 5):
+            yield self._corpo[i : i + 5]
+
+    def close(self):
+        pass
+
+
+class Portal:
+    """Three pages of two documents, each dated in the month of its NSU."""
+
+    def __init__(self):
+        self.urls = []
+
+    def get(self, url, timeout=0, stream=False):
+        self.urls.append(url)
+        consulta = int(url.rsplit("/", 1)[1].split("?")[0])
+        nsus = [n for n in (consulta + 1, consulta + 2) if n <= 6]
+        if not nsus:
+            return Resp(204)
+        docs = [
+            {
+                "NSU": str(n),
+                "ChaveAcesso": f"k{n}",
+                "ArquivoXml": base64.b64encode(
+                    gzip.compress(f"<r><dhEmi>2024-0{n}-10T00:00:00</dhEmi></r>".encode())
+                ).decode(),
+            }
+            for n in nsus
+        ]
+        return Resp(200, {"StatusProcessamento": "DOCUMENTOS_LOCALIZADOS", "LoteDFe": docs})
+
+    def close(self):
+        pass
+
+
+def _cfg(tmp_path, saida="xml", **kw):
+    return Config(
+        cnpj="123",
+        output_dir=str(tmp_path / saida),
+        log_dir=str(tmp_path),
+        state_db=str(tmp_path / "state.db"),
+        journal_dir=str(tmp_path / "diario"),
+        delay_seconds=0,
+        **kw,
+    )
+
+
+def test_run_journals_pages_and_replay_rewrites_archive(tmp_path, monkeypatch):
+    portal = Portal()
+    monkeypatch.setattr(NFSeDownloader, "_abrir_sessao", lambda self, write: portal)
+    NFSeDownloader(_cfg(tmp_path)).run()
+
+    paginas = list(DiarioDFe(str(tmp_path / "diario"), "123").paginas())
+    assert [(p.nsu_inicial, p.nsu_final) for p in paginas] == [(1, 2), (3, 4), (5, 6)]
+    assert json.loads(b"".join(paginas[1].corpo()))["LoteDFe"][0]["NSU"] == "3"
+
+    def sem_rede(self, write):
+        raise AssertionError("o reprocessamento não pode acessar o portal")
+
+    monkeypatch.setattr(NFSeDownloader, "_abrir_sessao", sem_rede)
+    cfg = _cfg(tmp_path, "novo", output_format="gzip", file_prefix="N")
+    store = StateStore(cfg.state_db)
+    store.salvar_cursor("123", 99)
+    resumo = Reprocessamento(cfg, store).run()
+
+    assert resumo.documentos == 6
+    nomes = sorted(p.name for p in (tmp_path / "novo").iterdir())
+    assert nomes[0] == "N_2024-01_k1.xml.gz" and len(nomes) == 6
+    assert ler_xml(str(tmp_path / "novo" / nomes[2])).startswith(b"<r><dhEmi>2024-03")
+    assert store.documento("123", 3).caminho.endswith("N_2024-03_k3.xml.gz")
+    assert store.ler_cursor("123") == 99
+    # The replay itself is not journaled again.
+    assert len(DiarioDFe(str(tmp_path / "diario"), "123").arquivos()) == 1
+
+
+def test_journal_skips_truncated_record_and_serves_latest_copy(tmp_path):
+    diario = DiarioDFe(str(tmp_path), "123")
+    diario.registrar(0, 2, gzip.compress(b'{"v": 1}'))
+    diario.registrar(3, 4, gzip.compress(b'{"v": 2}'))
+    novo = DiarioDFe(str(tmp_path), "123")
+    novo.registrar(0, 2, gzip.compress(b'{"v": 3}'))
+    with open(novo._arquivo, "ab") as f:
+        f.write(b'{"nsu_inicial": 5, "nsu_final": 6, "buscado_em": "x", "tamanho": 50}\n{"v"')
+
+    sessao = SessaoDiario(novo.paginas())
+
+    assert [(p.nsu_inicial, p.nsu_final) for p in sessao.paginas] == [(0, 2), (3, 4)]
+    resp = sessao.get("http://x/00000000000000000000?cnpj=123")
+    assert b"".join(resp.iter_content()) == b'{"v": 3}'
+    assert sessao.pagina(4).nsu_inicial == 3
+    assert sessao.pagina(1).nsu_inicial == 0
+    assert sessao.get("http://x/00000000000000000004?cnpj=123").status_code == 204
+
+    with pytest.raises(ValueError, match="Defina journal_dir"):
+        Reprocessamento(Config())
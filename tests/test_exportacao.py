@@ -0,0 +1,94 @@
+import csv
+import gzip
+import random
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from benchmarks.corpus import evento_xml, nfse_xml
+from nfse.campos import extrair_campos
+from nfse.config import Config
+from nfse.exportacao import Exportador
+from nfse.state import RegistroDocumento, StateStore
+
+CHAVE = "1" * 50
+
+
+def test_extrair_campos_of_note_and_event():
+    xml = nfse_xml(random.Random(1), CHAVE, 2024, 5, prestador="11111111000111", tomador="22222222000122")
+    campos = extrair_campos(xml, CHAVE)
+    assert (campos.tipo, campos.prestador, campos.tomador) == ("nfse", "11111111000111", "22222222000122")
+    assert campos.data_emissao.startswith("2024-05-") and campos.ano_mes == ("2024", "05")
+    assert campos.codigo_servico == "010101"
+    assert campos.valor_servico > campos.valor_liquido > 0
+    assert campos.tipo_evento is None
+
+    evento = extrair_campos(evento_xml(random.Random(2), CHAVE, 2024, 7), "e" + CHAVE)
+    assert (evento.tipo, evento.tipo_evento, evento.chave_nfse) == ("evento", "101101", CHAVE)
+    assert evento.ano_mes == ("2024", "07") and evento.valor_servico is None
+
+    with pytest.raises(ValueError):
+        extrair_campos(b"<NFSe><nNFSe>1", CHAVE)
+
+
+def _acervo(tmp_path, store, nsus, cnpj="123"):
+    rng = random.Random(0)
+    registros = []
+    for nsu in nsus:
+        chave = f"{nsu:050d}"
+        caminho = tmp_path / f"NFS-e_{chave}.xml.gz"
+        caminho.write_bytes(gzip.compress(nfse_xml(rng, chave, 2024, 1 + nsu % 2)))
+        registros.append(RegistroDocumento(nsu, chave, "salvo", str(caminho)))
+    store.registrar_lote(cnpj, max(nsus) + 1, registros)
+
+
+def test_export_is_incremental_and_partitioned(tmp_path):
+    cfg = Config(cnpj="123", state_db=str(tmp_path / "state.db"), export_dir=str(tmp_path / "exp"))
+    store = StateStore(cfg.state_db)
+    _acervo(tmp_path, store, [1, 2, 3])
+    store.registrar_lote("123", 4, [RegistroDocumento(4, "sumiu", "salvo", str(tmp_path / "x.xml"))])
+
+    stats = Exportador(cfg, store, "csv").run()
+
+    assert (stats.exportados, stats.falhas, stats.arquivos) == (3, 1, 2)
+    fev = tmp_path / "exp" / "cnpj=123" / "ano=2024" / "mes=02"
+    (parte,) = fev.iterdir()
+    assert parte.name == f"part-{1:020d}-{3:020d}.csv"
+    with open(parte, encoding="utf-8") as f:
+        linhas = list(csv.DictReader(f))
+    assert [l["nsu"] for l in linhas] == ["1", "3"]
+    assert linhas[0]["chave"] == f"{1:050d}" and float(linhas[0]["valor_servico"]) > 0
+
+    _acervo(tmp_path, store, [5])
+    stats = Exportador(cfg, store, "csv").run()
+    assert (stats.exportados, stats.falhas) == (1, 1)
+    assert sorted(p.name[-10:] for p in fev.iterdir()) == ["000003.csv", "000005.csv"]
+    assert len(list((fev.parent / "mes=01").iterdir())) == 1
+
+
+def test_export_uses_index_and_repeats_changed_documents(tmp_path):
+    cfg = Config(cnpj="123", state_db=str(tmp_path / "state.db"), export_dir=str(tmp_path / "exp"))
+    store = StateStore(cfg.state_db)
+    xml = nfse_xml(random.Random(4), CHAVE, 2024, 3)
+    campos = extrair_campos(xml, CHAVE)
+    registro = RegistroDocumento(1, CHAVE, "salvo", str(tmp_path / "sumiu.xml"), "a", campos)
+    store.registrar_lote("123", 2, [registro])
+
+    # Indexed documents are exported without reading the file.
+    assert Exportador(cfg, store, "csv").run().exportados == 1
+
+    store.registrar_lote("123", 2, [registro])
+    assert Exportador(cfg, store, "csv").run().exportados == 0
+
+    registro.status, registro.sha256 = "substituído", "b"
+    store.registrar_lote("123", 2, [registro])
+    assert Exportador(cfg, store, "csv").run().exportados == 1
+
+
+def test_parquet_requires_pyarrow(tmp_path, monkeypatch):
+    monkeypatch.setitem(sys.modules, "pyarrow", None)
+    with pytest.raises(RuntimeError, match="pyarrow"):
+        Exportador(Config(), StateStore(str(tmp_path / "s.db")), "parquet")
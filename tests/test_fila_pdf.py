@@ -0,0 +1,57 @@
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from nfse.fila_pdf import FilaPDF
+from nfse.state import StateStore
+
+
+class FakePDF:
+    """Stands in for NFSePDFDownloader; downloads succeed for chaves in ``ok``."""
+
+    def __init__(self, ok=()):
+        self.ok = set(ok)
+        self.chamadas = []
+
+    def submeter(self, chave, destino, callback):
+        self.chamadas.append(chave)
+        callback(chave, destino, chave in self.ok, False, 0.01)
+
+    def cancelar(self):
+        pass
+
+    def aguardar(self):
+        pass
+
+
+def test_failures_back_off_exponentially(tmp_path):
+    fila = FilaPDF(StateStore(str(tmp_path / "s.db")), "1", backoff=10, backoff_max=35)
+    antes = time.time()
+    atrasos = [fila.falhou("k", "k.pdf").proxima_em - antes for _ in range(4)]
+
+    assert 8 <= atrasos[0] <= 12.5
+    assert 16 <= atrasos[1] <= 24.5
+    assert 28 <= atrasos[2] <= 42.5 and 28 <= atrasos[3] <= 42.5
+    assert fila.state.pdfs_pendentes("1")[0].tentativas == 4
+
+
+def test_drenar_retries_only_due_entries(tmp_path):
+    state = StateStore(str(tmp_path / "s.db"))
+    fila = FilaPDF(state, "1", backoff=0, max_tentativas=3)
+    for chave in ("a", "b", "c"):
+        fila.falhou(chave, f"{chave}.pdf")
+    FilaPDF(state, "1", backoff=3600).falhou("tarde", "tarde.pdf")
+    pdf = FakePDF(ok={"a"})
+
+    assert fila.drenar(pdf) == (1, 2)
+    assert sorted(pdf.chamadas) == ["a", "b", "c"]
+    assert sorted(p.chave for p in state.pdfs_pendentes("1")) == ["b", "c", "tarde"]
+
+    # ``todos`` ignores the schedule; entries past max_tentativas are left alone.
+    pdf = FakePDF(ok={"tarde"})
+    assert fila.drenar(pdf, todos=True) == (1, 2)
+    assert fila.drenar(FakePDF(), todos=True) == (0, 0)
+    assert state.contar_pdfs_pendentes("1") == 2
+    assert fila.espera() is None
@@ -0,0 +1,78 @@
+import gzip
+import json
+import random
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from benchmarks.corpus import evento_xml, nfse_xml
+from nfse import cli
+from nfse.campos import extrair_campos_gzip
+from nfse.config import Config
+from nfse.indice import ReconstrucaoIndice
+from nfse.state import FiltroIndice, RegistroDocumento, StateStore
+
+A, B, C = "11111111000111", "22222222000122", "33333333000133"
+
+
+def _acervo(tmp_path, store):
+    """Store three notes and an event, without index rows."""
+    rng = random.Random(0)
+    notas = [(1, 1, A, B), (2, 2, B, C), (3, 3, A, C)]
+    registros = []
+    for nsu, mes, prestador, tomador in notas:
+        chave = f"{nsu:050d}"
+        caminho = tmp_path / f"NFS-e_{chave}.xml.gz"
+        caminho.write_bytes(gzip.compress(nfse_xml(rng, chave, 2024, mes, prestador, tomador)))
+        registros.append(RegistroDocumento(nsu, chave, "salvo", str(caminho)))
+    evento = tmp_path / "evento.xml"
+    evento.write_bytes(evento_xml(rng, f"{1:050d}", 2024, 4))
+    registros.append(RegistroDocumento(4, "e" + f"{1:050d}", "salvo", str(evento)))
+    registros.append(RegistroDocumento(5, "sumiu", "salvo", str(tmp_path / "sumiu.xml")))
+    store.registrar_lote("123", 6, registros)
+
+
+def test_extrair_campos_gzip_matches_plain():
+    xml = nfse_xml(random.Random(3), "k", 2024, 6, A, B)
+    campos = extrair_campos_gzip(gzip.compress(xml), "k")
+    assert (campos.prestador, campos.tomador, campos.data[:7]) == (A, B, "2024-06")
+
+
+def test_rebuild_and_search(tmp_path):
+    store = StateStore(str(tmp_path / "state.db"))
+    _acervo(tmp_path, store)
+    assert store.contar_indexados("123") == 0
+
+    stats = ReconstrucaoIndice(Config(), store, workers=1).run()
+
+    assert (stats.indexados, stats.falhas) == (4, 1)
+    assert store.contar_indexados("123") == 4
+    assert [e.nsu for e in store.buscar(FiltroIndice(participante=A))] == [1, 3]
+    assert [e.nsu for e in store.buscar(FiltroIndice(tomador=C, de="2024-03-01"))] == [3]
+    assert [e.nsu for e in store.buscar(FiltroIndice(ate="2024-01-31", tipo="nfse"))] == [1]
+    (evento,) = store.buscar(FiltroIndice(tipo="evento"))
+    assert evento.campos.chave_nfse == f"{1:050d}" and evento.caminho.endswith("evento.xml")
+    (nota,) = store.buscar(FiltroIndice(chave=f"{2:050d}"))
+    assert nota.campos.valor_servico > 0
+    assert store.buscar(FiltroIndice(valor_min=nota.campos.valor_servico + 1e9)) == []
+
+    # Rows are replaced, so rebuilding again is harmless.
+    ReconstrucaoIndice(Config(), store, workers=1).run()
+    assert store.contar_indexados("123") == 4
+
+
+def test_cli_buscar_json(tmp_path, capsys):
+    store = StateStore(str(tmp_path / "state.db"))
+    _acervo(tmp_path, store)
+    ReconstrucaoIndice(Config(), store, workers=1).run()
+    store.close()
+    config = tmp_path / "config.json"
+    Config(state_db=str(tmp_path / "state.db"), log_dir=str(tmp_path)).save(str(config))
+
+    assert cli.main(["--config", str(config), "--json", "buscar", "--prestador", A]) == 0
+
+    linhas = [json.loads(l) for l in capsys.readouterr().out.splitlines()]
+    assert [l["nsu"] for l in linhas if l["evento"] == "documento"] == [1, 3]
+    assert linhas[0]["prestador"] == A and linhas[0]["caminho"].endswith(".xml.gz")
+    assert linhas[-1]["total"] == 2
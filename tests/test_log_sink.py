@@ -0,0 +1,101 @@
+import logging
+import sys
+import threading
+import types
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+# Stub external dependencies used by download_nfse
+sys.modules.setdefault("requests", types.ModuleType("requests"))
+crypto = types.ModuleType("cryptography")
+hazmat = types.ModuleType("cryptography.hazmat")
+primitives = types.ModuleType("cryptography.hazmat.primitives")
+serialization = types.ModuleType("cryptography.hazmat.primitives.serialization")
+pkcs12 = types.ModuleType("cryptography.hazmat.primitives.serialization.pkcs12")
+serialization.Encoding = object()
+serialization.PrivateFormat = object()
+serialization.NoEncryption = object()
+pkcs12.load_key_and_certificates = lambda data, pwd, backend: (None, None, None)
+crypto.hazmat = hazmat
+hazmat.primitives = primitives
+primitives.serialization = serialization
+serialization.pkcs12 = pkcs12
+sys.modules["cryptography"] = crypto
+sys.modules["cryptography.hazmat"] = hazmat
+sys.modules["cryptography.hazmat.primitives"] = primitives
+sys.modules["cryptography.hazmat.primitives.serialization"] = serialization
+sys.modules["cryptography.hazmat.primitives.serialization.pkcs12"] = pkcs12
+
+import download_nfse
+from nfse.log_sink import LogSink
+
+
+def test_push_and_drain_in_batches():
+    sink = LogSink()
+    for i in range(5):
+        sink.push(f"l{i}\n", status=f"s{i}")
+    assert sink.drain(2) == ["l0\n", "l1\n"]
+    assert sink.drain() == ["l2\n", "l3\n", "l4\n"]
+    assert sink.drain() == []
+    assert sink.status == "s4"
+
+
+def test_pending_lines_are_bounded():
+    sink = LogSink(max_pendentes=3)
+    threads = [
+        threading.Thread(target=lambda n=n: [sink.push(f"{n}-{i}") for i in range(100)])
+        for n in range(4)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(sink.drain()) == 3
+    assert sink.descartadas == 397
+
+
+class DummyText:
+    def __init__(self):
+        self.lines = []
+
+    def insert(self, index, text):
+        self.lines.extend(text.splitlines())
+
+    def index(self, index):
+        return f"{len(self.lines) + 1}.0"
+
+    def delete(self, start, end):
+        del self.lines[: int(end.split(".")[0]) - 1]
+
+    def see(self, index):
+        pass
+
+
+class DummyLabel:
+    def __init__(self):
+        self.text = None
+
+    def config(self, text=None, **kwargs):
+        self.text = text
+
+
+def test_app_write_only_touches_sink_and_drain_trims(monkeypatch):
+    App = download_nfse.App
+    app = App.__new__(App)
+    app.logger = logging.getLogger("test")
+    app.log_sink = LogSink()
+    app.download_done = threading.Event()
+    app.text = None  # write() must not use the widget
+
+    for i in range(12):
+        app.write(f"msg {i}", log=False)
+
+    app.text = DummyText()
+    app.status_label = DummyLabel()
+    app.root = types.SimpleNamespace(after=lambda ms, func: None)
+    monkeypatch.setattr(App, "LOG_MAX_LINES", 5)
+    app.drain_log()
+    assert len(app.text.lines) == 5
+    assert app.text.lines[-1].endswith("msg 11")
+    assert app.status_label.text == "msg 11"
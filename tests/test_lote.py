@@ -0,0 +1,78 @@
+import json
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from nfse.lote import LeitorLote
+from nfse.pipeline import NSUVistos
+
+
+def _pedacos(dados: bytes, tamanho: int):
+    return [dados[i : i + tamanho] for i in range(0, len(dados), tamanho)]
+
+
+@pytest.mark.parametrize("tamanho", [1, 3, 64, 10_000])
+def test_leitor_lote_yields_documents_across_chunk_boundaries(tamanho):
+    resposta = {
+        "StatusProcessamento": "DOCUMENTOS_LOCALIZADOS",
+        "LoteDFe": [
+            {"NSU": 10, "ChaveAcesso": "k10", "ArquivoXml": "QUJD" * 50},
+            {"NSU": 11, "ChaveAcesso": "ç11", "ArquivoXml": "REVG"},
+        ],
+        "TipoAmbiente": 12345,
+        "Alertas": None,
+        "Obs": 'a "[x]" \\ {',
+    }
+    corpo = json.dumps(resposta, ensure_ascii=False, indent=1).encode()
+    leitor = LeitorLote()
+    docs = list(leitor.iterar(_pedacos(corpo, tamanho)))
+    assert docs == resposta["LoteDFe"]
+    assert leitor.campos == {
+        "StatusProcessamento": "DOCUMENTOS_LOCALIZADOS",
+        "TipoAmbiente": 12345,
+        "Alertas": None,
+        "Obs": 'a "[x]" \\ {',
+    }
+
+
+def test_leitor_lote_rejects_truncated_body():
+    corpo = b'{"LoteDFe": [{"NSU": 1}, {"NSU": 2'
+    leitor = LeitorLote()
+    with pytest.raises(ValueError):
+        list(leitor.iterar(_pedacos(corpo, 5)))
+
+
+def test_leitor_lote_decodes_large_document_once(monkeypatch):
+    from nfse import lote
+
+    grande = {"NSU": 1, "ChaveAcesso": "k1", "ArquivoXml": "QUJD" * (2 << 20)}
+    corpo = json.dumps({"LoteDFe": [grande, {"NSU": 2}]}).encode()
+    chamadas = []
+    loads = json.loads
+    monkeypatch.setattr(lote.json, "loads", lambda s: chamadas.append(len(s)) or loads(s))
+
+    docs = list(LeitorLote().iterar(_pedacos(corpo, lote.CHUNK_SIZE)))
+
+    assert [d["NSU"] for d in docs] == [1, 2]
+    assert docs[0]["ArquivoXml"] == grande["ArquivoXml"]
+    # One decode per value, however many chunks the document spans.
+    assert len(chamadas) == 3
+
+
+def test_nsu_vistos_stays_bounded():
+    vistos = NSUVistos(5)
+    assert not vistos.adicionar(4)
+    assert vistos.adicionar(7)
+    assert vistos.adicionar(5)
+    assert not vistos.adicionar(7)
+    assert (vistos.contiguo, len(vistos)) == (5, 1)
+    assert vistos.adicionar(6)
+    assert (vistos.contiguo, len(vistos)) == (7, 0)
+    # A gap that never fills is dropped when the page closes.
+    vistos.adicionar(20)
+    vistos.avancar(20)
+    assert (vistos.contiguo, len(vistos)) == (20, 0)
+    assert not vistos.adicionar(15)
@@ -0,0 +1,45 @@
+import sys
+import urllib.request
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from nfse.metrics import Metricas, ServidorMetricas
+
+
+def test_views_share_storage_and_summary_is_a_delta():
+    raiz = Metricas()
+    a = raiz.vincular(cnpj="1")
+    b = raiz.vincular(cnpj="2")
+    a.documentos.inc()
+    antes = a.amostras()
+    a.documentos.inc(2)
+    b.documentos.inc()
+    a.latencia.observar(0.02, servico="dfe")
+
+    assert raiz.amostras()['nfse_documentos_total{cnpj="1"}'] == 3
+    assert raiz.amostras()['nfse_documentos_total{cnpj="2"}'] == 1
+    assert a.resumo(antes) == {
+        'nfse_documentos_total{cnpj="1"}': 2,
+        'nfse_http_latencia_segundos_count{cnpj="1",servico="dfe"}': 1,
+        'nfse_http_latencia_segundos_sum{cnpj="1",servico="dfe"}': 0.02,
+    }
+
+
+def test_prometheus_exposition_and_endpoint():
+    m = Metricas()
+    m.respostas.inc(servico="dfe", status=429)
+    with m.gravacao.cronometrar():
+        pass
+    texto = m.exposicao()
+    assert "# TYPE nfse_http_respostas_total counter" in texto
+    assert 'nfse_http_respostas_total{servico="dfe",status="429"} 1' in texto
+    assert 'nfse_gravacao_segundos_bucket{le="+Inf"} 1' in texto
+    assert "nfse_gravacao_segundos_count 1" in texto
+
+    servidor = ServidorMetricas(m, 0).iniciar()
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{servidor.porta}/metrics") as resp:
+            assert resp.read().decode() == texto
+    finally:
+        servidor.parar()
@@ -0,0 +1,91 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from nfse.config import Config
+from nfse.migracao import MigracaoLayout
+from nfse.state import RegistroDocumento, StateStore
+
+
+def _cfg(tmp_path, layout="{cnpj}/{ano}/{mes}"):
+    return Config(
+        cnpj="111",
+        output_dir=str(tmp_path / "xml"),
+        state_db=str(tmp_path / "state.db"),
+        output_layout=layout,
+    )
+
+
+def _acervo(cfg):
+    raiz = Path(cfg.output_dir)
+    raiz.mkdir()
+    store = StateStore(cfg.state_db)
+    registros = {"111": [], "222": []}
+    for nsu, (cnpj, mes) in enumerate([("111", "01"), ("111", "02"), ("222", "02")], start=1):
+        nome = f"NFS-e_2024-{mes}_k{nsu}"
+        (raiz / f"{nome}.xml").write_bytes(f"<r>{nsu}</r>".encode())
+        (raiz / f"{nome}.pdf").write_bytes(b"%PDF")
+        caminho = str(raiz / f"{nome}.xml")
+        registros[cnpj].append(RegistroDocumento(nsu, f"k{nsu}", "salvo", caminho, "x"))
+    (raiz / "NFS-e_2024-03.tar").write_bytes(b"tar")
+    registros["111"].append(
+        RegistroDocumento(9, "k9", "salvo", str(raiz / "NFS-e_2024-03.tar#NFS-e_2024-03_k9.xml.gz"))
+    )
+    (raiz / "outro.txt").write_text("fica")
+    for cnpj, regs in registros.items():
+        store.registrar_lote(cnpj, 10, regs)
+    return store
+
+
+def test_migracao_moves_files_and_updates_state(tmp_path):
+    cfg = _cfg(tmp_path)
+    store = _acervo(cfg)
+    raiz = Path(cfg.output_dir)
+    # Queued PDFs: one whose partial file is on disk and one not yet downloaded.
+    store.adiar_pdf("111", "k1", str(raiz / "NFS-e_2024-01_k1.pdf"), lambda t: 0)
+    store.adiar_pdf("222", "k4", str(raiz / "NFS-e_2024-02_k4.pdf"), lambda t: 0)
+
+    stats = MigracaoLayout(cfg, store, workers=4).run()
+
+    assert (stats.movidos, stats.conflitos) == (7, 0)
+    assert [p.destino for p in store.pdfs_pendentes("111")] == [
+        str(raiz / "111/2024/01/NFS-e_2024-01_k1.pdf")
+    ]
+    assert [p.destino for p in store.pdfs_pendentes("222")] == [
+        str(raiz / "222/2024/02/NFS-e_2024-02_k4.pdf")
+    ]
+    assert sorted(p.name for p in raiz.iterdir()) == ["111", "222", "outro.txt"]
+    assert (raiz / "111/2024/01/NFS-e_2024-01_k1.pdf").exists()
+    assert (raiz / "222/2024/02/NFS-e_2024-02_k3.xml").exists()
+    assert store.documento("222", 3).caminho == str(raiz / "222/2024/02/NFS-e_2024-02_k3.xml")
+    assert store.documento("111", 9).caminho == str(
+        raiz / "111/2024/03/NFS-e_2024-03.tar#NFS-e_2024-03_k9.xml.gz"
+    )
+    # Nothing left: a second run is a no-op.
+    assert MigracaoLayout(cfg, store).run().movidos == 0
+
+
+def test_migracao_repairs_rows_after_interruption(tmp_path):
+    cfg = _cfg(tmp_path)
+    store = _acervo(cfg)
+    raiz = Path(cfg.output_dir)
+    # Simulate a crash after the rename and before the state update.
+    destino = raiz / "111/2024/01/NFS-e_2024-01_k1.xml"
+    destino.parent.mkdir(parents=True)
+    (raiz / "NFS-e_2024-01_k1.xml").rename(destino)
+    # And a file that already exists in the layout with the same content.
+    (raiz / "111/2024/01/NFS-e_2024-01_k1.pdf").write_bytes(b"%PDF")
+
+    stats = MigracaoLayout(cfg, store).run()
+
+    assert stats.reparados == 1 and stats.duplicados == 1
+    assert store.documento("111", 1).caminho == str(destino)
+    assert not (raiz / "NFS-e_2024-01_k1.pdf").exists()
+
+
+def test_migracao_requires_layout(tmp_path):
+    with pytest.raises(ValueError):
+        MigracaoLayout(_cfg(tmp_path, layout=""))
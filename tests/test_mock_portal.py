@@ -0,0 +1,45 @@
+import base64
+import gzip
+import json
+import sys
+import urllib.error
+import urllib.request
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from benchmarks.mock_portal import MockPortal
+from nfse import datas
+
+
+def _get(url):
+    with urllib.request.urlopen(url) as resp:
+        return resp.status, resp.read()
+
+
+def test_mock_portal_pages_until_204():
+    with MockPortal(docs=5, pagina=2, pdf_kib=1) as portal:
+        status, corpo = _get(f"{portal.dfe_url}/{0:020d}?cnpj=1")
+        lote = json.loads(corpo)["LoteDFe"]
+        assert status == 200 and [d["NSU"] for d in lote] == [1, 2]
+        xml = gzip.decompress(base64.b64decode(lote[0]["ArquivoXml"]))
+        assert datas.data_streaming(xml)
+
+        _, corpo = _get(f"{portal.dfe_url}/{4:020d}?cnpj=1")
+        assert [d["NSU"] for d in json.loads(corpo)["LoteDFe"]] == [5]
+        assert _get(f"{portal.dfe_url}/{5:020d}?cnpj=1") == (204, b"")
+
+        status, pdf = _get(f"{portal.danfse_url}/{lote[0]['ChaveAcesso']}")
+        assert status == 200 and pdf.startswith(b"%PDF")
+        assert (portal.stats.paginas, portal.stats.pdfs) == (2, 1)
+
+
+def test_mock_portal_throttles():
+    with MockPortal(docs=1, taxa_429=1.0, retry_after=3) as portal:
+        with pytest.raises(urllib.error.HTTPError) as exc:
+            _get(f"{portal.dfe_url}/{0:020d}")
+        assert exc.value.code == 429
+        assert exc.value.headers["Retry-After"] == "3"
+        assert portal.stats.throttled == 1
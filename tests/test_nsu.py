@@ -1,3 +1,4 @@
+import gzip
 import os
 import sys
 from pathlib import Path
@@ -35,6 +36,8 @@ sys.modules[
 
 from nfse.downloader import NFSeDownloader
 from nfse.config import Config
+from nfse.state import RegistroDocumento, StateStore
+from nfse import datas
 
 
 def test_salvar_e_ler_nsu(tmp_path: Path) -> None:
@@ -43,8 +46,8 @@ def test_salvar_e_ler_nsu(tmp_path: Path) -> None:
     try:
         dl = NFSeDownloader(Config(cnpj="12345678901234"))
         dl.salvar_ultimo_nsu(42)
-        file_path = tmp_path / "ultimo_nsu_12345678901234.txt"
-        assert file_path.read_text() == "42"
+        store = StateStore(str(tmp_path / "nfse_state.db"))
+        assert store.ler_cursor("12345678901234") == 42
         assert dl.ler_ultimo_nsu() == 42
     finally:
         os.chdir(cwd)
@@ -73,6 +76,38 @@ def test_salvar_nsu_persiste_novo_obj(tmp_path: Path) -> None:
         os.chdir(cwd)
 
 
+def test_importa_nsu_txt_legado(tmp_path: Path) -> None:
+    cwd = os.getcwd()
+    os.chdir(tmp_path)
+    try:
+        (tmp_path / "ultimo_nsu_55.txt").write_text("77")
+        dl = NFSeDownloader(Config(cnpj="55"))
+        assert dl.ler_ultimo_nsu() == 77
+        dl.salvar_ultimo_nsu(80)
+        assert dl.ler_ultimo_nsu() == 80
+        assert (tmp_path / "ultimo_nsu_55.txt").read_text() == "77"
+    finally:
+        os.chdir(cwd)
+
+
+def test_state_store_registrar_lote(tmp_path: Path) -> None:
+    store = StateStore(str(tmp_path / "state.db"))
+    store.registrar_lote(
+        "1",
+        3,
+        [
+            RegistroDocumento(1, "k1", "salvo", "a.xml", "aa"),
+            RegistroDocumento(2, "k2", "salvo", "b.xml", "bb"),
+        ],
+    )
+    store.registrar_lote("1", 4, [RegistroDocumento(2, "k2", "substituído", "b.xml", "cc")])
+    assert store.ler_cursor("1") == 4
+    assert store.contar_documentos("1") == 2
+    assert store.documento("1", 2) == RegistroDocumento(2, "k2", "substituído", "b.xml", "cc")
+    store.close()
+    assert StateStore(str(tmp_path / "state.db")).ler_cursor("1") == 4
+
+
 def test_extrair_ano_mes() -> None:
     xml = "<root><DataEmissao>2024-05-10T10:00:00</DataEmissao></root>"
     ano, mes = NFSeDownloader.extrair_ano_mes(xml.encode())
@@ -92,3 +127,36 @@ def test_extrair_ano_mes_dhevento() -> None:
     ano, mes = NFSeDownloader.extrair_ano_mes(xml.encode())
     assert ano == "2026"
     assert mes == "12"
+
+
+def test_extrair_ano_mes_streaming_namespaced() -> None:
+    xml = (
+        '<NFSe xmlns="http://www.sped.fazenda.gov.br/nfse"><infNFSe>'
+        "<dhProc>2020-01-01T00:00:00</dhProc><DPS><infDPS>"
+        "<dhEmi>2025-03-04T10:00:00-03:00</dhEmi>"
+        "</infDPS></DPS></infNFSe></NFSe>"
+    ).encode()
+    assert datas.data_streaming(xml, chunk_size=7) == "2025-03-04T10:00:00-03:00"
+    assert NFSeDownloader.extrair_ano_mes(xml) == ("2025", "03")
+
+
+def test_extrair_ano_mes_prefixed_event() -> None:
+    xml = b'<n:evento xmlns:n="urn:x"><n:dhEvento>2024-11-30T08:00:00</n:dhEvento></n:evento>'
+    assert NFSeDownloader.extrair_ano_mes(xml) == ("2024", "11")
+
+
+def test_extrair_ano_mes_fallback_to_tree() -> None:
+    # The first date element is unparsable, the full search prefers dhEmi.
+    xml = b"<r><dhEvento>invalida</dhEvento><dhEmi>2023-02-01</dhEmi></r>"
+    assert NFSeDownloader.extrair_ano_mes(xml) == ("2023", "02")
+
+
+def test_extrair_ano_mes_gzip_partial_inflate() -> None:
+    cauda = b"<x>" + b"a" * 200_000 + b"</x>"
+    xml = b"<r><dhEmi>2022-08-15T00:00:00</dhEmi>" + cauda + b"</r>"
+    gz = gzip.compress(xml)
+    assert datas.data_gzip(gz, chunk_size=64) == "2022-08-15T00:00:00"
+    assert datas.extrair_ano_mes_gzip(gz) == ("2022", "08")
+    # Invalid date in the stream falls back to the full tree search.
+    gz = gzip.compress(b"<r><dhEvento>x</dhEvento><dhEmi>2021-01-02</dhEmi></r>")
+    assert datas.extrair_ano_mes_gzip(gz) == ("2021", "01")
@@ -0,0 +1,209 @@
+import base64
+import gzip
+import json
+import os
+import sys
+import types
+from contextlib import contextmanager
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+# Stub external dependencies used by nfse.downloader
+sys.modules.setdefault("requests", types.ModuleType("requests"))
+crypto = types.ModuleType("cryptography")
+hazmat = types.ModuleType("cryptography.hazmat")
+primitives = types.ModuleType("cryptography.hazmat.primitives")
+serialization = types.ModuleType("cryptography.hazmat.primitives.serialization")
+pkcs12 = types.ModuleType("cryptography.hazmat.primitives.serialization.pkcs12")
+serialization.Encoding = object()
+serialization.PrivateFormat = object()
+serialization.NoEncryption = object()
+pkcs12.load_key_and_certificates = lambda data, pwd, backend: (None, None, None)
+crypto.hazmat = hazmat
+hazmat.primitives = primitives
+primitives.serialization = serialization
+serialization.pkcs12 = pkcs12
+sys.modules["cryptography"] = crypto
+sys.modules["cryptography.hazmat"] = hazmat
+sys.modules["cryptography.hazmat.primitives"] = primitives
+sys.modules["cryptography.hazmat.primitives.serialization"] = serialization
+sys.modules["cryptography.hazmat.primitives.serialization.pkcs12"] = pkcs12
+
+from nfse.config import Config
+from nfse.state import StateStore
+from nfse.orchestrator import MultiCNPJOrchestrator
+
+
+class DummyResp:
+    def __init__(self, status, data=None):
+        self.status_code = status
+        self._data = data or {}
+        self.text = ""
+
+    def json(self):
+        return self._data
+
+    def iter_content(self, chunk_size=1):
+        corpo = json.dumps(self._data).encode()
+        for i in range(0, len(corpo), 7):
+            yield corpo[i : i + 7]
+
+    def close(self):
+        pass
+
+
+class DummySession:
+    def __init__(self):
+        self.urls = []
+
+    def get(self, url, timeout=0, stream=False):
+        self.urls.append(url)
+        if url.split("/")[-1].startswith("00000000000000000000"):
+            cnpj = url.rsplit("=", 1)[1]
+            xml = gzip.compress(b"<r><dhEmi>2024-02-01</dhEmi></r>")
+            doc = {
+                "NSU": "1",
+                "ChaveAcesso": f"chave{cnpj}",
+                "ArquivoXml": base64.b64encode(xml).decode(),
+            }
+            data = {"StatusProcessamento": "DOCUMENTOS_LOCALIZADOS", "LoteDFe": [doc]}
+            return DummyResp(200, data)
+        return DummyResp(204)
+
+
+def test_config_para_cliente():
+    base = Config(cert_path="base.pfx", clients=[{"cnpj": "1"}])
+    cfg = base.para_cliente({"cnpj": "2", "cert_path": "outro.pfx"})
+    assert cfg.cnpj == "2"
+    assert cfg.cert_path == "outro.pfx"
+    assert cfg.clients == []
+    with pytest.raises(ValueError):
+        base.para_cliente({"cnpj": "3", "senha": "x"})
+
+
+def test_orchestrator_shares_session_per_certificate(tmp_path):
+    sessoes = {}
+
+    @contextmanager
+    def factory(cert_path, cert_pass, pool_size):
+        sessoes[cert_path] = DummySession()
+        yield sessoes[cert_path]
+
+    cfg = Config(
+        cert_path="a.pfx",
+        output_dir=str(tmp_path / "xml"),
+        log_dir=str(tmp_path),
+        delay_seconds=0,
+        max_concurrent=2,
+        clients=[
+            {"cnpj": "111"},
+            {"cnpj": "222"},
+            {"cnpj": "333", "cert_path": "b.pfx"},
+        ],
+    )
+    msgs = []
+    cwd = os.getcwd()
+    os.chdir(tmp_path)
+    try:
+        resumos = MultiCNPJOrchestrator(cfg, session_factory=factory).run(
+            write=lambda m, log=True: msgs.append(m)
+        )
+    finally:
+        os.chdir(cwd)
+
+    assert sorted(sessoes) == ["a.pfx", "b.pfx"]
+    assert len(sessoes["a.pfx"].urls) == 4
+    assert len(sessoes["b.pfx"].urls) == 2
+    assert [r.cnpj for r in resumos] == ["111", "222", "333"]
+    assert all(r.documentos == 1 and r.bytes > 0 and r.erro is None for r in resumos)
+    state = StateStore(str(tmp_path / "nfse_state.db"))
+    for cnpj in ("111", "222", "333"):
+        assert state.ler_cursor(cnpj) == 2
+        assert (tmp_path / "xml" / f"NFS-e_2024-02_chave{cnpj}.xml").exists()
+    assert any(m.startswith("[222] ") for m in msgs)
+
+
+class AsyncContent:
+    def __init__(self, body):
+        self.body = body
+
+    async def iter_chunked(self, size):
+        for i in range(0, len(self.body), size):
+            yield self.body[i : i + size]
+
+
+class AsyncResp:
+    def __init__(self, status, data=None):
+        self.status = status
+        self.content = AsyncContent(json.dumps(data or {}).encode())
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def text(self):
+        return ""
+
+
+class AsyncSession:
+    def __init__(self):
+        self.sync = DummySession()
+        self.fechada = False
+
+    def get(self, url):
+        resp = self.sync.get(url)
+        return AsyncResp(resp.status_code, resp._data)
+
+    async def close(self):
+        raise AssertionError("a sessão compartilhada é fechada pelo orquestrador")
+
+
+def test_orchestrator_runs_clients_on_asyncio_engine(tmp_path):
+    from contextlib import asynccontextmanager
+
+    sessoes = {}
+
+    @asynccontextmanager
+    async def factory(cert_path, cert_pass, pool_size):
+        sessoes[cert_path] = sess = AsyncSession()
+        yield sess
+        sess.fechada = True
+
+    @contextmanager
+    def factory_threads(cert_path, cert_pass, pool_size):
+        raise AssertionError("o motor asyncio não usa sessões requests")
+
+    cfg = Config(
+        cert_path="a.pfx",
+        output_dir=str(tmp_path / "xml"),
+        log_dir=str(tmp_path),
+        state_db=str(tmp_path / "state.db"),
+        delay_seconds=0,
+        engine="asyncio",
+        max_concurrent=2,
+        clients=[{"cnpj": "111"}, {"cnpj": "222"}, {"cnpj": "333", "cert_path": "b.pfx"}],
+    )
+    resumos = MultiCNPJOrchestrator(
+        cfg, session_factory=factory_threads, async_session_factory=factory
+    ).run()
+
+    assert [(r.cnpj, r.documentos, r.erro) for r in resumos] == [
+        ("111", 1, None),
+        ("222", 1, None),
+        ("333", 1, None),
+    ]
+    assert sorted(sessoes) == ["a.pfx", "b.pfx"]
+    assert len(sessoes["a.pfx"].sync.urls) == 4
+    assert all(s.fechada for s in sessoes.values())
+    store = StateStore(cfg.state_db)
+    assert [store.ler_cursor(c) for c in ("111", "222", "333")] == [2, 2, 2]
+
+
+def test_clients_cannot_override_engine():
+    with pytest.raises(ValueError):
+        Config(clients=[{"cnpj": "1"}]).para_cliente({"cnpj": "1", "engine": "asyncio"})
@@ -0,0 +1,55 @@
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from nfse.pacing import PacingController, parse_retry_after
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_token_bucket_and_aimd():
+    clock = FakeClock()
+    pacer = PacingController(1.0, 10.0, clock=clock)
+    assert pacer.reservar() == 0.0
+    assert pacer.reservar() == 10.0
+    for _ in range(20):
+        pacer.sucesso()
+    assert pacer.intervalo == 1.0
+    clock.now += 1.0
+    assert pacer.reservar() == 0.0
+    pacer.penalizar()
+    assert pacer.intervalo == 2.0
+
+
+def test_retry_after_blocks_requests():
+    clock = FakeClock()
+    pacer = PacingController(1.0, 1.0, clock=clock)
+    pacer.penalizar(30)
+    assert pacer.reservar() == 30.0
+    clock.now += 30.0
+    assert pacer.reservar() == 0.0
+
+
+def test_zero_delay_disables_pacing():
+    pacer = PacingController(1.0, 0)
+    assert all(pacer.reservar() == 0.0 for _ in range(5))
+
+
+def test_backoff_grows_with_jitter():
+    pacer = PacingController(1.0, 10.0, backoff_base=2.0, backoff_max=20.0)
+    assert 1.0 <= pacer.backoff(1) <= 2.0
+    assert 4.0 <= pacer.backoff(3) <= 8.0
+    assert 10.0 <= pacer.backoff(10) <= 20.0
+
+
+def test_parse_retry_after():
+    assert parse_retry_after("120") == 120.0
+    assert parse_retry_after(None) == 0.0
+    assert parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0.0
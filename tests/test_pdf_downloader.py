@@ -1,5 +1,8 @@
 from pathlib import Path
 import sys
+import threading
+
+import pytest
 
 sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
 
@@ -19,13 +22,21 @@ class DummyResp:
         self.content = content
         self.text = ""
 
+    def iter_content(self, chunk_size=1):
+        for i in range(0, len(self.content), chunk_size):
+            yield self.content[i : i + chunk_size]
+
 
 class DummySession:
     def __init__(self):
         self.calls = []
+        self.lock = threading.Lock()
 
-    def get(self, url, timeout=0):
-        self.calls.append(url)
+    def get(self, url, timeout=0, stream=False):
+        with self.lock:
+            self.calls.append(url)
+        if url.endswith("/falha"):
+            return DummyResp(404)
         return DummyResp(200, b"pdfdata")
 
 
@@ -37,3 +48,75 @@ def test_baixar(tmp_path: Path):
     assert dl.baixar(chave, str(dest))
     assert dest.read_bytes() == b"pdfdata"
     assert session.calls[0] == f"{NFSePDFDownloader.BASE_URL}/{chave}"
+
+
+def test_baixar_streams_in_chunks(tmp_path: Path, monkeypatch):
+    monkeypatch.setattr(NFSePDFDownloader, "CHUNK_SIZE", 2)
+    dl = NFSePDFDownloader(DummySession(), timeout=1)
+    dest = tmp_path / "nota.pdf"
+    assert dl.baixar("123", str(dest))
+    assert dest.read_bytes() == b"pdfdata"
+    assert not (tmp_path / "nota.pdf.part").exists()
+
+
+def test_baixar_removes_partial_file_when_stream_breaks(tmp_path: Path):
+    class Quebrada(DummyResp):
+        def iter_content(self, chunk_size=1):
+            yield b"pdf"
+            raise ConnectionError("reset")
+
+    session = DummySession()
+    session.get = lambda url, timeout=0, stream=False: Quebrada(200)
+    dl = NFSePDFDownloader(session, timeout=1)
+    with pytest.raises(ConnectionError):
+        dl.baixar("123", str(tmp_path / "nota.pdf"))
+    assert list(tmp_path.iterdir()) == []
+    assert dl.stats.falha == 1
+
+
+def test_submeter_pool_drains(tmp_path: Path):
+    session = DummySession()
+    dl = NFSePDFDownloader(session, timeout=1, workers=3)
+    results = []
+    chaves = [str(i) for i in range(10)] + ["falha"]
+    for chave in chaves:
+        dl.submeter(
+            chave,
+            str(tmp_path / f"{chave}.pdf"),
+            lambda ch, dest, ok, existed, seg: results.append((ch, ok)),
+        )
+    dl.aguardar()
+    assert sorted(results) == sorted((c, c != "falha") for c in chaves)
+    assert dl.stats.sucesso == 10
+    assert dl.stats.falha == 1
+
+
+def test_cancelar_reports_skipped_jobs(tmp_path: Path):
+    session = DummySession()
+    iniciados = threading.Semaphore(0)
+    liberar = threading.Event()
+    get = session.get
+
+    def lento(url, timeout=0, stream=False):
+        iniciados.release()
+        liberar.wait(5)
+        return get(url, timeout, stream)
+
+    session.get = lento
+    dl = NFSePDFDownloader(session, timeout=1, workers=2)
+    results = []
+
+    def callback(ch, dest, ok, existed, seg):
+        results.append((ch, ok))
+
+    for chave in "0123":
+        dl.submeter(chave, str(tmp_path / f"{chave}.pdf"), callback)
+    assert iniciados.acquire(timeout=5) and iniciados.acquire(timeout=5)
+    dl.cancelar()
+    liberar.set()
+    dl.submeter("4", str(tmp_path / "4.pdf"), callback)
+    dl.aguardar()
+
+    assert sorted(results) == [("0", True), ("1", True), ("2", False), ("3", False), ("4", False)]
+    assert sorted(session.calls) == [f"{NFSePDFDownloader.BASE_URL}/{c}" for c in "01"]
+    assert not (tmp_path / "2.pdf").exists()
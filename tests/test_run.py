@@ -1,10 +1,12 @@
 import base64
 import gzip
+import json
 import os
 import sys
 import types
 from pathlib import Path
-from contextlib import contextmanager
+
+import pytest
 
 sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
 
@@ -31,6 +33,10 @@ sys.modules["cryptography.hazmat.primitives.serialization.pkcs12"] = pkcs12
 
 from nfse.downloader import NFSeDownloader
 from nfse.config import Config
+from nfse.metrics import Metricas
+from nfse.pdf_downloader import NFSePDFDownloader
+from nfse.state import FiltroIndice, StateStore
+from nfse.storage import ler_xml
 
 
 class DummyResp:
@@ -42,13 +48,21 @@ class DummyResp:
     def json(self):
         return self._data
 
+    def iter_content(self, chunk_size=1):
+        corpo = json.dumps(self._data).encode()
+        for i in range(0, len(corpo), 7):
+            yield corpo[i : i + 7]
+
+    def close(self):
+        pass
+
 
 class DummySession:
     def __init__(self):
         self.calls = 0
         self.urls = []
 
-    def get(self, url, timeout=0):
+    def get(self, url, timeout=0, stream=False):
         self.calls += 1
         self.urls.append(url)
         if self.calls == 1:
@@ -68,7 +82,6 @@ class DummySession:
 def test_run_updates_nsu(tmp_path, monkeypatch):
     session = DummySession()
     req_mod = types.ModuleType("requests")
-    req_mod.Session = lambda: session
     req_mod.exceptions = types.SimpleNamespace(RequestException=Exception)
     monkeypatch.setitem(sys.modules, "requests", req_mod)
     import nfse.downloader as dl_mod
@@ -86,11 +99,7 @@ def test_run_updates_nsu(tmp_path, monkeypatch):
 
     dl = NFSeDownloader(cfg)
 
-    @contextmanager
-    def dummy_pfx(self, *a, **k):
-        yield str(tmp_path / "cert.pem")
-
-    monkeypatch.setattr(NFSeDownloader, "pfx_to_pem", dummy_pfx)
+    monkeypatch.setattr(NFSeDownloader, "_abrir_sessao", lambda self, write: session)
 
     cwd = os.getcwd()
     os.chdir(tmp_path)
@@ -103,6 +112,539 @@ def test_run_updates_nsu(tmp_path, monkeypatch):
     first_url = session.urls[0]
     assert first_url.endswith("/00000000000000000000?cnpj=123")
 
-    nsu_file = tmp_path / "ultimo_nsu_123.txt"
-    assert nsu_file.exists()
-    assert nsu_file.read_text() == "1"
+    assert StateStore(str(tmp_path / "nfse_state.db")).ler_cursor("123") == 1
+
+
+class PagedSession(DummySession):
+    def get(self, url, timeout=0, stream=False):
+        self.calls += 1
+        self.urls.append(url)
+        if self.calls == 1:
+            docs = []
+            for nsu in (5, 3, 4):
+                xml = f"<r><dhEmi>2024-0{nsu}-01T00:00:00</dhEmi></r>".encode()
+                docs.append(
+                    {
+                        "NSU": str(nsu),
+                        "ChaveAcesso": f"k{nsu}",
+                        "ArquivoXml": base64.b64encode(gzip.compress(xml)).decode(),
+                    }
+                )
+            data = {"StatusProcessamento": "DOCUMENTOS_LOCALIZADOS", "LoteDFe": docs}
+            return DummyResp(200, data)
+        return DummyResp(204, {})
+
+
+@pytest.mark.parametrize("formato,ext", [("xml", ".xml"), ("gzip", ".xml.gz")])
+def test_run_pipeline_writes_all_documents(tmp_path, monkeypatch, formato, ext):
+    session = PagedSession()
+    req_mod = types.ModuleType("requests")
+    req_mod.exceptions = types.SimpleNamespace(RequestException=Exception)
+    import nfse.downloader as dl_mod
+    monkeypatch.setattr(dl_mod, "requests", req_mod)
+
+    monkeypatch.setattr(NFSeDownloader, "_abrir_sessao", lambda self, write: session)
+
+    cfg = Config(
+        cnpj="123",
+        output_dir=str(tmp_path / "xml"),
+        log_dir=str(tmp_path),
+        delay_seconds=0,
+        decode_workers=3,
+        queue_size=1,
+        output_format=formato,
+    )
+    msgs = []
+    cwd = os.getcwd()
+    os.chdir(tmp_path)
+    try:
+        resumo = NFSeDownloader(cfg, metricas=Metricas()).run(
+            write=lambda m, log=True: msgs.append(m)
+        )
+    finally:
+        os.chdir(cwd)
+
+    names = sorted(p.name for p in (tmp_path / "xml").iterdir())
+    assert names == [
+        f"NFS-e_2024-03_k3{ext}",
+        f"NFS-e_2024-04_k4{ext}",
+        f"NFS-e_2024-05_k5{ext}",
+    ]
+    assert ler_xml(str(tmp_path / "xml" / names[0])).startswith(b"<r><dhEmi>2024-03")
+    assert session.urls[1].endswith("/00000000000000000005?cnpj=123")
+    store = StateStore(str(tmp_path / "nfse_state.db"))
+    assert store.ler_cursor("123") == 6
+    assert store.contar_documentos("123") == 3
+    achados = store.buscar(FiltroIndice(de="2024-04-01"))
+    assert [(e.nsu, e.campos.data) for e in achados] == [(4, "2024-04-01"), (5, "2024-05-01")]
+    assert achados[0].caminho.endswith(f"k4{ext}")
+    assert any(m.startswith("Estágio gravação: 3 documentos") for m in msgs)
+    assert msgs[-1] == "Processo concluído. Total baixados: 3"
+    assert resumo.metricas['nfse_documentos_total{cnpj="123"}'] == 3
+    assert resumo.metricas['nfse_paginas_total{cnpj="123"}'] == 1
+    assert resumo.metricas['nfse_http_respostas_total{cnpj="123",servico="dfe",status="204"}'] == 1
+    assert resumo.metricas['nfse_extrair_ano_mes_segundos_count{cnpj="123"}'] == 3
+
+
+@pytest.mark.parametrize("formato,ext", [("xml", ".xml"), ("mensal", ".tar")])
+def test_run_decodes_in_worker_processes(tmp_path, monkeypatch, formato, ext):
+    session = MultiPageSession(paginas=3)
+    monkeypatch.setattr(NFSeDownloader, "_abrir_sessao", lambda self, write: session)
+    cfg = _cfg_prefetch(tmp_path, 0)
+    cfg.decode_processes = 2
+    cfg.output_format = formato
+
+    msgs = []
+    resumo = NFSeDownloader(cfg, metricas=Metricas()).run(write=lambda m, log=True: msgs.append(m))
+
+    assert resumo.documentos == 6
+    assert any(m.startswith("Estágio decodificação: 6 documentos") for m in msgs)
+    assert resumo.metricas['nfse_decodificacao_segundos_count{cnpj="123"}'] == 6
+    store = StateStore(cfg.state_db)
+    assert store.ler_cursor("123") == 7
+    assert store.contar_indexados("123") == 6
+    caminho = store.documento("123", 4).caminho
+    assert caminho.split("#")[0].endswith(ext)
+    assert ler_xml(caminho) == b"<r/>"
+
+
+@pytest.mark.parametrize("formato", ["xml", "mensal"])
+def test_run_streams_large_documents_to_disk(tmp_path, monkeypatch, formato):
+    from nfse import decodificacao
+
+    monkeypatch.setattr(decodificacao, "LIMITE_MEMORIA", 0)
+    monkeypatch.setattr(decodificacao, "BLOCO_BASE64", 8)
+    monkeypatch.setattr(NFSeDownloader, "_abrir_sessao", lambda self, write: PagedSession())
+    cfg = _cfg_prefetch(tmp_path, 0)
+    cfg.output_format = formato
+
+    resumo = NFSeDownloader(cfg).run()
+
+    assert resumo.documentos == 3
+    store = StateStore(cfg.state_db)
+    assert ler_xml(store.documento("123", 4).caminho).startswith(b"<r><dhEmi>2024-04")
+    assert [e.nsu for e in store.buscar(FiltroIndice(de="2024-05-01"))] == [5]
+    assert not [p for p in (tmp_path / "xml").iterdir() if p.name.endswith(".tmp")]
+
+
+class UnsortedSession(DummySession):
+    """Pages whose NSUs arrive out of order: 51, 55, 53 after the queried NSU."""
+
+    def get(self, url, timeout=0, stream=False):
+        self.calls += 1
+        self.urls.append(url)
+        consulta = int(url.split("?")[0].rsplit("/", 1)[1])
+        docs = [
+            {
+                "NSU": str(n),
+                "ChaveAcesso": f"k{n}",
+                "ArquivoXml": base64.b64encode(gzip.compress(b"<r/>")).decode(),
+            }
+            for n in (51, 55, 53)
+            if n > consulta
+        ]
+        if not docs:
+            return DummyResp(204, {})
+        dados = {"StatusProcessamento": "DOCUMENTOS_LOCALIZADOS", "LoteDFe": docs}
+        return DummyResp(200, dados)
+
+
+def test_stop_inside_unsorted_page_does_not_skip_lower_nsus(tmp_path, monkeypatch):
+    monkeypatch.setattr(NFSeDownloader, "_abrir_sessao", lambda self, write: UnsortedSession())
+    cfg = _cfg_prefetch(tmp_path, 0)
+    StateStore(cfg.state_db).salvar_cursor("123", 51)
+    gravados = []
+
+    def write(msg, log=True):
+        if msg.startswith("XML Baixado"):
+            gravados.append(msg)
+
+    NFSeDownloader(cfg).run(write=write, running=lambda: not gravados)
+
+    store = StateStore(cfg.state_db)
+    # Decoding runs on several workers, so any one of the three was written.
+    assert store.contar_documentos("123") == 1
+    assert store.ler_cursor("123") <= 53
+    NFSeDownloader(cfg).run()
+    assert store.documento("123", 53) is not None
+    assert store.ler_cursor("123") == 56
+
+
+class StatusSession(DummySession):
+    """One 200 page whose fields come in ``ordem``, with ``status``."""
+
+    def __init__(self, status, ordem=("StatusProcessamento", "Erros", "LoteDFe")):
+        super().__init__()
+        self.status = status
+        self.ordem = ordem
+
+    def get(self, url, timeout=0, stream=False):
+        self.calls += 1
+        self.urls.append(url)
+        if self.calls > 1:
+            return DummyResp(204, {})
+        doc = {
+            "NSU": "1",
+            "ChaveAcesso": "k1",
+            "ArquivoXml": base64.b64encode(gzip.compress(b"<r/>")).decode(),
+        }
+        campos = {
+            "StatusProcessamento": self.status,
+            "Erros": [{"Codigo": "E999", "Descricao": "Falha"}],
+            "LoteDFe": [doc],
+        }
+        return DummyResp(200, {nome: campos[nome] for nome in self.ordem})
+
+
+@pytest.mark.parametrize("profundidade", [0, 2])
+@pytest.mark.parametrize(
+    "ordem",
+    [("StatusProcessamento", "Erros", "LoteDFe"), ("LoteDFe", "Erros", "StatusProcessamento")],
+)
+def test_run_stops_on_error_status(tmp_path, monkeypatch, profundidade, ordem):
+    session = StatusSession("REJEICAO", ordem)
+    monkeypatch.setattr(NFSeDownloader, "_abrir_sessao", lambda self, write: session)
+    cfg = _cfg_prefetch(tmp_path, profundidade)
+    msgs = []
+    NFSeDownloader(cfg).run(write=lambda m, log=True: msgs.append(m))
+
+    store = StateStore(cfg.state_db)
+    assert store.contar_documentos("123") == 0
+    assert store.ler_cursor("123") == 1
+    assert session.calls == 1
+    assert "Resposta inesperada ou nenhum documento localizado." in msgs
+
+
+def test_run_reads_status_after_documents(tmp_path, monkeypatch):
+    session = StatusSession("DOCUMENTOS_LOCALIZADOS", ("LoteDFe", "StatusProcessamento"))
+    monkeypatch.setattr(NFSeDownloader, "_abrir_sessao", lambda self, write: session)
+    cfg = _cfg_prefetch(tmp_path, 0)
+    NFSeDownloader(cfg).run()
+
+    store = StateStore(cfg.state_db)
+    assert store.contar_documentos("123") == 1
+    assert store.ler_cursor("123") == 2
+
+
+class FechamentoSession(DummySession):
+    """Records every response; the second request answers ``status``."""
+
+    def __init__(self, status):
+        super().__init__()
+        self.status = status
+        self.respostas = []
+
+    def get(self, url, timeout=0, stream=False):
+        if self.calls:
+            self.calls += 1
+            resp = DummyResp(self.status)
+        else:
+            resp = super().get(url)
+        resp.fechada = False
+        resp.close = lambda: setattr(resp, "fechada", True)
+        self.respostas.append(resp)
+        return resp
+
+
+@pytest.mark.parametrize("status", [204, 404])
+def test_run_closes_every_response(tmp_path, monkeypatch, status):
+    session = FechamentoSession(status)
+    monkeypatch.setattr(NFSeDownloader, "_abrir_sessao", lambda self, write: session)
+    NFSeDownloader(_cfg_prefetch(tmp_path, 0)).run()
+
+    assert [r.status_code for r in session.respostas] == [200, status]
+    assert all(r.fechada for r in session.respostas)
+
+
+class FlakySession(DummySession):
+    def get(self, url, timeout=0, stream=False):
+        self.calls += 1
+        self.urls.append(url)
+        if self.calls == 1:
+            raise ConnectionError("reset")
+        if self.calls == 2:
+            resp = DummyResp(429)
+            resp.headers = {"Retry-After": "0"}
+            return resp
+        return DummyResp(204)
+
+
+def test_run_retries_transient_errors(tmp_path, monkeypatch):
+    session = FlakySession()
+    req_mod = types.ModuleType("requests")
+    req_mod.exceptions = types.SimpleNamespace(RequestException=ConnectionError)
+    import nfse.downloader as dl_mod
+    monkeypatch.setattr(dl_mod, "requests", req_mod)
+
+    monkeypatch.setattr(NFSeDownloader, "_abrir_sessao", lambda self, write: session)
+
+    cfg = Config(
+        cnpj="123",
+        output_dir=str(tmp_path),
+        log_dir=str(tmp_path),
+        delay_seconds=0,
+        retry_backoff_seconds=0.01,
+    )
+    msgs = []
+    cwd = os.getcwd()
+    os.chdir(tmp_path)
+    try:
+        NFSeDownloader(cfg).run(write=lambda m, log=True: msgs.append(m))
+    finally:
+        os.chdir(cwd)
+
+    assert session.calls == 3
+    assert any(m.startswith("Erro de conexão: reset. Nova tentativa") for m in msgs)
+    assert any(m.startswith("Erro: 429 . Nova tentativa") for m in msgs)
+    assert "Nenhuma nota encontrada. Fim da consulta." in msgs
+
+
+class BrokenStreamResp(DummyResp):
+    def iter_content(self, chunk_size=1):
+        corpo = json.dumps(self._data).encode()
+        # Cut the body right after the first document.
+        corte = corpo.index(b"}, {") + 3
+        yield corpo[:corte]
+        raise ConnectionError("stream reset")
+
+
+class BrokenStreamSession(PagedSession):
+    quebrou = False
+
+    def get(self, url, timeout=0, stream=False):
+        resp = super().get(url, timeout, stream)
+        if not self.quebrou:
+            # Break the first page once; the retry gets it whole.
+            self.quebrou = True
+            self.calls = 0
+            return BrokenStreamResp(resp.status_code, resp._data)
+        return resp
+
+
+def test_run_retries_page_when_stream_breaks(tmp_path, monkeypatch):
+    session = BrokenStreamSession()
+    req_mod = types.ModuleType("requests")
+    req_mod.exceptions = types.SimpleNamespace(RequestException=ConnectionError)
+    import nfse.downloader as dl_mod
+    monkeypatch.setattr(dl_mod, "requests", req_mod)
+    monkeypatch.setattr(NFSeDownloader, "_abrir_sessao", lambda self, write: session)
+
+    cfg = Config(
+        cnpj="123",
+        output_dir=str(tmp_path / "xml"),
+        log_dir=str(tmp_path),
+        state_db=str(tmp_path / "state.db"),
+        delay_seconds=0,
+    )
+    msgs = []
+    resumo = NFSeDownloader(cfg).run(write=lambda m, log=True: msgs.append(m))
+
+    assert "Erro ao ler lote: stream reset" in msgs
+    assert len(session.urls) == 3
+    assert session.urls[0] == session.urls[1]
+    assert resumo.documentos == 3
+    assert StateStore(str(tmp_path / "state.db")).ler_cursor("123") == 6
+
+
+class MultiPageSession(DummySession):
+    """Serves ``paginas`` pages of two documents each, keyed by the queried NSU."""
+
+    def __init__(self, paginas=4):
+        super().__init__()
+        self.ultimo = paginas * 2
+
+    def get(self, url, timeout=0, stream=False):
+        self.calls += 1
+        self.urls.append(url)
+        consulta = int(url.rsplit("/", 1)[1].split("?")[0])
+        nsus = [n for n in (consulta + 1, consulta + 2) if n <= self.ultimo]
+        if not nsus:
+            return DummyResp(204, {})
+        docs = [
+            {
+                "NSU": str(n),
+                "ChaveAcesso": f"k{n}",
+                "ArquivoXml": base64.b64encode(gzip.compress(b"<r/>")).decode(),
+            }
+            for n in nsus
+        ]
+        return DummyResp(200, {"StatusProcessamento": "DOCUMENTOS_LOCALIZADOS", "LoteDFe": docs})
+
+
+def _cfg_prefetch(tmp_path, profundidade):
+    return Config(
+        cnpj="123",
+        output_dir=str(tmp_path / "xml"),
+        log_dir=str(tmp_path),
+        state_db=str(tmp_path / "state.db"),
+        delay_seconds=0,
+        queue_size=1,
+        prefetch_depth=profundidade,
+    )
+
+
+def test_run_prefetch_reads_pages_ahead(tmp_path, monkeypatch):
+    session = MultiPageSession(paginas=4)
+    monkeypatch.setattr(NFSeDownloader, "_abrir_sessao", lambda self, write: session)
+
+    resumo = NFSeDownloader(_cfg_prefetch(tmp_path, 2)).run(write=lambda *a, **k: None)
+
+    assert resumo.documentos == 8
+    assert [u.split("?")[0][-2:] for u in session.urls] == ["00", "02", "04", "06", "08"]
+    store = StateStore(str(tmp_path / "state.db"))
+    assert store.ler_cursor("123") == 9
+    assert store.contar_documentos("123") == 8
+
+
+def test_run_prefetch_stop_discards_pages_read_ahead(tmp_path, monkeypatch):
+    session = MultiPageSession(paginas=10)
+    monkeypatch.setattr(NFSeDownloader, "_abrir_sessao", lambda self, write: session)
+
+    # Stop once the reader is ahead of what was written.
+    NFSeDownloader(_cfg_prefetch(tmp_path, 3)).run(
+        write=lambda *a, **k: None, running=lambda: session.calls < 4
+    )
+
+    store = StateStore(str(tmp_path / "state.db"))
+    cursor = store.ler_cursor("123")
+    assert cursor < 2 * session.calls
+    assert store.contar_documentos("123") >= cursor - 1
+    gravados = {p.name for p in (tmp_path / "xml").iterdir()}
+    for nsu in range(1, cursor):
+        assert any(f"_k{nsu}." in nome for nome in gravados)
+
+
+def test_run_resync_skips_unchanged_files(tmp_path, monkeypatch):
+    monkeypatch.setattr(NFSeDownloader, "_abrir_sessao", lambda self, write: MultiPageSession(2))
+    cfg = _cfg_prefetch(tmp_path, 0)
+    NFSeDownloader(cfg).run(write=lambda *a, **k: None)
+    StateStore(cfg.state_db).salvar_cursor("123", 1)
+
+    msgs = []
+    resumo = NFSeDownloader(cfg, metricas=Metricas()).run(write=lambda m, log=True: msgs.append(m))
+
+    assert sum(m.startswith("XML inalterado:") for m in msgs) == 4
+    assert StateStore(cfg.state_db).documento("123", 3).status == "inalterado"
+    assert 'nfse_bytes_total{cnpj="123",tipo="xml"}' not in resumo.metricas
+
+
+class PDFResp:
+    def __init__(self, status):
+        self.status_code = status
+        self.text = ""
+        self.headers = {}
+
+    def iter_content(self, chunk_size=1):
+        yield b"%PDF-1.4"
+
+    def close(self):
+        pass
+
+
+class DanfseSession(MultiPageSession):
+    """Serves the DFe pages and answers DANFSe requests with ``pdf_status``."""
+
+    pdf_status = 503
+
+    def get(self, url, timeout=0, stream=False):
+        if "/danfse/" in url:
+            self.urls.append(url)
+            return PDFResp(self.pdf_status)
+        return super().get(url, timeout, stream)
+
+
+def test_failed_pdfs_are_queued_and_retried(tmp_path, monkeypatch):
+    session = DanfseSession(1)
+    monkeypatch.setattr(NFSeDownloader, "_abrir_sessao", lambda self, write: session)
+    cfg = _cfg_prefetch(tmp_path, 0)
+    cfg.download_pdf = True
+    cfg.pdf_workers = 0
+    msgs = []
+    NFSeDownloader(cfg).run(write=lambda m, log=True: msgs.append(m))
+
+    store = StateStore(cfg.state_db)
+    assert sorted(p.chave for p in store.pdfs_pendentes("123")) == ["k1", "k2"]
+    assert any(m.startswith("Falha ao baixar PDF: k1. Nova tentativa em") for m in msgs)
+
+    session.pdf_status = 200
+    # Not due yet: nothing is retried without ``todos``.
+    assert NFSeDownloader(cfg).reprocessar_pdfs() == (0, 0)
+    assert NFSeDownloader(cfg).reprocessar_pdfs(todos=True) == (2, 0)
+    assert store.contar_pdfs_pendentes("123") == 0
+    assert any(p.name.endswith("_k1.pdf") for p in (tmp_path / "xml").iterdir())
+
+
+@pytest.mark.parametrize("workers", [0, 2])
+def test_downloaded_pdfs_leave_no_pending_rows(tmp_path, monkeypatch, workers):
+    session = DanfseSession(1)
+    session.pdf_status = 200
+    monkeypatch.setattr(NFSeDownloader, "_abrir_sessao", lambda self, write: session)
+    cfg = _cfg_prefetch(tmp_path, 0)
+    cfg.download_pdf = True
+    cfg.pdf_workers = workers
+    NFSeDownloader(cfg).run()
+
+    store = StateStore(cfg.state_db)
+    assert store.contar_pdfs_pendentes("123") == 0
+    assert len([p for p in (tmp_path / "xml").iterdir() if p.suffix == ".pdf"]) == 2
+
+
+def test_pdfs_in_flight_when_process_dies_are_queued(tmp_path, monkeypatch):
+    session = DanfseSession(1)
+    monkeypatch.setattr(NFSeDownloader, "_abrir_sessao", lambda self, write: session)
+    em_voo = []
+    # The process dies before any queued download reports back.
+    monkeypatch.setattr(
+        NFSePDFDownloader, "submeter", lambda self, chave, destino, cb: em_voo.append(chave)
+    )
+    cfg = _cfg_prefetch(tmp_path, 0)
+    cfg.download_pdf = True
+    NFSeDownloader(cfg).run()
+
+    store = StateStore(cfg.state_db)
+    assert sorted(em_voo) == ["k1", "k2"]
+    assert store.ler_cursor("123") == 3
+    pendentes = store.pdfs_pendentes("123")
+    assert sorted(p.chave for p in pendentes) == ["k1", "k2"]
+    assert all(p.tentativas == 0 and p.destino.endswith(".pdf") for p in pendentes)
+
+
+def test_stop_queues_pdfs_of_written_documents(tmp_path, monkeypatch):
+    class Sessao(UnsortedSession):
+        def get(self, url, timeout=0, stream=False):
+            if "/danfse/" in url:
+                return PDFResp(503)
+            return super().get(url, timeout, stream)
+
+    monkeypatch.setattr(NFSeDownloader, "_abrir_sessao", lambda self, write: Sessao())
+    cfg = _cfg_prefetch(tmp_path, 0)
+    cfg.download_pdf = True
+    cfg.pdf_workers = 1
+    StateStore(cfg.state_db).salvar_cursor("123", 51)
+    gravados = []
+
+    def write(msg, log=True):
+        if msg.startswith("XML Baixado"):
+            gravados.append(msg)
+
+    NFSeDownloader(cfg).run(write=write, running=lambda: not gravados)
+
+    store = StateStore(cfg.state_db)
+    ((_, nsu, _),) = store.caminhos()
+    assert [p.chave for p in store.pdfs_pendentes("123")] == [f"k{nsu}"]
+
+
+def test_run_exports_new_documents(tmp_path, monkeypatch):
+    monkeypatch.setattr(NFSeDownloader, "_abrir_sessao", lambda self, write: MultiPageSession(2))
+    cfg = _cfg_prefetch(tmp_path, 0)
+    cfg.export_format = "csv"
+    cfg.export_dir = str(tmp_path / "exp")
+
+    msgs = []
+    NFSeDownloader(cfg).run(write=lambda m, log=True: msgs.append(m))
+    NFSeDownloader(cfg).run(write=lambda m, log=True: msgs.append(m))
+
+    exportacoes = [m for m in msgs if m.startswith("Exportação:")]
+    assert exportacoes[0].startswith("Exportação: 4 documentos")
+    assert exportacoes[1].startswith("Exportação: 0 documentos")
+    assert len(list((tmp_path / "exp" / "cnpj=123").rglob("part-*.csv"))) == 1
@@ -0,0 +1,197 @@
+import gzip
+import hashlib
+import os
+import sys
+import tarfile
+import types
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+# Stub cryptography modules
+sys.modules.setdefault("requests", types.ModuleType("requests"))
+crypto = types.ModuleType("cryptography")
+hazmat = types.ModuleType("cryptography.hazmat")
+primitives = types.ModuleType("cryptography.hazmat.primitives")
+serialization = types.ModuleType("cryptography.hazmat.primitives.serialization")
+pkcs12 = types.ModuleType("cryptography.hazmat.primitives.serialization.pkcs12")
+serialization.Encoding = object()
+serialization.PrivateFormat = object()
+serialization.NoEncryption = object()
+pkcs12.load_key_and_certificates = lambda data, pwd, backend: (None, None, None)
+crypto.hazmat = hazmat
+hazmat.primitives = primitives
+primitives.serialization = serialization
+serialization.pkcs12 = pkcs12
+sys.modules["cryptography"] = crypto
+sys.modules["cryptography.hazmat"] = hazmat
+sys.modules["cryptography.hazmat.primitives"] = primitives
+sys.modules["cryptography.hazmat.primitives.serialization"] = serialization
+sys.modules["cryptography.hazmat.primitives.serialization.pkcs12"] = pkcs12
+
+
+from nfse.config import Config
+from nfse.pipeline import Documento
+from nfse.state import RegistroDocumento
+from nfse.storage import Armazenamento, ler_xml
+
+XML = b"<r><dhEmi>2024-05-01T00:00:00</dhEmi></r>"
+
+
+def _doc(chave: str, xml: bytes = XML) -> Documento:
+    return Documento(1, chave, b"", "2024", "05", gzip_bytes=gzip.compress(xml))
+
+
+def test_gzip_format_writes_payload_as_received(tmp_path):
+    cfg = Config(output_dir=str(tmp_path), output_format="gzip")
+    doc = _doc("k1")
+    g = Armazenamento(cfg).gravar(doc)
+    assert g.caminho.endswith("NFS-e_2024-05_k1.xml.gz")
+    assert g.acao == "salvo" and g.nbytes == len(doc.gzip_bytes)
+    assert Path(g.caminho).read_bytes() == doc.gzip_bytes
+    assert g.sha256 == hashlib.sha256(doc.gzip_bytes).hexdigest()
+    assert ler_xml(g.caminho) == XML
+
+
+def test_mensal_format_appends_to_monthly_archive(tmp_path):
+    cfg = Config(output_dir=str(tmp_path), output_format="mensal")
+    arm = Armazenamento(cfg)
+    c1 = arm.gravar(_doc("k1")).caminho
+    c2 = arm.gravar(_doc("k2", b"<r>2</r>")).caminho
+    arm.close()
+    # A new instance appends to the existing archive and sees old members.
+    arm = Armazenamento(cfg)
+    g3 = arm.gravar(_doc("k1", b"<r>novo</r>"))
+    # The same payload as recorded in the state store is not appended again.
+    g4 = arm.gravar(_doc("k1", b"<r>novo</r>"), RegistroDocumento(1, "k1", "x", g3.caminho, g3.sha256))
+    arm.close()
+
+    assert c1 == g3.caminho and g3.acao == "substituído"
+    assert g4.acao == "inalterado" and g4.nbytes == 0
+    assert list(tmp_path.iterdir()) == [tmp_path / "NFS-e_2024-05.tar"]
+    assert ler_xml(c2) == b"<r>2</r>"
+    assert ler_xml(c1) == b"<r>novo</r>"
+    # Closing dropped the stale copy of k1.
+    with tarfile.open(tmp_path / "NFS-e_2024-05.tar") as tar:
+        assert tar.getnames() == ["NFS-e_2024-05_k1.xml.gz", "NFS-e_2024-05_k2.xml.gz"]
+
+
+@pytest.mark.parametrize("corte", [0, 300, 600])
+def test_mensal_archive_reopens_after_a_torn_append(tmp_path, corte):
+    cfg = Config(output_dir=str(tmp_path), output_format="mensal")
+    arm = Armazenamento(cfg)
+    c1 = arm.gravar(_doc("k1")).caminho
+    arm.sincronizar()
+    arquivo = tmp_path / "NFS-e_2024-05.tar"
+    inteiro = arquivo.stat().st_size
+    # The process dies while appending k2: only part of it reaches the disk.
+    arm.gravar(_doc("k2", os.urandom(2000)))
+    arm._arquivos[str(arquivo)][0].fileobj.close()
+    with open(arquivo, "rb+") as f:
+        f.truncate(inteiro - 1024 + corte)
+
+    arm = Armazenamento(cfg)
+    c3 = arm.gravar(_doc("k3", b"<r>3</r>")).caminho
+    arm.close()
+    with tarfile.open(arquivo) as tar:
+        assert tar.getnames() == ["NFS-e_2024-05_k1.xml.gz", "NFS-e_2024-05_k3.xml.gz"]
+    assert ler_xml(c1) == XML and ler_xml(c3) == b"<r>3</r>"
+
+
+def test_xml_format_and_unknown_format(tmp_path):
+    cfg = Config(output_dir=str(tmp_path))
+    caminho = Armazenamento(cfg).gravar(Documento(1, "k", XML, "2024", "05")).caminho
+    assert caminho.endswith(".xml") and ler_xml(caminho) == XML
+    with pytest.raises(ValueError):
+        Armazenamento(Config(output_format="zip"))
+
+
+def test_identical_content_is_not_rewritten(tmp_path):
+    arm = Armazenamento(Config(output_dir=str(tmp_path)))
+    doc = Documento(1, "k", XML, "2024", "05")
+    g = arm.gravar(doc)
+    os.utime(g.caminho, (0, 0))
+
+    # Without a state row the existing file is hashed.
+    assert arm.gravar(doc).acao == "inalterado"
+    anterior = RegistroDocumento(1, "k", "salvo", g.caminho, g.sha256)
+    assert arm.gravar(doc, anterior).acao == "inalterado"
+    assert os.stat(g.caminho).st_mtime == 0
+
+    g2 = arm.gravar(Documento(1, "k", b"<r>outro</r>", "2024", "05"), anterior)
+    assert g2.acao == "substituído" and Path(g.caminho).read_bytes() == b"<r>outro</r>"
+
+
+def test_failed_write_keeps_previous_file(tmp_path, monkeypatch):
+    arm = Armazenamento(Config(output_dir=str(tmp_path)))
+    caminho = arm.gravar(Documento(1, "k", XML, "2024", "05")).caminho
+
+    def falhar(origem, destino):
+        raise OSError("disco cheio")
+
+    monkeypatch.setattr(os, "replace", falhar)
+    with pytest.raises(OSError):
+        arm.gravar(Documento(1, "k", b"<r>novo</r>", "2024", "05"))
+    assert Path(caminho).read_bytes() == XML
+    assert [p.name for p in tmp_path.iterdir()] == [Path(caminho).name]
+
+
+def test_sincronizar_fsyncs_each_page_once(tmp_path, monkeypatch):
+    arm = Armazenamento(Config(output_dir=str(tmp_path)))
+    for chave in ("a", "b", "c"):
+        arm.gravar(Documento(1, chave, XML, "2024", "05"))
+    chamadas = []
+    monkeypatch.setattr(os, "fsync", lambda fd: chamadas.append(fd))
+
+    arm.sincronizar()
+    esperado = 3 + (1 if hasattr(os, "O_DIRECTORY") else 0)
+    assert len(chamadas) == esperado
+    arm.sincronizar()
+    assert len(chamadas) == esperado
+
+
+def test_layout_spreads_files_in_subdirectories(tmp_path):
+    cfg = Config(cnpj="123", output_dir=str(tmp_path), output_layout="{cnpj}/{ano}/{mes}")
+    arm = Armazenamento(cfg)
+    g = arm.gravar(Documento(1, "k", XML, "2024", "05"))
+    assert g.caminho == str(tmp_path / "123" / "2024" / "05" / "NFS-e_2024-05_k.xml")
+    assert arm.diretorio("2024", "05") == str(tmp_path / "123" / "2024" / "05")
+    arm.sincronizar()
+
+    for invalido in ("{cnpj}/{dia}", "../{ano}", "/abs/{ano}"):
+        with pytest.raises(ValueError):
+            Armazenamento(Config(output_layout=invalido))
+
+
+@pytest.mark.parametrize("formato", ["xml", "gzip", "mensal"])
+def test_spooled_documents_match_in_memory_decode(tmp_path, monkeypatch, formato):
+    import base64
+    import random
+
+    from benchmarks.corpus import nfse_xml
+    from nfse import decodificacao
+
+    monkeypatch.setattr(decodificacao, "BLOCO_BASE64", 64)
+    xml = nfse_xml(random.Random(7), "k", 2023, 11)
+    arquivo = base64.b64encode(gzip.compress(xml)).decode()
+    comprimido = formato != "xml"
+    (em_memoria,) = decodificacao.decodificar_lote([(1, "k", arquivo)], comprimido, True, "")
+    spool = decodificacao.decodificar_em_arquivo(1, "k", arquivo, str(tmp_path), comprimido, True)
+
+    assert (spool.ano, spool.mes, spool.campos) == ("2023", "11", em_memoria.campos)
+    with open(spool.arquivo, "rb") as f:
+        gravado = f.read()
+    assert gravado == (em_memoria.gzip_bytes if comprimido else xml)
+    assert spool.sha256 == hashlib.sha256(gravado).hexdigest() and spool.tamanho == len(gravado)
+
+    cfg = Config(output_dir=str(tmp_path), output_format=formato)
+    arm = Armazenamento(cfg)
+    g = arm.gravar(spool)
+    assert g.sha256 == spool.sha256 and ler_xml(g.caminho) == xml
+    anterior = RegistroDocumento(1, "k", "salvo", g.caminho, g.sha256)
+    outro = decodificacao.decodificar_em_arquivo(1, "k", arquivo, str(tmp_path), comprimido)
+    assert arm.gravar(outro, anterior).acao == "inalterado"
+    arm.close()
+    assert not any(p.name.endswith(".tmp") for p in tmp_path.iterdir())
@@ -0,0 +1,80 @@
+import socket
+import ssl
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from benchmarks.mock_portal import MockPortal
+from nfse import transport
+from nfse.config import Config
+from nfse.metrics import Metricas
+
+
+@pytest.fixture
+def requests_real(monkeypatch):
+    # Other test modules may have left a stub in sys.modules.
+    if not hasattr(sys.modules.get("requests"), "Session"):
+        monkeypatch.delitem(sys.modules, "requests", raising=False)
+    return pytest.importorskip("requests")
+
+
+def test_pool_sizes_per_host():
+    cfg = Config(pdf_workers=3)
+    assert transport.tamanhos_pool(cfg, 2) == {
+        "https://adn.nfse.gov.br/": 2,
+        "https://sefin.nfse.gov.br/": 8,
+    }
+    cfg = Config(dfe_url="http://127.0.0.1:8000/dfe", danfse_url="http://127.0.0.1:8000/pdf")
+    assert transport.tamanhos_pool(cfg) == {"http://127.0.0.1:8000/": 6}
+    assert transport.tamanhos_pool(Config(http_pool_size=3)) == {
+        "https://adn.nfse.gov.br/": 3,
+        "https://sefin.nfse.gov.br/": 3,
+    }
+
+
+def test_keepalive_socket_options():
+    assert (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1) in transport.opcoes_socket(60)
+    assert (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1) not in transport.opcoes_socket(0)
+
+
+def test_session_reuses_connections_and_counts_them(requests_real):
+    metricas = Metricas()
+    with MockPortal(docs=40, pagina=10, pdf_kib=1) as portal:
+        cfg = Config(dfe_url=portal.dfe_url, danfse_url=portal.danfse_url, pdf_workers=3)
+        sess = transport.criar_sessao(ssl.create_default_context(), cfg, metricas)
+        try:
+            assert sess.get_adapter(portal.dfe_url)._pool_maxsize == 5
+            for nsu in (0, 10, 20, 30):
+                resp = sess.get(f"{portal.dfe_url}/{nsu:020d}?cnpj=1", timeout=5, stream=True)
+                resp.content
+                resp.close()
+
+            def pdf(i):
+                resp = sess.get(f"{portal.danfse_url}/{i}", timeout=5, stream=True)
+                resp.content
+                resp.close()
+
+            with ThreadPoolExecutor(3) as pool:
+                list(pool.map(pdf, range(30)))
+        finally:
+            sess.close()
+
+    est = sess.transporte.estatisticas["127.0.0.1"]
+    assert est.requisicoes == 34
+    assert 1 <= est.conexoes <= 5
+    assert est.reutilizadas == 34 - est.conexoes
+    amostras = metricas.amostras()
+    assert amostras['nfse_http_requisicoes_total{host="127.0.0.1"}'] == 34
+    assert amostras['nfse_http_conexoes_total{host="127.0.0.1"}'] == est.conexoes
+    assert "reutilizadas" in sess.transporte.resumo()
+
+
+def test_http2_requires_httpx(monkeypatch):
+    monkeypatch.setitem(sys.modules, "httpx", None)
+    tr = transport.Transporte(ssl.create_default_context(), Config(http2=True))
+    with pytest.raises(RuntimeError, match="httpx"):
+        tr.sessao()